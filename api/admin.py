@@ -2,10 +2,12 @@ from django.contrib import admin
 # Register your models here.
 from django.contrib.auth.models import User
 
-from api.models import Silo, Sensor, Measurement, Notification
+from api.models import Silo, SiloGeometry, Sensor, Measurement, Notification, OutgoingNotification
 
 admin.site.register(Silo)
+admin.site.register(SiloGeometry)
 admin.site.register(Notification)
+admin.site.register(OutgoingNotification)
 
 
 @admin.register(Measurement)
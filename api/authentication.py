@@ -0,0 +1,35 @@
+from django.conf import settings
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from api import caching
+
+# users by their token, cached per process, see `CachedTokenAuthentication`
+token_cache = caching.LocalCache('TOKEN_CACHE_TTL', 300, 'TOKEN_CACHE_SIZE', 10000)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    '''
+    Token authentication which remembers the user of every valid token, so gateways sending measurements every
+    few seconds don't look up their token on every request. Changing or deleting a token or a user invalidates
+    the cache of the process doing it, other processes accept a deleted token until it expires after
+    `TOKEN_CACHE_TTL` seconds. Invalid tokens are never cached.
+    '''
+
+    def authenticate_credentials(self, key):
+        return token_cache.get(key, lambda: super(CachedTokenAuthentication, self).authenticate_credentials(key))
+
+
+@receiver(post_save, sender=Token)
+@receiver(post_delete, sender=Token)
+def invalidate_token(sender, instance=None, **kwargs):
+    token_cache.pop(instance.key)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def clear_token_cache(sender, **kwargs):
+    # e.g. a deactivated user, whose tokens are not known here without a query
+    token_cache.clear()
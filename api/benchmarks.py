@@ -0,0 +1,147 @@
+'''
+Timings and query counts of the main endpoints on synthetic fleets of growing size, so the results of different
+commits can be compared
+'''
+import statistics
+import subprocess
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from api import serializers
+from api.fleet import generate_fleet
+from api.geometry import silo_cache
+from api.models import Measurement, Silo
+
+BULK_SIZE = 100
+SERIALIZED_ROWS = 10000
+TIMESPANS = ('hour', 'day', 'week', 'month')
+
+
+def scenarios(silo):
+    '''
+    :return: (name, method, url, data) of every benchmarked request
+    '''
+    yield 'silo_list', 'get', '/silo/', None
+    yield 'measurement_list', 'get', '/measurement/?page_size=1000', None
+    for timespan in TIMESPANS:
+        yield f'graph_{timespan}', 'get', f'/measurement/graph/{silo.id}/{timespan}/', None
+    yield 'all_values', 'get', f'/measurement/all/{silo.id}/', None
+    yield 'csv_export', 'get', f'/measurement/export/{silo.id}/month/', None
+    yield 'create', 'post', '/measurement/', {"sensor": silo.sensor_id, "value": 3000}
+    yield 'create_bulk', 'post', '/measurement/bulk/', [{"sensor": silo.sensor_id, "value": 3000}] * BULK_SIZE
+
+
+def measure(client, method, url, data=None, repeat=5):
+    '''
+    Send the request `repeat` times with an empty response cache
+    :return: query count of the last request, response size and latencies in milliseconds
+    '''
+    timings = []
+    for _ in range(repeat):
+        caches[getattr(settings, 'RESPONSE_CACHE', 'default')].clear()
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = getattr(client, method)(url, data, format='json', secure=True)
+            # streamed responses only run their queries while they are consumed
+            content = b''.join(response.streaming_content) if response.streaming else response.content
+            timings.append((time.perf_counter() - started) * 1000)
+        if response.status_code >= 400:
+            raise RuntimeError(f'{method.upper()} {url} failed with {response.status_code}: {content[:200]}')
+    return {
+        "queries": len(queries),
+        "bytes": len(content),
+        "median_ms": round(statistics.median(timings), 2),
+        "min_ms": round(min(timings), 2),
+        "max_ms": round(max(timings), 2),
+    }
+
+
+def compare_serializers(serializer_class, values_serializer_class, queryset, repeat=5):
+    '''
+    Render the rows of the queryset to JSON with the DRF serializer and with its `values()` counterpart
+    :return: row count and median latencies in milliseconds, including the queries
+    '''
+    def drf():
+        return JSONRenderer().render(serializer_class(queryset.all(), many=True).data)
+
+    def values():
+        values_serializer = values_serializer_class(serializer_class())
+        return JSONRenderer().render(values_serializer.serialize(values_serializer.values(queryset.all())))
+
+    timings = {drf: [], values: []}
+    for _ in range(repeat):
+        for render in timings:
+            started = time.perf_counter()
+            content = render()
+            timings[render].append((time.perf_counter() - started) * 1000)
+    if drf() != values():
+        raise RuntimeError(f'{values_serializer_class.__name__} does not render like {serializer_class.__name__}')
+    return {
+        "rows": queryset.count(),
+        "drf_median_ms": round(statistics.median(timings[drf]), 2),
+        "values_median_ms": round(statistics.median(timings[values]), 2),
+        "bytes": len(content),
+    }
+
+
+def current_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                              check=True, cwd=settings.BASE_DIR).stdout.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes, silos=10, users=2, interval=15, repeat=5, log=None):
+    '''
+    Benchmark every scenario on a fleet with `days` days of readings for every size. Each fleet is generated in
+    a transaction which is rolled back afterwards, so the database is left as it was.
+    :param sizes: numbers of days of readings per silo
+    :return: results which can be written as JSON
+    '''
+    log = log or (lambda message: None)
+    results = []
+    for days in sizes:
+        with transaction.atomic():
+            started = time.perf_counter()
+            fleet = generate_fleet(users=users, silos=silos, days=days, interval=interval, seed=int(days))
+            log(f'Generated {days} days of readings of {silos} silos in {time.perf_counter() - started:.1f} s')
+
+            silo = fleet[0]
+            client = APIClient()
+            client.force_authenticate(silo.sensor.user)
+            result = {"days": days, "measurements": Measurement.objects.count(), "scenarios": {}}
+            result["serializers"] = {
+                "silo_list": compare_serializers(serializers.SiloSerializer, serializers.SiloValuesSerializer,
+                                                 Silo.objects.select_related('sensor', 'snapshot'), repeat),
+                "measurement_list": compare_serializers(
+                    serializers.MeasurementSerializer, serializers.ValuesSerializer,
+                    Measurement.objects.select_related('geometry').order_by('-saved', '-id')[:SERIALIZED_ROWS],
+                    repeat),
+            }
+            log(f'{days} days, serializers: {result["serializers"]}')
+            for name, method, url, data in scenarios(silo):
+                result["scenarios"][name] = measure(client, method, url, data, repeat)
+                log(f'{days} days, {name}: {result["scenarios"][name]}')
+            results.append(result)
+            transaction.set_rollback(True)
+        # the ids of the rolled back silos may be reused
+        silo_cache.clear()
+
+    return {
+        "commit": current_commit(),
+        "database": connection.vendor,
+        "created": timezone.now().isoformat(),
+        "silos": silos,
+        "users": users,
+        "interval": interval,
+        "repeat": repeat,
+        "results": results,
+    }
@@ -0,0 +1,142 @@
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse, HttpResponseNotModified
+
+SILO_LIST = 'list'
+
+
+def _cache():
+    return caches[getattr(settings, 'RESPONSE_CACHE', 'default')]
+
+
+def _version_key(name):
+    return f'response-version:{name}'
+
+
+def _versions(names):
+    '''
+    Current version token of every name, a missing token (never set or evicted) is created
+    '''
+    cache = _cache()
+    keys = [_version_key(name) for name in names]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            version = uuid.uuid4().hex
+            # another process might have created the token in the meantime
+            if not cache.add(key, version, None):
+                version = cache.get(key, version)
+            versions[key] = version
+    return [versions[key] for key in keys]
+
+
+def invalidate_silos(silo_ids):
+    '''
+    Drop the cached responses depending on the given silos and the cached silo lists
+    '''
+    _cache().set_many({_version_key(name): uuid.uuid4().hex for name in list(silo_ids) + [SILO_LIST]}, None)
+
+
+def user_scope(user):
+    return 'all' if user.is_superuser else f'user-{user.id}'
+
+
+def _etag_matches(request, etag):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    # weak comparison, as the content is the same for equal tags
+    return '*' in tags or etag in [tag[2:] if tag.startswith('W/') else tag for tag in tags]
+
+
+def cached_response(request, key, depends_on, render):
+    '''
+    Answer the request from the cache. The ETag is derived from the versions of what the response depends on,
+    so a client sending it back gets a 304 without any database query, until one of the dependencies changes
+    or the cache timeout passes (responses relative to the current time slowly change without new data).
+    :param request: the request, for the `If-None-Match` header
+    :param key: tuple identifying the response, including everything it depends on besides the dependencies
+    :param depends_on: names (silo ids or `SILO_LIST`) whose invalidation invalidates the response
+    :param render: function returning the JSON content if it is not cached
+    :return: response with ETag
+    '''
+    timeout = getattr(settings, 'RESPONSE_CACHE_TIMEOUT', 60)
+    time_slot = int(time.time() // timeout)
+    fingerprint = '|'.join(str(part) for part in list(key) + _versions(depends_on) + [time_slot])
+    etag = '"' + hashlib.md5(fingerprint.encode('utf-8')).hexdigest() + '"'
+
+    if _etag_matches(request, etag):
+        response = HttpResponseNotModified()
+    else:
+        cache = _cache()
+        content_key = f'response:{etag}'
+        content = cache.get(content_key)
+        if content is None:
+            content = render()
+            cache.set(content_key, content, timeout)
+        response = HttpResponse(content, content_type='application/json')
+
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+class LocalCache:
+    '''
+    Bounded cache in the memory of the process. Entries expire after a time to live, the least recently used
+    entries are dropped once there are too many. Both limits are read from the settings on every store, so they
+    can be changed at runtime.
+    '''
+
+    def __init__(self, ttl_setting, default_ttl, size_setting, default_size):
+        self.ttl_setting = ttl_setting
+        self.default_ttl = default_ttl
+        self.size_setting = size_setting
+        self.default_size = default_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # incremented by every invalidation, so a value loaded before it is not stored afterwards
+        self._generation = 0
+
+    def get(self, key, load):
+        '''
+        :param load: function returning the value if it is not cached, None is not cached
+        '''
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] >= now:
+                self._entries.move_to_end(key)
+                return entry[1]
+            generation = self._generation
+
+        value = load()
+        if value is None:
+            return value
+        with self._lock:
+            if generation == self._generation:
+                self._entries[key] = (now + getattr(settings, self.ttl_setting, self.default_ttl), value)
+                self._entries.move_to_end(key)
+                while len(self._entries) > getattr(settings, self.size_setting, self.default_size):
+                    self._entries.popitem(last=False)
+        return value
+
+    def pop(self, key):
+        with self._lock:
+            self._generation += 1
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
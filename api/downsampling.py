@@ -0,0 +1,104 @@
+'''
+Shape preserving downsampling of (saved, value) series in a single pass, so graphs of long ranges stay small
+without losing short dips like a silo being emptied
+'''
+import collections
+import itertools
+
+LTTB = 'lttb'
+MIN_MAX = 'minmax'
+ALGORITHMS = (LTTB, MIN_MAX)
+
+
+def _x(point):
+    return point[0].timestamp()
+
+
+def lttb(points, total, threshold):
+    '''
+    Largest-Triangle-Three-Buckets: splits the points into `threshold - 2` buckets and keeps the point of every
+    bucket spanning the largest triangle with the point kept before and the average of the next bucket.
+    Only two buckets are held in memory at a time.
+    :param points: iterable of (saved, value) ordered by saved
+    :param total: number of points, counted before reading them: if points were added or removed in the meantime,
+    the buckets are a bit off but the series still ends with its actual last point
+    :param threshold: number of points to keep, at least 3
+    :return: generator of the kept points
+    '''
+    points = iter(points)
+    if total <= threshold:
+        yield from points
+        return
+
+    selected = next(points, None)
+    if selected is None:
+        return
+    yield selected
+
+    def bucket_end(bucket):
+        # index (exclusive) of the last point of the bucket, the last point of all is never part of a bucket.
+        # computed in integers, as rounded fractions can end the last bucket before it
+        return min(1 + (bucket + 1) * (total - 2) // (threshold - 2), total - 1)
+
+    def read_bucket(bucket, start):
+        return list(itertools.islice(points, bucket_end(bucket) - start))
+
+    current = read_bucket(0, 1)
+    for bucket in range(threshold - 2):
+        if bucket + 1 < threshold - 2:
+            following = read_bucket(bucket + 1, bucket_end(bucket))
+        else:
+            # the last point, however many points there are left
+            following = list(collections.deque(points, maxlen=1))
+        if not current or not following:
+            # fewer points than counted
+            break
+        average_x = sum(_x(point) for point in following) / len(following)
+        average_y = sum(point[1] for point in following) / len(following)
+
+        selected_x, selected_y = _x(selected), selected[1]
+        selected = max(current, key=lambda point: abs(
+            (selected_x - average_x) * (point[1] - selected_y) - (selected_x - _x(point)) * (average_y - selected_y)))
+        yield selected
+        current = following
+
+    if current and current[-1] is not selected:
+        yield current[-1]
+
+
+def min_max(points, date_from, date_to, threshold):
+    '''
+    Splits the range into `threshold / 2` equally long buckets and keeps the lowest and the highest point
+    of every bucket, in the order they were measured
+    :param points: iterable of (saved, value) ordered by saved
+    :param date_from: start of the range
+    :param date_to: end of the range
+    :param threshold: maximal number of points to keep
+    :return: generator of the kept points
+    '''
+    buckets = max(threshold // 2, 1)
+    bucket_size = (date_to - date_from) / buckets
+
+    current_bucket = None
+    low = high = None
+    for point in points:
+        bucket = min(int((point[0] - date_from) / bucket_size), buckets - 1) if bucket_size else 0
+        if bucket != current_bucket:
+            if current_bucket is not None:
+                yield from _ordered(low, high)
+            current_bucket = bucket
+            low = high = point
+        else:
+            if point[1] < low[1]:
+                low = point
+            if point[1] > high[1]:
+                high = point
+
+    if current_bucket is not None:
+        yield from _ordered(low, high)
+
+
+def _ordered(low, high):
+    if low is high:
+        return [low]
+    return sorted((low, high), key=lambda point: point[0])
@@ -0,0 +1,86 @@
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # optional dependency, only needed for the columnar export
+    pyarrow = None
+
+from api.models import Measurement, Silo, SiloGeometry
+from api.retention import Readings
+
+PARQUET_BATCH_SIZE = 50000
+
+# dimensions of the silo, exported under the names they had when every measurement stored them
+GEOMETRY_COLUMNS = {
+    'capacity': 'capacity',
+    'radius': 'radius',
+    'silo_height': 'height',
+    'silo_width': 'width',
+    'silo_gap_top': 'gap_top',
+    'silo_gap_bottom': 'gap_bottom',
+}
+# exportable measurement fields mapped to their columns
+EXPORT_COLUMNS = dict({field.name: field.attname for field in Measurement._meta.concrete_fields
+                       if field.name != 'geometry'},
+                      **{column: f'geometry__{field}' for column, field in GEOMETRY_COLUMNS.items()})
+DEFAULT_PARQUET_COLUMNS = ['sensor', 'saved', 'value', 'distance', 'content', 'temperature', 'humidity', 'pressure']
+
+
+def _model_field(column):
+    if column in GEOMETRY_COLUMNS:
+        return SiloGeometry._meta.get_field(GEOMETRY_COLUMNS[column])
+    return Measurement._meta.get_field(column)
+
+
+def _arrow_type(field):
+    internal_type = field.get_internal_type()
+    if internal_type == 'FloatField':
+        return pyarrow.float64()
+    if internal_type == 'DateTimeField':
+        return pyarrow.timestamp('us', tz='UTC')
+    if internal_type == 'CharField':
+        return pyarrow.string()
+    return pyarrow.int64()
+
+
+def parquet_schema(columns):
+    return pyarrow.schema([pyarrow.field('silo', pyarrow.int64())] + [
+        pyarrow.field(column, _arrow_type(_model_field(column))) for column in columns])
+
+
+def write_measurements_parquet(where, silo_ids, date_from, date_to, columns=DEFAULT_PARQUET_COLUMNS,
+                               batch_size=PARQUET_BATCH_SIZE):
+    '''
+    Write the measurements of several silos into a Parquet file with typed columns. The rows of every fetch of a
+    chunked cursor are turned into columns and written as one record batch, so memory usage only depends on the
+    batch size.
+    Compacted measurements are exported as the last reading of every hour, with empty columns besides the
+    sensor, timestamp and value.
+    :param where: path or binary file object to write to
+    :param silo_ids: silos to export, the silo id is written in the first column
+    :param date_from: first saved timestamp to export
+    :param date_to: last saved timestamp to export
+    :param columns: names of the measurement fields to export
+    :param batch_size: number of rows fetched at once and written per record batch, a batch holds a single silo
+    :return: number of exported rows
+    '''
+    if pyarrow is None:
+        raise RuntimeError('pyarrow is required for exporting measurements as Parquet')
+
+    schema = parquet_schema(columns)
+    fields = [EXPORT_COLUMNS[column] for column in columns]
+    silos = Silo.objects.filter(id__in=silo_ids, sensor__isnull=False).select_related('sensor').order_by('id')
+
+    exported = 0
+    with pyarrow.parquet.ParquetWriter(where, schema) as writer:
+        for silo in silos:
+            for count, chunk in Readings(silo.sensor, date_from, date_to).column_chunks(fields, batch_size):
+                writer.write_table(_to_table(silo.id, count, chunk, schema))
+                exported += count
+    return exported
+
+
+def _to_table(silo_id, count, columns, schema):
+    # every column is converted into an arrow array at once, the silo column repeats the same id
+    arrays = [pyarrow.array([silo_id] * count, type=schema[0].type)] + [
+        pyarrow.array(column, type=field.type) for column, field in zip(columns, list(schema)[1:])]
+    return pyarrow.Table.from_arrays(arrays, schema=schema)
@@ -0,0 +1,72 @@
+'''
+Synthetic fleets of silos with years of measurements, for benchmarks and local development
+'''
+import numpy
+from django.contrib.auth.models import User
+from django.utils import timezone
+
+from api.geometry import FillCalculator
+from api.models import Measurement, MeasurementRollup, Sensor, Silo, SiloSnapshot
+
+BATCH_SIZE = 5000
+
+
+def _fill_levels(random, count, interval_hours):
+    '''
+    Fill percentages of a silo being emptied at a varying rate and refilled when it runs low
+    '''
+    levels = numpy.empty(count)
+    level = random.uniform(40, 95)
+    consumption = random.uniform(0.2, 1.5)
+    for index in range(count):
+        level -= consumption * interval_hours * random.uniform(0.5, 1.5)
+        if level < random.uniform(5, 20):
+            level = random.uniform(85, 98)
+            consumption = random.uniform(0.2, 1.5)
+        levels[index] = level
+    return levels + random.normal(0, 0.3, count)
+
+
+def generate_fleet(users=1, silos=10, sensors=None, days=365, interval=15, seed=0, end=None, batch_size=BATCH_SIZE,
+                   log=None):
+    '''
+    Create users, sensors and silos with one reading every `interval` minutes (with some jitter) for `days` days
+    up to `end`, inserted in bulk. The rollups and snapshots are built once all readings are stored.
+    :param users: number of farmers owning the silos
+    :param silos: number of silos, each with a sensor
+    :param sensors: number of sensors, the ones beyond the number of silos are not mounted in a silo
+    :return: the created silos
+    '''
+    random = numpy.random.RandomState(seed)
+    end = end or timezone.now()
+    log = log or (lambda message: None)
+    owners = [User.objects.create_user(username=f'fleet-farmer-{seed}-{index}', password='password')
+              for index in range(users)]
+    fleet_sensors = [Sensor.objects.create(serial_number=f'FLEET-{seed}-{index}', user=owners[index % users])
+                     for index in range(max(sensors or silos, silos))]
+    fleet_silos = [Silo.objects.create(name=f'Fleet silo {index}', sensor=sensor, location=f'Farm {index % users}',
+                                       height=round(random.uniform(6, 14), 1), width=round(random.uniform(2, 4), 1),
+                                       gap_top=0.5, gap_bottom=0.5)
+                   for index, sensor in enumerate(fleet_sensors[:silos])]
+
+    count = int(days * 24 * 60 / interval)
+    for silo in fleet_silos:
+        calculator = FillCalculator.for_silo(silo)
+        offsets = numpy.cumsum(random.uniform(0.9, 1.1, count) * interval)
+        timestamps = [end - timezone.timedelta(minutes=offset) for offset in offsets[::-1].tolist()]
+        distances = numpy.round((1 - _fill_levels(random, count, interval / 60) / 100) * calculator.usable_height *
+                                1000).tolist()
+        temperatures = numpy.round(random.normal(12, 6, count), 1).tolist()
+        humidities = numpy.round(random.uniform(30, 90, count), 1).tolist()
+        measurements = [Measurement(sensor=silo.sensor, saved=saved, temperature=temperature, humidity=humidity,
+                                    **fields)
+                        for saved, temperature, humidity, fields in zip(
+                            timestamps, temperatures, humidities, calculator.measurement_fields(distances))]
+        # sliced here as Django 2.2 doesn't limit an explicit batch size to what the database supports
+        for start in range(0, count, batch_size):
+            Measurement.objects.bulk_create(measurements[start:start + batch_size])
+
+        MeasurementRollup.rebuild(silo.sensor_id)
+        SiloSnapshot.rebuild(silo)
+        log(f'Generated {count} measurements of silo {silo.id}')
+    return fleet_silos
@@ -0,0 +1,156 @@
+from math import pi
+
+import numpy
+from django.db import IntegrityError, transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from api import caching
+from api.models import Sensor, Silo, SiloGeometry
+
+
+class FillCalculator:
+    '''
+    Converts distances measured by the sensor at the top of a cylindrical silo into fill percentages and contents,
+    for single distances or whole arrays of them at once
+    '''
+
+    def __init__(self, height, width, gap_top, gap_bottom, geometry=None):
+        self.height = height
+        self.width = width
+        self.gap_top = gap_top
+        self.gap_bottom = gap_bottom
+        self.radius = width / 2
+        self.area = pi * pow(self.radius, 2)
+        self.usable_height = height - gap_top - gap_bottom
+        self.capacity = self.area * self.usable_height
+        # the stored version of these dimensions which measurements reference
+        self.geometry = geometry
+
+    @classmethod
+    def for_silo(cls, silo):
+        '''
+        :return: calculator for the silo with its current geometry, or None if the silo has no valid dimensions
+        '''
+        if silo and silo.width is not None and silo.width > 0 and silo.height is not None and silo.height > 0:
+            calculator = cls(silo.height, silo.width, silo.gap_top, silo.gap_bottom)
+            calculator.geometry = calculator.current_geometry(silo)
+            return calculator
+        return None
+
+    def compute(self, distances):
+        '''
+        :param distances: distances from the sensor to the content in millimeters
+        :return: fill percentages and contents in cubic meters, rounded to two decimals
+        '''
+        distances = numpy.asarray(distances, dtype=numpy.float64)
+        content = self.area * (self.usable_height - distances / 1000)
+        percentage = content / self.capacity * 100
+        return numpy.round(percentage, 2), numpy.round(content, 2)
+
+    def geometry_fields(self):
+        '''
+        :return: the fields of a `SiloGeometry` describing these dimensions
+        '''
+        return {
+            "height": self.height,
+            "width": self.width,
+            "gap_top": self.gap_top,
+            "gap_bottom": self.gap_bottom,
+            "radius": self.radius,
+            "capacity": round(self.capacity, 2),
+        }
+
+    def current_geometry(self, silo):
+        '''
+        :return: the latest geometry version of the silo, a new version is stored if the dimensions changed
+        '''
+        fields = self.geometry_fields()
+        latest = SiloGeometry.objects.filter(silo=silo).order_by('-version').first()
+        if latest is not None and all(getattr(latest, field) == value for field, value in fields.items()):
+            return latest
+        try:
+            with transaction.atomic():
+                return SiloGeometry.objects.create(silo=silo, version=latest.version + 1 if latest else 1, **fields)
+        except IntegrityError:
+            # another process stored the new version in the meantime
+            return SiloGeometry.objects.filter(silo=silo).order_by('-version').first()
+
+    def measurement_fields(self, distances):
+        '''
+        :param distances: measured distances in millimeters
+        :return: the derived fields of a measurement for every distance
+        '''
+        percentages, contents = self.compute(distances)
+        return [dict(geometry=self.geometry, value=percentage, distance=distance, content=content)
+                for distance, percentage, content in zip(distances, percentages.tolist(), contents.tolist())]
+
+
+class _SiloCache:
+    '''
+    Sensors (with the id of their owner), the silos they are mounted in and their fill calculators, cached per
+    process so storing measurements doesn't have to query them. Saving or deleting a sensor or a silo invalidates
+    the cache of the process doing it, other processes see the change once their entries expire after
+    `SILO_CACHE_TTL` seconds. At most `SILO_CACHE_SIZE` sensors are kept.
+    '''
+
+    def __init__(self):
+        self._cache = caching.LocalCache('SILO_CACHE_TTL', 300, 'SILO_CACHE_SIZE', 10000)
+        self._serial_numbers = caching.LocalCache('SILO_CACHE_TTL', 300, 'SILO_CACHE_SIZE', 10000)
+
+    @staticmethod
+    def _load(sensor_id):
+        sensor = Sensor.objects.select_related('user').filter(id=sensor_id).first()
+        if sensor is None:
+            return None
+        silo = Silo.objects.filter(sensor_id=sensor_id).first()
+        return sensor, silo, FillCalculator.for_silo(silo)
+
+    def get(self, sensor_id):
+        '''
+        :return: the silo the sensor is mounted in and its fill calculator, both None if there is no silo
+        '''
+        entry = self._cache.get(sensor_id, lambda: self._load(sensor_id))
+        return (entry[1], entry[2]) if entry else (None, None)
+
+    def sensor(self, sensor_id):
+        '''
+        :return: the sensor, None if it doesn't exist
+        '''
+        entry = self._cache.get(sensor_id, lambda: self._load(sensor_id))
+        return entry[0] if entry else None
+
+    def sensor_by_serial_number(self, serial_number):
+        '''
+        :return: the sensor with the serial number, None if there is no or more than one such sensor
+        '''
+        def load():
+            sensor_ids = list(Sensor.objects.filter(serial_number=serial_number).values_list('id', flat=True)[:2])
+            return sensor_ids[0] if len(sensor_ids) == 1 else None
+        sensor_id = self._serial_numbers.get(serial_number, load)
+        return self.sensor(sensor_id) if sensor_id is not None else None
+
+    def invalidate(self, sensor_id):
+        self._cache.pop(sensor_id)
+        # the serial number might have changed, the previous one is not known here
+        self._serial_numbers.clear()
+
+    def clear(self):
+        self._cache.clear()
+        self._serial_numbers.clear()
+
+
+silo_cache = _SiloCache()
+
+
+@receiver(post_save, sender=Silo)
+@receiver(post_delete, sender=Silo)
+def clear_silo_cache(sender, **kwargs):
+    # the sensor of a silo may change as well, so the whole cache is cleared
+    silo_cache.clear()
+
+
+@receiver(post_save, sender=Sensor)
+@receiver(post_delete, sender=Sensor)
+def invalidate_sensor(sender, instance=None, **kwargs):
+    silo_cache.invalidate(instance.id)
@@ -0,0 +1,427 @@
+'''
+Storing new readings of sensors: fill levels, bulk insert, derived data and critical level notifications, shared
+by the measurement API and the sensor listener
+'''
+import atexit
+import fcntl
+import json
+import logging
+import os
+import threading
+import uuid
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import close_old_connections, connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from api import models, notifications
+from api.geometry import silo_cache
+from api.models import Measurement, SiloAlertState
+
+logger = logging.getLogger(__name__)
+
+BULK_CREATE_BATCH_SIZE = 500
+
+# `INGESTION_BUFFER` modes: readings are kept in memory only or also appended to a journal on disk
+MEMORY = 'memory'
+FILE = 'file'
+# `INGESTION_BUFFER_ACK` modes: requests are answered once their reading is accepted or once it is stored
+ACCEPTED = 'accepted'
+COMMITTED = 'committed'
+
+
+def send_notification(silo_name, level, topic):
+    # the push message is sent by the `send_notifications` worker, see `api.notifications`
+    notifications.enqueue(title=silo_name, body=f"The level is below {level}%", topic=topic)
+
+
+def check_critical_levels(silo, values, topic, notify=send_notification):
+    '''
+    Notify when the values drop below the critical levels of the silo and it wasn't notified already,
+    see `SiloAlertState.evaluate`
+    :param silo: silo the values were measured in
+    :param values: new values in the order they were measured
+    :param topic: push topic of the notifications
+    :param notify: function sending a notification, called with the name of the silo, the level and the topic
+    '''
+    with transaction.atomic():
+        # locked until the transaction ends, so concurrent ingestion for the silo (other workers, the listener,
+        # the ingestion buffer) evaluates the values one after the other instead of overwriting each other.
+        # `get_or_create` looks the state up again if another process created it concurrently.
+        state, _ = SiloAlertState.objects.select_for_update().get_or_create(silo_id=silo.id)
+        state.silo = silo
+
+        now = timezone.now()
+        for value in values:
+            level = state.evaluate(value, now)
+            if level is not None:
+                notify(silo.name, level, topic=topic)
+        state.save()
+
+
+def store_readings(readings, topic=None, notify=send_notification):
+    '''
+    Compute the fill levels of the readings, insert them at once with their derived data and check the critical
+    levels once per silo for its ordered readings
+    :param readings: fields of the measurements, `sensor` being the `Sensor`, modified in place
+    :param topic: push topic of the notifications, by default the username of the owner of the sensor
+    :param notify: see `check_critical_levels`
+    :return: the stored measurements
+    '''
+    sensors = {reading["sensor"].id: reading["sensor"] for reading in readings}
+    silos = {}
+    for sensor_id in sensors:
+        silo, calculator = silo_cache.get(sensor_id)
+        if silo:
+            silos[sensor_id] = silo
+        if calculator:
+            # the percentages of all readings of the sensor are computed at once
+            sensor_readings = [reading for reading in readings if reading["sensor"].id == sensor_id]
+            fields = calculator.measurement_fields([reading["value"] for reading in sensor_readings])
+            for reading, reading_fields in zip(sensor_readings, fields):
+                reading.update(reading_fields)
+    # inserted in the order they were received, so the ids of readings saved at the same time follow it
+    measurements = [Measurement(**reading) for reading in readings]
+
+    with transaction.atomic():
+        Measurement.objects.bulk_create(measurements, batch_size=BULK_CREATE_BATCH_SIZE)
+        models.update_derived_data(measurements)
+
+    for sensor_id, silo in silos.items():
+        values = [m.value for m in measurements if m.sensor_id == sensor_id]
+        owner = sensors[sensor_id].user
+        if values and (topic or owner):
+            check_critical_levels(silo, values, topic or owner.username, notify)
+    return measurements
+
+
+def store_buffered_readings(readings):
+    '''
+    Store readings of the ingestion buffer, which reference their sensor by id. Readings of sensors deleted in
+    the meantime are dropped.
+    :return: the stored measurement of every reading, None for the dropped ones
+    '''
+    resolved = {}
+    for index, reading in enumerate(readings):
+        sensor = silo_cache.sensor(reading["sensor"])
+        if sensor is None:
+            logger.warning('Dropped a reading of the deleted sensor %s', reading["sensor"])
+            continue
+        reading = dict(reading, sensor=sensor)
+        # readings replayed from the journal have their timestamps as strings
+        for field in ('saved', 'read'):
+            if isinstance(reading.get(field), str):
+                reading[field] = parse_datetime(reading[field])
+        resolved[index] = reading
+    measurements = dict(zip(resolved, store_readings(list(resolved.values())))) if resolved else {}
+    return [measurements.get(index) for index in range(len(readings))]
+
+
+class ReadingJournal:
+    '''
+    Readings which were accepted but are not stored yet, appended to files in a directory so they survive a crash
+    of the process. Each process appends to its own segment and keeps it locked until its readings are stored,
+    segments which are not locked belong to processes which are gone and are claimed by `recover`.
+    Appends are synced to disk in groups: a reading is durable once `sync` returned after appending it.
+    '''
+    SUFFIX = '.jsonl'
+
+    def __init__(self, directory, fsync=True):
+        '''
+        :param fsync: sync the segments to disk, without it readings only survive a crash of the process but not
+        one of the machine
+        '''
+        self.directory = directory
+        self.fsync = fsync
+        os.makedirs(directory, exist_ok=True)
+        self._sync_lock = threading.Lock()
+        self._appended = 0
+        self._synced = 0
+        self._rotated = 0
+        self._segment = self._open_segment()
+
+    def _open_segment(self):
+        segment = open(os.path.join(self.directory, f'{os.getpid()}-{uuid.uuid4().hex}{self.SUFFIX}'), 'a',
+                       encoding='utf-8')
+        fcntl.flock(segment, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return segment
+
+    def append(self, reading):
+        '''
+        Write the reading to the current segment, has to be serialized with `rotate` by the caller
+        :return: position to pass to `sync`
+        '''
+        self._segment.write(json.dumps(reading, cls=DjangoJSONEncoder) + '\n')
+        self._segment.flush()
+        self._appended += 1
+        return self._appended
+
+    def sync(self, position):
+        '''
+        Make sure the readings up to the position are on disk, one fsync covers all readings appended before it
+        '''
+        if not self.fsync:
+            return
+        with self._sync_lock:
+            if self._synced >= position:
+                return
+            appended = self._appended
+            os.fsync(self._segment.fileno())
+            self._synced = appended
+
+    def rotate(self):
+        '''
+        Continue in a new segment, has to be serialized with `append` by the caller
+        :return: the previous segment, locked until it is discarded
+        '''
+        with self._sync_lock:
+            segment, self._segment = self._segment, self._open_segment()
+            if self.fsync:
+                os.fsync(segment.fileno())
+            self._synced = self._rotated = self._appended
+        return segment
+
+    def discard(self, segment, failed=()):
+        '''
+        Remove a segment whose readings are stored, the ones which could not be stored are kept in `<name>.failed`
+        :param failed: readings of the segment which could not be stored
+        '''
+        if failed:
+            with open(f'{segment.name}.failed', 'w', encoding='utf-8') as failed_segment:
+                failed_segment.writelines(json.dumps(reading, cls=DjangoJSONEncoder) + '\n' for reading in failed)
+                failed_segment.flush()
+                if self.fsync:
+                    os.fsync(failed_segment.fileno())
+        os.remove(segment.name)
+        segment.close()
+
+    def recover(self):
+        '''
+        Claim the segments of processes which are gone
+        :return: the claimed segments, locked until they are discarded, with their readings
+        '''
+        for name in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, name)
+            if not name.endswith(self.SUFFIX) or path == self._segment.name:
+                continue
+            try:
+                segment = open(path, 'r', encoding='utf-8')
+            except FileNotFoundError:
+                continue
+            try:
+                fcntl.flock(segment, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                segment.close()
+                continue
+            if not os.path.exists(path):
+                # stored and removed by its process before the lock was taken
+                segment.close()
+                continue
+
+            readings = []
+            for line in segment:
+                try:
+                    readings.append(json.loads(line))
+                except ValueError:
+                    # the last line of a process which crashed while appending it
+                    logger.warning('Skipped an incomplete reading in %s', path)
+            yield segment, readings
+
+    def close(self):
+        # a segment with readings appended since the last rotation is left for `recover`
+        if self._appended == self._rotated:
+            os.remove(self._segment.name)
+        self._segment.close()
+
+
+class ReadingBuffer:
+    '''
+    Readings waiting to be stored, flushed by a background thread once `batch_size` readings are waiting or
+    `flush_interval` seconds passed, or right away for a caller waiting on its own (see `add`). All waiting
+    readings are stored in one transaction (group commit), so the cost of a commit is shared by all of them. With a
+    journal, the readings are appended to it before they are accepted. If the transaction fails, the readings are stored again in halves, so only the readings which can not
+    be stored are logged and dropped (and kept in a failed journal segment).
+    '''
+
+    def __init__(self, store, batch_size=500, flush_interval=1.0, journal=None):
+        '''
+        :param store: function storing a list of readings, e.g. `store_buffered_readings`. What it returns for every
+        reading (if it returns a list) is the result of the future of the reading.
+        :param journal: `ReadingJournal` for readings which have to survive a crash of the process
+        '''
+        self.store = store
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.journal = journal
+        self._readings = []
+        self._futures = []
+        self._storing = False
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._full = threading.Event()
+        self._closed = threading.Event()
+        self._thread = None
+
+    def add(self, reading, waits=False):
+        '''
+        :param waits: the caller waits until the reading is stored. If no other reading is waiting or being stored,
+        it stores its reading itself right away, as nothing could be grouped with it (e.g. in a single threaded
+        worker). The caller completing a batch stores it itself as well instead of waking the background thread.
+        :return: `concurrent.futures.Future` resolved once the reading is stored, failing if it could not be
+        '''
+        if self._closed.is_set():
+            raise RuntimeError('The reading buffer is closed')
+        future = Future()
+        with self._lock:
+            alone = not self._readings and not self._storing
+            position = self.journal.append(reading) if self.journal else None
+            self._readings.append(reading)
+            self._futures.append(future)
+            full = len(self._readings) >= self.batch_size
+        if position is not None:
+            self.journal.sync(position)
+        if waits and (full or alone):
+            self.flush()
+        elif full:
+            self._full.set()
+        return future
+
+    def __len__(self):
+        return len(self._readings)
+
+    def flush(self):
+        '''
+        Store all waiting readings in one transaction, inserted in chunks of `batch_size`
+        :return: number of stored readings
+        '''
+        with self._flush_lock:
+            with self._lock:
+                readings, futures = self._readings, self._futures
+                self._readings, self._futures = [], []
+                self._full.clear()
+                self._storing = bool(readings)
+                segment = self.journal.rotate() if self.journal and readings else None
+            if not readings:
+                return 0
+            results = self._store_isolating_failures(readings)
+            self._storing = False
+            failed = [reading for reading, result in zip(readings, results) if isinstance(result, Exception)]
+            if segment is not None:
+                self.journal.discard(segment, failed)
+            for future, result in zip(futures, results):
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+            return len(readings) - len(failed)
+
+    def _store(self, readings):
+        results = []
+        with transaction.atomic():
+            for start in range(0, len(readings), self.batch_size):
+                chunk = readings[start:start + self.batch_size]
+                stored = self.store(chunk)
+                results += stored if isinstance(stored, list) else [None] * len(chunk)
+        return results
+
+    def _store_isolating_failures(self, readings):
+        '''
+        Store the readings in one transaction, or if that fails each half in its own transaction and so on, so a
+        reading which can not be stored (e.g. of a sensor deleted in another process) doesn't drop the others
+        :return: what was stored for every reading (see `store`), or the error if it could not be stored
+        '''
+        try:
+            return self._store(readings)
+        except Exception as error:
+            if len(readings) == 1:
+                logger.error('Could not store the reading %s', readings[0], exc_info=error)
+                return [error]
+        middle = len(readings) // 2
+        return self._store_isolating_failures(readings[:middle]) + self._store_isolating_failures(readings[middle:])
+
+    def recover(self):
+        '''
+        Store the readings which processes using the same journal directory accepted but didn't store
+        :return: number of stored readings
+        '''
+        stored = 0
+        for segment, readings in self.journal.recover():
+            failed = [reading for reading, result in zip(readings, self._store_isolating_failures(readings))
+                      if isinstance(result, Exception)]
+            logger.info('Stored %d of the %d readings of %s', len(readings) - len(failed), len(readings),
+                        segment.name)
+            self.journal.discard(segment, failed)
+            stored += len(readings) - len(failed)
+        return stored
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='reading-buffer', daemon=True)
+        self._thread.start()
+
+    def close(self):
+        '''
+        Stop accepting readings and store the ones still waiting, then stop the background thread
+        '''
+        self._closed.set()
+        self._full.set()
+        if self._thread is not None:
+            self._thread.join()
+        else:
+            self.flush()
+        if self.journal is not None:
+            self.journal.close()
+
+    def _run(self):
+        try:
+            while not self._closed.is_set():
+                self._full.wait(self.flush_interval)
+                close_old_connections()
+                self.flush()
+            self.flush()
+        finally:
+            connection.close()
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_buffer():
+    '''
+    The write-behind buffer of `POST /measurement/` in this process, configured by the `INGESTION_BUFFER_*`
+    settings. It is started on first use, after storing what crashed processes left in the journal, and closed
+    when the process exits normally (e.g. on SIGTERM from gunicorn), storing the waiting readings.
+    :return: the buffer, None if `INGESTION_BUFFER` is not set
+    '''
+    global _buffer
+    mode = getattr(settings, 'INGESTION_BUFFER', None)
+    if not mode:
+        return None
+    with _buffer_lock:
+        if _buffer is None:
+            journal = None
+            if mode == FILE:
+                journal = ReadingJournal(settings.INGESTION_BUFFER_DIRECTORY, settings.INGESTION_BUFFER_FSYNC)
+            buffer = ReadingBuffer(store_buffered_readings, settings.INGESTION_BUFFER_ROWS,
+                                   settings.INGESTION_BUFFER_DELAY_MS / 1000, journal)
+            if journal is not None:
+                buffer.recover()
+            buffer.start()
+            atexit.register(close_buffer)
+            _buffer = buffer
+    return _buffer
+
+
+def close_buffer():
+    '''
+    Store the waiting readings and stop the buffer of the process, the next `get_buffer` starts a new one
+    '''
+    global _buffer
+    with _buffer_lock:
+        buffer, _buffer = _buffer, None
+    if buffer is not None:
+        atexit.unregister(close_buffer)
+        buffer.close()
@@ -0,0 +1,173 @@
+'''
+Listener for readings which sensors send with a compact line protocol over UDP or TCP instead of HTTPS requests
+to the API. Every line is one reading of the sensor with the serial number, its fields separated by whitespace:
+
+    <serial number> <distance> [<temperature> [<humidity> [<pressure> [<acc> [<sensor timestamp>]]]]]
+
+The distance is in millimeters like `value` of `POST /measurement/`. Readings are buffered and stored in
+micro-batches like the ones of `POST /measurement/bulk/`, with the same fill computation and notifications.
+There is no authentication, the listener must only be reachable by the sensors.
+'''
+import asyncio
+import logging
+import math
+import signal
+
+from django.utils import timezone
+
+from api import ingestion
+from api.geometry import silo_cache
+from api.models import Measurement
+
+logger = logging.getLogger(__name__)
+
+FIELDS = ('value', 'temperature', 'humidity', 'pressure', 'acc', 'sensor_timestamp')
+NUMBER_FIELDS = ('value', 'temperature', 'humidity', 'pressure')
+# a TCP connection sending longer lines is closed
+MAX_LINE_LENGTH = 1024
+
+
+def parse_reading(line):
+    '''
+    :param line: line of the protocol, without the line break
+    :return: the serial number and the measurement fields of the reading
+    :raise ValueError: if the line is not a valid reading
+    '''
+    parts = line.split()
+    if not 2 <= len(parts) <= len(FIELDS) + 1:
+        raise ValueError(f'expected 2 to {len(FIELDS) + 1} fields, got {len(parts)}')
+
+    reading = {}
+    for field, value in zip(FIELDS, parts[1:]):
+        if field in NUMBER_FIELDS:
+            reading[field] = float(value)
+            if not math.isfinite(reading[field]):
+                raise ValueError(f'{field} has to be a finite number')
+        else:
+            max_length = Measurement._meta.get_field(field).max_length
+            if len(value) > max_length:
+                raise ValueError(f'{field} is longer than {max_length} characters')
+            reading[field] = value
+    return parts[0], reading
+
+
+def store_sensor_readings(readings):
+    '''
+    Store buffered readings, identifying their sensors by the serial numbers. Readings of unknown sensors are
+    dropped.
+    :param readings: measurement fields with the `serial_number` of the sensor
+    '''
+    unknown_serial_numbers = set()
+    resolved = []
+    for reading in readings:
+        reading = dict(reading)
+        serial_number = reading.pop('serial_number')
+        sensor = silo_cache.sensor_by_serial_number(serial_number)
+        if sensor is None:
+            unknown_serial_numbers.add(serial_number)
+        else:
+            resolved.append(dict(reading, sensor=sensor))
+
+    if unknown_serial_numbers:
+        logger.warning('Dropped the readings of unknown or ambiguous sensors %s', ', '.join(
+            sorted(unknown_serial_numbers)))
+    if resolved:
+        ingestion.store_readings(resolved)
+
+
+class SensorListener:
+    '''
+    Parses the received lines into the buffer, see `serve` for the network part
+    '''
+
+    def __init__(self, buffer):
+        '''
+        :param buffer: `ingestion.ReadingBuffer` storing the readings with `store_sensor_readings`
+        '''
+        self.buffer = buffer
+
+    def receive_line(self, line):
+        '''
+        :return: error message if the line is not a valid reading, None if it was buffered
+        '''
+        try:
+            serial_number, reading = parse_reading(line.decode('utf-8'))
+        except (UnicodeDecodeError, ValueError) as error:
+            return str(error)
+        self.buffer.add(dict(reading, serial_number=serial_number, saved=timezone.now()))
+        return None
+
+
+class _DatagramProtocol(asyncio.DatagramProtocol):
+    # every datagram contains one or more lines, invalid lines are logged as there is no answer
+
+    def __init__(self, listener):
+        self.listener = listener
+
+    def datagram_received(self, data, address):
+        for line in data.splitlines():
+            if line.strip():
+                error = self.listener.receive_line(line)
+                if error is not None:
+                    logger.warning('Invalid reading from %s: %s', address[0], error)
+
+
+class _StreamProtocol(asyncio.Protocol):
+    # every line is answered with `OK` once buffered or `ERR <reason>`
+
+    def __init__(self, listener):
+        self.listener = listener
+        self.transport = None
+        self.pending = b''
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        lines = (self.pending + data).split(b'\n')
+        self.pending = lines.pop()
+        if len(self.pending) > MAX_LINE_LENGTH:
+            self.transport.write(b'ERR line too long\n')
+            self.transport.close()
+            return
+        for line in lines:
+            if line.strip():
+                error = self.listener.receive_line(line.rstrip(b'\r'))
+                self.transport.write(b'OK\n' if error is None else f'ERR {error}\n'.encode('utf-8'))
+
+
+async def serve(listener, host, udp_port=None, tcp_port=None, stop=None, started=None):
+    '''
+    Listen until `stop` is set (by SIGINT or SIGTERM by default), then store the buffered readings
+    :param stop: `asyncio.Event` ending the listener
+    :param started: function called with the bound UDP and TCP addresses (None if not listening) once listening
+    '''
+    loop = asyncio.get_event_loop()
+    if stop is None:
+        stop = asyncio.Event()
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signal_number, stop.set)
+
+    datagram_transport = server = None
+    if udp_port is not None:
+        datagram_transport, _ = await loop.create_datagram_endpoint(lambda: _DatagramProtocol(listener),
+                                                                    local_addr=(host, udp_port))
+        logger.info('Listening for readings on UDP %s:%s', host, udp_port)
+    if tcp_port is not None:
+        server = await loop.create_server(lambda: _StreamProtocol(listener), host, tcp_port)
+        logger.info('Listening for readings on TCP %s:%s', host, tcp_port)
+
+    listener.buffer.start()
+    if started is not None:
+        started(datagram_transport and datagram_transport.get_extra_info('sockname'),
+                server and server.sockets[0].getsockname())
+    try:
+        await stop.wait()
+    finally:
+        if datagram_transport is not None:
+            datagram_transport.close()
+        if server is not None:
+            server.close()
+            await server.wait_closed()
+        # the readings received until now are stored before returning
+        await loop.run_in_executor(None, listener.buffer.close)
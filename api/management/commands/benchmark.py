@@ -0,0 +1,42 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from api import benchmarks
+
+
+class Command(BaseCommand):
+    help = 'Time and count the queries of the main endpoints on synthetic fleets of increasing size. ' \
+           'Runs on a separate test database and writes the results as JSON.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', default='7,90,365',
+                            help='Comma separated days of readings per silo to benchmark (default: 7,90,365)')
+        parser.add_argument('--silos', type=int, default=10, help='Number of silos (default: 10)')
+        parser.add_argument('--users', type=int, default=2, help='Number of farmers owning the silos (default: 2)')
+        parser.add_argument('--interval', type=float, default=15,
+                            help='Average number of minutes between two readings (default: 15)')
+        parser.add_argument('--repeat', type=int, default=5, help='Requests per scenario (default: 5)')
+        parser.add_argument('--output', help='File to write the results to (default: standard output)')
+        parser.add_argument('--keepdb', action='store_true', help='Keep the test database between runs')
+
+    def handle(self, *args, **options):
+        sizes = [float(days) for days in options['days'].split(',')]
+        setup_test_environment()
+        database_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=options['keepdb'])
+        try:
+            results = benchmarks.run(sizes, silos=options['silos'], users=options['users'],
+                                     interval=options['interval'], repeat=options['repeat'], log=self.stderr.write)
+        finally:
+            connection.creation.destroy_test_db(database_name, verbosity=0, keepdb=options['keepdb'])
+            teardown_test_environment()
+
+        output = json.dumps(results, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output)
+        else:
+            self.stdout.write(output)
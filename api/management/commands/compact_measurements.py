@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from api import retention
+from api.models import Silo
+
+
+class Command(BaseCommand):
+    help = 'Compact the raw measurements of silos with a retention policy (`raw_retention_days`) into hour and ' \
+           'day rollups once they are older than the retention. Meant to run as a scheduled job, an interrupted ' \
+           'run is continued by the next one.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--silo', type=int, action='append', dest='silos',
+                            help='Id of the silo to compact, can be repeated (default: all silos with a retention)')
+        parser.add_argument('--chunk-size', type=int, default=retention.DELETE_CHUNK_SIZE,
+                            help=f'Number of rows deleted per transaction (default: {retention.DELETE_CHUNK_SIZE})')
+
+    def handle(self, *args, **options):
+        silos = Silo.objects.filter(raw_retention_days__isnull=False, sensor__isnull=False).select_related(
+            'sensor').order_by('id')
+        if options['silos']:
+            silos = silos.filter(id__in=options['silos'])
+
+        for silo in silos:
+            deleted = retention.compact(silo.sensor, silo.raw_retention_days, options['chunk_size'])
+            self.stdout.write(f'Compacted silo {silo.id}: deleted {deleted} measurements saved before '
+                              f'{silo.sensor.compacted_until}')
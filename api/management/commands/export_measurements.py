@@ -0,0 +1,34 @@
+from dateutil import parser
+from django.core.management.base import BaseCommand, CommandError
+
+from api import exports
+
+
+class Command(BaseCommand):
+    help = 'Export the measurements of one or more silos into a Parquet file with typed columns'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='Path of the Parquet file to write')
+        parser.add_argument('--silo', type=int, action='append', dest='silos', required=True,
+                            help='Id of a silo to export, can be repeated')
+        parser.add_argument('--from', dest='date_from', required=True, help='First timestamp (ISO 8601)')
+        parser.add_argument('--to', dest='date_to', required=True, help='Last timestamp (ISO 8601)')
+        parser.add_argument('--columns', default=','.join(exports.DEFAULT_PARQUET_COLUMNS),
+                            help='Comma separated measurement fields to export')
+        parser.add_argument('--batch-size', type=int, default=exports.PARQUET_BATCH_SIZE,
+                            help='Number of rows per record batch')
+
+    def handle(self, *args, **options):
+        if exports.pyarrow is None:
+            raise CommandError('pyarrow has to be installed to export measurements as Parquet')
+
+        columns = options['columns'].split(',')
+        unknown_columns = [column for column in columns if column not in exports.EXPORT_COLUMNS]
+        if unknown_columns:
+            raise CommandError(f'Unknown columns: {", ".join(unknown_columns)}')
+
+        exported = exports.write_measurements_parquet(options['output'], options['silos'],
+                                                      parser.parse(options['date_from']),
+                                                      parser.parse(options['date_to']), columns,
+                                                      options['batch_size'])
+        self.stdout.write(f'Exported {exported} measurements to {options["output"]}')
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api import fleet
+
+
+class Command(BaseCommand):
+    help = 'Generate a synthetic fleet of silos with realistic readings, e.g. for local development or benchmarks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1, help='Number of farmers owning the silos (default: 1)')
+        parser.add_argument('--silos', type=int, default=10, help='Number of silos (default: 10)')
+        parser.add_argument('--sensors', type=int,
+                            help='Number of sensors, the ones beyond the number of silos are not mounted')
+        parser.add_argument('--years', type=float, default=1, help='Years of readings per silo (default: 1)')
+        parser.add_argument('--interval', type=float, default=15,
+                            help='Average number of minutes between two readings (default: 15)')
+        parser.add_argument('--seed', type=int, default=0, help='Seed of the random generator (default: 0)')
+        parser.add_argument('--batch-size', type=int, default=fleet.BATCH_SIZE,
+                            help=f'Number of measurements per insert (default: {fleet.BATCH_SIZE})')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            silos = fleet.generate_fleet(users=options['users'], silos=options['silos'], sensors=options['sensors'],
+                                         days=options['years'] * 365, interval=options['interval'],
+                                         seed=options['seed'], batch_size=options['batch_size'],
+                                         log=self.stdout.write)
+        self.stdout.write(f'Generated {len(silos)} silos')
@@ -0,0 +1,29 @@
+import asyncio
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api import ingestion, listener
+
+
+class Command(BaseCommand):
+    help = 'Receive the readings of sensors sent with the line protocol described in `api.listener` over UDP ' \
+           'and/or TCP and store them in micro-batches, until interrupted'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1', help='Address to listen on (default: 127.0.0.1)')
+        parser.add_argument('--udp-port', type=int, help='UDP port to listen on')
+        parser.add_argument('--tcp-port', type=int, help='TCP port to listen on')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of readings which are stored at once at most (default: 500)')
+        parser.add_argument('--flush-interval', type=float, default=1,
+                            help='Seconds readings wait at most before they are stored (default: 1)')
+
+    def handle(self, *args, **options):
+        if options['udp_port'] is None and options['tcp_port'] is None:
+            raise CommandError('At least one of --udp-port and --tcp-port is needed')
+
+        buffer = ingestion.ReadingBuffer(listener.store_sensor_readings, options['batch_size'],
+                                         options['flush_interval'])
+        asyncio.get_event_loop().run_until_complete(listener.serve(
+            listener.SensorListener(buffer), options['host'], options['udp_port'], options['tcp_port']))
+        self.stdout.write('Stopped listening, the received readings are stored')
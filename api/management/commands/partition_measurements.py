@@ -0,0 +1,159 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from api.models import Measurement
+
+PARTITION_NAME_FORMAT = '{table}_y{year:04d}m{month:02d}'
+
+
+def _add_months(year, month, months):
+    month_index = year * 12 + month - 1 + months
+    return month_index // 12, month_index % 12 + 1
+
+
+def _month_start(year, month):
+    return datetime(year, month, 1, tzinfo=timezone.utc)
+
+
+class Command(BaseCommand):
+    help = 'Manage the optional monthly partitioning of the measurement table (PostgreSQL only). ' \
+           'Creates partitions for the upcoming months and detaches partitions older than the retention.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--convert', action='store_true',
+                            help='Convert the measurement table into a table partitioned by month of `saved`. '
+                                 'Locks the table while the rows are copied, run it in a maintenance window.')
+        parser.add_argument('--months-ahead', type=int, default=3,
+                            help='Number of future months to create partitions for (default: 3)')
+        parser.add_argument('--detach-older-than', type=int, default=None, metavar='MONTHS',
+                            help='Detach partitions which only hold measurements older than the given '
+                                 'number of months. Detached partitions are kept as standalone tables.')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Partitioning of measurements is only supported on PostgreSQL')
+
+        self.table = Measurement._meta.db_table
+
+        with transaction.atomic():
+            if options['convert']:
+                self._convert()
+            elif not self._is_partitioned():
+                raise CommandError(f'Table {self.table} is not partitioned, run the command with --convert first')
+
+            self._create_partitions(options['months_ahead'])
+            if options['detach_older_than'] is not None:
+                self._detach_partitions(options['detach_older_than'])
+
+    def _execute(self, sql, params=None):
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            if cursor.description:
+                return cursor.fetchall()
+        return []
+
+    def _is_partitioned(self):
+        return bool(self._execute(
+            'SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid WHERE c.relname = %s',
+            [self.table]))
+
+    def _partitions(self):
+        '''
+        :return: names of the partitions currently attached to the measurement table
+        '''
+        rows = self._execute(
+            'SELECT child.relname FROM pg_inherits '
+            'JOIN pg_class parent ON parent.oid = pg_inherits.inhparent '
+            'JOIN pg_class child ON child.oid = pg_inherits.inhrelid '
+            'WHERE parent.relname = %s', [self.table])
+        return {row[0] for row in rows}
+
+    def _create_partition(self, year, month):
+        name = PARTITION_NAME_FORMAT.format(table=self.table, year=year, month=month)
+        quote = connection.ops.quote_name
+        self._execute(
+            f'CREATE TABLE IF NOT EXISTS {quote(name)} PARTITION OF {quote(self.table)} '
+            f'FOR VALUES FROM (%s) TO (%s)',
+            [_month_start(year, month), _month_start(*_add_months(year, month, 1))])
+        return name
+
+    def _create_partitions(self, months_ahead):
+        now = timezone.now()
+        existing = self._partitions()
+        for offset in range(months_ahead + 1):
+            year, month = _add_months(now.year, now.month, offset)
+            if PARTITION_NAME_FORMAT.format(table=self.table, year=year, month=month) not in existing:
+                self.stdout.write(f'Creating partition {self._create_partition(year, month)}')
+
+    def _detach_partitions(self, months):
+        now = timezone.now()
+        cutoff = _month_start(*_add_months(now.year, now.month, -months))
+        quote = connection.ops.quote_name
+        for name in sorted(self._partitions()):
+            try:
+                start = datetime.strptime(name[len(self.table):], '_y%Ym%m').replace(tzinfo=timezone.utc)
+            except ValueError:
+                continue  # not created by this command
+            end = _month_start(*_add_months(start.year, start.month, 1))
+            if end <= cutoff:
+                self._execute(f'ALTER TABLE {quote(self.table)} DETACH PARTITION {quote(name)}')
+                self.stdout.write(f'Detached partition {name}')
+
+    def _convert(self):
+        '''
+        Replace the measurement table with a table partitioned by range of `saved`, copying all the rows.
+        The primary key of a partitioned table has to include the partition key, so it becomes (id, saved).
+        '''
+        if self._is_partitioned():
+            raise CommandError(f'Table {self.table} is already partitioned')
+
+        quote = connection.ops.quote_name
+        table = quote(self.table)
+        legacy = quote(f'{self.table}_unpartitioned')
+
+        if self._execute(f'SELECT 1 FROM {table} WHERE saved IS NULL LIMIT 1'):
+            raise CommandError(f'Table {self.table} contains measurements without `saved` timestamp, '
+                               f'they can not be assigned to a partition')
+
+        self._execute(f'LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE')
+        (first_saved, last_saved), = self._execute(f'SELECT MIN(saved), MAX(saved) FROM {table}')
+        indexes = self._execute(
+            'SELECT indexname, indexdef FROM pg_indexes WHERE tablename = %s AND indexname NOT IN ('
+            'SELECT conname FROM pg_constraint WHERE contype IN (%s, %s))', [self.table, 'p', 'u'])
+        foreign_keys = self._execute(
+            'SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint '
+            'WHERE conrelid = %s::regclass AND contype = %s', [self.table, 'f'])
+
+        self._execute(f'ALTER TABLE {table} RENAME TO {legacy}')
+        self._execute(f'CREATE TABLE {table} (LIKE {legacy} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) '
+                      f'PARTITION BY RANGE (saved)')
+
+        # every row needs a partition, including the ones saved in the future (e.g. by a sensor with a wrong
+        # clock), the months after the current one are completed by `_create_partitions`
+        now = timezone.now()
+        year, month = (first_saved.year, first_saved.month) if first_saved else (now.year, now.month)
+        last = max((now.year, now.month), (last_saved.year, last_saved.month) if last_saved else (now.year, now.month))
+        while (year, month) <= last:
+            self._create_partition(year, month)
+            year, month = _add_months(year, month, 1)
+
+        self._execute(f'INSERT INTO {table} SELECT * FROM {legacy}')
+
+        # the id sequence belongs to the old table and would be dropped together with it
+        (sequence,), = self._execute('SELECT pg_get_serial_sequence(%s, %s)', [f'{self.table}_unpartitioned', 'id'])
+        if sequence:
+            self._execute(f'ALTER SEQUENCE {sequence} OWNED BY {table}.id')
+        self._execute(f'DROP TABLE {legacy}')
+
+        # constraints and indexes are recreated once the names are free again, the definitions were read before
+        # renaming the table so they already point to the new one
+        self._execute(f'ALTER TABLE {table} ADD PRIMARY KEY (id, saved)')
+        for name, definition in foreign_keys:
+            self._execute(f'ALTER TABLE {table} ADD CONSTRAINT {quote(name)} {definition}')
+        for name, definition in indexes:
+            self._execute(definition)
+
+        self.stdout.write(f'Converted {self.table} into a partitioned table')
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from api.models import MeasurementRollup, Sensor
+
+
+class Command(BaseCommand):
+    help = 'Recompute the minute, hour and day rollups of the measurements, ' \
+           'e.g. after changing measurements with bulk updates'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sensor', type=int, action='append', dest='sensors',
+                            help='Id of the sensor to rebuild, can be repeated (default: all sensors)')
+
+    def handle(self, *args, **options):
+        sensor_ids = options['sensors'] or Sensor.objects.order_by('id').values_list('id', flat=True)
+        for sensor_id in sensor_ids:
+            MeasurementRollup.rebuild(sensor_id)
+            self.stdout.write(f'Rebuilt rollups of sensor {sensor_id}')
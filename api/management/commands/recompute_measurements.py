@@ -0,0 +1,76 @@
+from dateutil import parser
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from api.geometry import FillCalculator
+from api.models import Measurement, MeasurementRollup, Silo, SiloSnapshot
+
+ROLLUP_WINDOW = timezone.timedelta(days=31)
+
+
+class Command(BaseCommand):
+    help = 'Recompute the fill percentage and content of stored measurements of a silo from their distance ' \
+           'with the current dimensions of the silo, e.g. after the height or gaps of the silo were corrected. ' \
+           'Only measurements which were computed with a silo geometry in the first place are updated.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('silo', type=int, help='Id of the silo')
+        parser.add_argument('--from', dest='date_from', help='First timestamp to recompute (ISO 8601)')
+        parser.add_argument('--to', dest='date_to', help='Last timestamp to recompute (ISO 8601)')
+        parser.add_argument('--chunk-size', type=int, default=5000,
+                            help='Number of measurements updated per transaction (default: 5000)')
+        parser.add_argument('--after-id', type=int, default=0,
+                            help='Resume after the measurement with this id, as printed by an interrupted run')
+
+    def handle(self, *args, **options):
+        silo = Silo.objects.filter(id=options['silo']).first()
+        if silo is None or silo.sensor_id is None:
+            raise CommandError(f'Silo {options["silo"]} does not exist or has no sensor')
+        calculator = FillCalculator.for_silo(silo)
+        if calculator is None:
+            raise CommandError(f'Silo {silo.id} has no valid dimensions')
+
+        date_from = parser.parse(options['date_from']) if options['date_from'] else None
+        date_to = parser.parse(options['date_to']) if options['date_to'] else None
+        measures = Measurement.objects.filter(sensor_id=silo.sensor_id, geometry__isnull=False)
+        if date_from:
+            measures = measures.filter(saved__gte=date_from)
+        if date_to:
+            measures = measures.filter(saved__lte=date_to)
+
+        total = measures.filter(id__gt=options['after_id']).count()
+        processed = 0
+        last_id = options['after_id']
+        fields = ['value', 'content', 'geometry']
+
+        while True:
+            # keyset pagination keeps every chunk as cheap as the first one
+            rows = list(measures.filter(id__gt=last_id).order_by('id').values_list('id', 'distance')[
+                        :options['chunk_size']])
+            if not rows:
+                break
+
+            ids, distances = zip(*rows)
+            updated = [Measurement(id=measurement_id, **measurement_fields) for measurement_id, measurement_fields in
+                       zip(ids, calculator.measurement_fields(distances))]
+            with transaction.atomic():
+                Measurement.objects.bulk_update(updated, fields, batch_size=options['chunk_size'])
+
+            processed += len(rows)
+            last_id = ids[-1]
+            self.stdout.write(f'Recomputed {processed}/{total} measurements (last id {last_id})')
+
+        self._refresh_aggregates(silo, measures, date_from, date_to)
+        self.stdout.write(f'Recomputed {processed} measurements of silo {silo.id}')
+
+    def _refresh_aggregates(self, silo, measures, date_from, date_to):
+        if date_from is None:
+            date_from = measures.order_by('saved').values_list('saved', flat=True).first()
+        if date_to is None:
+            date_to = timezone.now()
+        # the rollups are rebuilt in windows to keep the transactions short
+        while date_from is not None and date_from <= date_to:
+            MeasurementRollup.rebuild(silo.sensor_id, date_from, min(date_from + ROLLUP_WINDOW, date_to))
+            date_from += ROLLUP_WINDOW
+        SiloSnapshot.rebuild(silo)
@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api import notifications
+
+
+class Command(BaseCommand):
+    help = 'Send the queued push notifications, retrying failed ones with backoff'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Send the due notifications and exit')
+        parser.add_argument('--interval', type=float, default=2,
+                            help='Seconds to wait when there is nothing to send (default: 2)')
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Maximal number of notifications sent per batch (default: 100)')
+
+    def handle(self, *args, **options):
+        sender = notifications.get_sender()
+        while True:
+            sent, failed = notifications.dispatch_pending(sender, options['batch_size'])
+            if sent or failed:
+                self.stdout.write(f'Sent {sent} notifications, {failed} failed')
+            if options['once']:
+                return
+            if sent + failed < options['batch_size']:
+                time.sleep(options['interval'])
@@ -0,0 +1,224 @@
+'''
+Per endpoint request metrics kept in memory of the process: SQL query count, database time, render time,
+total latency and response size, aggregated into histograms
+'''
+import json
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+QUERIES = 'queries'
+DB_TIME = 'db_time_ms'
+RENDER_TIME = 'render_time_ms'
+LATENCY = 'latency_ms'
+SIZE = 'size_bytes'
+
+_TIME_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+BUCKETS = {
+    QUERIES: (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000),
+    DB_TIME: _TIME_BUCKETS,
+    RENDER_TIME: _TIME_BUCKETS,
+    LATENCY: _TIME_BUCKETS,
+    SIZE: (1000, 10000, 100000, 1000000, 10000000, 100000000),
+}
+
+
+class Histogram:
+    '''
+    Counts of the observed values per bucket, the last bucket counts everything above the highest bound
+    '''
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+
+    def observe(self, value):
+        index = next((index for index, bound in enumerate(self.bounds) if value <= bound), len(self.bounds))
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def percentile(self, fraction):
+        '''
+        :return: upper bound of the bucket the percentile falls into, the maximum for the last bucket
+        '''
+        if not self.count:
+            return 0
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= fraction * self.count:
+                return self.bounds[index] if index < len(self.bounds) else self.max
+        return self.max
+
+    def report(self):
+        return {
+            "count": self.count,
+            "mean": round(self.sum / self.count, 2) if self.count else 0,
+            "max": round(self.max, 2),
+            "p50": self.percentile(0.5),
+            "p95": self.percentile(0.95),
+            "buckets": {f'le_{bound}': count for bound, count in zip(self.bounds, self.counts)},
+            "buckets_above": self.counts[-1],
+        }
+
+
+class _Registry:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._last_dump = time.monotonic()
+
+    def record(self, endpoint, values):
+        with self._lock:
+            histograms = self._histograms.setdefault(
+                endpoint, {name: Histogram(bounds) for name, bounds in BUCKETS.items()})
+            for name, value in values.items():
+                histograms[name].observe(value)
+        self._dump_if_due()
+
+    def report(self):
+        with self._lock:
+            return {endpoint: {name: histogram.report() for name, histogram in histograms.items()}
+                    for endpoint, histograms in sorted(self._histograms.items())}
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+
+    def dump(self, path):
+        # written to a temporary file first, so readers never see a partial report
+        temporary_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temporary_path, 'w') as file:
+            json.dump(self.report(), file, indent=2)
+        os.replace(temporary_path, path)
+
+    def _dump_if_due(self):
+        path = getattr(settings, 'METRICS_DUMP_FILE', None)
+        if not path:
+            return
+        with self._lock:
+            if time.monotonic() - self._last_dump < getattr(settings, 'METRICS_DUMP_INTERVAL', 60):
+                return
+            self._last_dump = time.monotonic()
+        try:
+            self.dump(path)
+        except OSError:
+            logger.exception('Could not dump the request metrics to %s', path)
+
+
+registry = _Registry()
+
+
+class _RequestMetrics:
+    '''
+    Metrics of a single request, used as database execute wrapper to count the queries and their time
+    '''
+
+    def __init__(self, request):
+        self.request = request
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0
+        self.render_time = 0
+        self.size = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.db_time += time.perf_counter() - started
+
+    def finish(self):
+        endpoint = getattr(self.request, 'metrics_endpoint', None)
+        if endpoint is None:
+            return
+        latency = (time.perf_counter() - self.started) * 1000
+        registry.record(endpoint, {
+            QUERIES: self.queries,
+            DB_TIME: self.db_time * 1000,
+            RENDER_TIME: self.render_time * 1000,
+            LATENCY: latency,
+            SIZE: self.size,
+        })
+
+        budget = dict(getattr(settings, 'METRICS_BUDGET', {}))
+        budget.update(getattr(settings, 'METRICS_ENDPOINT_BUDGETS', {}).get(endpoint, {}))
+        if self.queries > budget.get(QUERIES, float('inf')) or latency > budget.get(LATENCY, float('inf')):
+            logger.warning('%s %s (%s) exceeded its budget: %d queries, %.0f ms database, %.0f ms total',
+                           self.request.method, self.request.path, endpoint, self.queries, self.db_time * 1000,
+                           latency)
+
+
+def endpoint_name(view_func, request):
+    '''
+    :return: `<viewset>.<action>` for views of viewsets, the name of the url otherwise
+    '''
+    actions = getattr(view_func, 'actions', None)
+    if actions and request.method.lower() in actions:
+        return f'{view_func.cls.__name__}.{actions[request.method.lower()]}'
+    if request.resolver_match is not None and request.resolver_match.url_name:
+        return request.resolver_match.url_name
+    return getattr(view_func, '__name__', 'unknown')
+
+
+class MetricsMiddleware:
+    '''
+    Record the metrics of every request routed to a view. Streamed responses are measured until their last chunk
+    was generated, as their queries run while streaming.
+    '''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics = _RequestMetrics(request)
+        request.metrics = metrics
+        with connection.execute_wrapper(metrics):
+            response = self.get_response(request)
+
+        if response.streaming:
+            response.streaming_content = self._measure_stream(response.streaming_content, metrics)
+        else:
+            metrics.size = len(response.content)
+            metrics.finish()
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.metrics_endpoint = endpoint_name(view_func, request)
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered right after this hook
+        render_started = time.perf_counter()
+
+        def rendered(response):
+            request.metrics.render_time += time.perf_counter() - render_started
+        response.add_post_render_callback(rendered)
+        return response
+
+    @staticmethod
+    def _measure_stream(chunks, metrics):
+        chunks = iter(chunks)
+        while True:
+            started = time.perf_counter()
+            with connection.execute_wrapper(metrics):
+                chunk = next(chunks, None)
+            metrics.render_time += time.perf_counter() - started
+            if chunk is None:
+                break
+            metrics.size += len(chunk)
+            yield chunk
+        metrics.finish()
@@ -0,0 +1,56 @@
+# Generated by Django 2.2.1 on 2026-10-18 10:07
+
+import json
+
+from django.db import migrations, models
+from django.db.models import Max
+from django.utils import timezone
+import django.db.models.deletion
+
+# `SiloSnapshot.DAYS_KEPT` at the time of this migration
+DAYS_KEPT = 4
+
+
+def build_snapshots(apps, schema_editor):
+    # every existing silo gets its snapshot right away, built like by `SiloSnapshot.rebuild`
+    Silo = apps.get_model('api', 'Silo')
+    Measurement = apps.get_model('api', 'Measurement')
+    SiloSnapshot = apps.get_model('api', 'SiloSnapshot')
+
+    snapshots = []
+    for silo_id, sensor_id in Silo.objects.values_list('id', 'sensor_id').iterator():
+        snapshot = SiloSnapshot(silo_id=silo_id)
+        measures = Measurement.objects.filter(sensor_id=sensor_id, saved__isnull=False)
+        last_saved = measures.aggregate(last=Max('saved'))['last'] if sensor_id is not None else None
+        if last_saved is not None:
+            first_day = timezone.localtime(last_saved).replace(hour=0, minute=0, second=0, microsecond=0) - \
+                timezone.timedelta(days=DAYS_KEPT)
+            closing_values = {}
+            for saved, value in measures.filter(saved__gte=first_day).order_by('saved', 'id').values_list(
+                    'saved', 'value').iterator():
+                closing_values[timezone.localtime(saved).strftime('%Y-%m-%d')] = [saved.isoformat(), value]
+                snapshot.saved, snapshot.value = saved, value
+            snapshot.closing_values = json.dumps(dict(sorted(closing_values.items(), reverse=True)[:DAYS_KEPT]))
+        snapshots.append(snapshot)
+    SiloSnapshot.objects.bulk_create(snapshots, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0019_auto_20200113_1424'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SiloSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.FloatField(null=True)),
+                ('saved', models.DateTimeField(null=True)),
+                ('closing_values', models.TextField(default='{}')),
+                ('silo', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='snapshot', to='api.Silo')),
+            ],
+        ),
+        migrations.RunPython(build_snapshots, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 2.2.1 on 2026-10-18 10:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0020_silosnapshot'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='measurement',
+            index=models.Index(fields=['sensor', 'saved'], name='api_measure_sensor_saved_idx'),
+        ),
+    ]
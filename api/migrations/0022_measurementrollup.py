@@ -0,0 +1,32 @@
+# Generated by Django 2.2.1 on 2026-10-18 10:09
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0021_measurement_sensor_saved_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MeasurementRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.CharField(choices=[('minute', 'Minute'), ('hour', 'Hour'), ('day', 'Day')], max_length=10)),
+                ('bucket', models.DateTimeField()),
+                ('last_value', models.FloatField()),
+                ('last_saved', models.DateTimeField()),
+                ('min_value', models.FloatField()),
+                ('max_value', models.FloatField()),
+                ('value_sum', models.FloatField()),
+                ('count', models.IntegerField()),
+                ('sensor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.Sensor')),
+            ],
+            options={
+                'unique_together': {('sensor', 'granularity', 'bucket')},
+            },
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 2.2.1 on 2026-10-18 10:13
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0022_measurementrollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutgoingNotification',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('topic', models.CharField(max_length=150)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('sent', 'Sent'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('attempts', models.IntegerField(default=0)),
+                ('next_attempt', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('sent', models.DateTimeField(blank=True, null=True)),
+                ('notification', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.Notification')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='outgoingnotification',
+            index=models.Index(fields=['status', 'next_attempt'], name='api_outgoing_due_idx'),
+        ),
+    ]
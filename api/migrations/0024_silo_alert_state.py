@@ -0,0 +1,53 @@
+# Generated by Django 2.2.1 on 2026-10-18 10:14
+
+import django.core.validators
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+import django.db.models.deletion
+import re
+
+
+def seed_alert_states(apps, schema_editor):
+    # start from the latest measurement of every silo, so the first new measurement can already cross a level
+    SiloAlertState = apps.get_model('api', 'SiloAlertState')
+    Silo = apps.get_model('api', 'Silo')
+    Measurement = apps.get_model('api', 'Measurement')
+    latest = Measurement.objects.filter(sensor_id=OuterRef('sensor_id')).order_by('-saved', '-id').values('value')
+    silos = Silo.objects.annotate(last_value=Subquery(latest[:1])).values_list('id', 'last_value')
+    SiloAlertState.objects.bulk_create([SiloAlertState(silo_id=silo_id, last_value=value) for silo_id, value in silos])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0023_outgoingnotification'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='silo',
+            name='alert_cooldown',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='silo',
+            name='alert_hysteresis',
+            field=models.FloatField(default=2),
+        ),
+        migrations.AddField(
+            model_name='silo',
+            name='critical_levels',
+            field=models.CharField(blank=True, default='20,40,60,80', max_length=200, validators=[django.core.validators.RegexValidator(re.compile('^\\d+(?:,\\d+)*\\Z'), code='invalid', message='Enter only digits separated by commas.')]),
+        ),
+        migrations.CreateModel(
+            name='SiloAlertState',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_value', models.FloatField(null=True)),
+                ('notified_level', models.IntegerField(null=True)),
+                ('notified_at', models.DateTimeField(null=True)),
+                ('silo', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='alert_state', to='api.Silo')),
+            ],
+        ),
+        migrations.RunPython(seed_alert_states, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 2.2.1 on 2026-10-18 10:23
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0024_silo_alert_state'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sensor',
+            name='compacted_until',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='silo',
+            name='raw_retention_days',
+            field=models.PositiveIntegerField(blank=True, null=True, validators=[django.core.validators.MinValueValidator(1)]),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 2.2.1 on 2026-10-18 10:24
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0025_measurement_retention'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SiloGeometry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveIntegerField(default=1)),
+                ('height', models.FloatField(default=0)),
+                ('width', models.FloatField(default=0)),
+                ('gap_top', models.FloatField(default=0)),
+                ('gap_bottom', models.FloatField(default=0)),
+                ('radius', models.FloatField(default=0)),
+                ('capacity', models.FloatField(default=0)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('silo', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='geometries', to='api.Silo')),
+            ],
+            options={
+                'unique_together': {('silo', 'version')},
+            },
+        ),
+        migrations.AddField(
+            model_name='measurement',
+            name='geometry',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, to='api.SiloGeometry'),
+        ),
+    ]
@@ -0,0 +1,65 @@
+from django.db import migrations
+from django.db.models import Min
+
+BATCH_SIZE = 10000
+
+# geometry fields of measurements mapped to the fields of the geometry table
+GEOMETRY_FIELDS = {
+    'silo_height': 'height',
+    'silo_width': 'width',
+    'silo_gap_top': 'gap_top',
+    'silo_gap_bottom': 'gap_bottom',
+    'radius': 'radius',
+    'capacity': 'capacity',
+}
+
+
+def _update_in_batches(queryset, **values):
+    while True:
+        ids = list(queryset.order_by('id').values_list('id', flat=True)[:BATCH_SIZE])
+        if not ids:
+            return
+        queryset.model.objects.filter(id__in=ids).update(**values)
+
+
+def deduplicate_geometries(apps, schema_editor):
+    # every distinct geometry of a sensor becomes a version of the silo the sensor is mounted in now,
+    # measurements computed without a geometry (capacity 0) keep none
+    Measurement = apps.get_model('api', 'Measurement')
+    Silo = apps.get_model('api', 'Silo')
+    SiloGeometry = apps.get_model('api', 'SiloGeometry')
+    silos = dict(Silo.objects.filter(sensor__isnull=False).order_by('id').values_list('sensor_id', 'id'))
+
+    geometries = Measurement.objects.filter(capacity__gt=0, geometry__isnull=True).values(
+        'sensor_id', *GEOMETRY_FIELDS).annotate(first_saved=Min('saved')).order_by('first_saved')
+    for row in list(geometries):
+        silo_id = silos.get(row['sensor_id'])
+        fields = {field: row[column] for column, field in GEOMETRY_FIELDS.items()}
+        geometry = SiloGeometry.objects.filter(silo_id=silo_id, **fields).first()
+        if geometry is None:
+            versions = SiloGeometry.objects.filter(silo_id=silo_id).count()
+            geometry = SiloGeometry.objects.create(silo_id=silo_id, version=versions + 1, **fields)
+        _update_in_batches(Measurement.objects.filter(sensor_id=row['sensor_id'], geometry__isnull=True,
+                                                      **{column: row[column] for column in GEOMETRY_FIELDS}),
+                           geometry=geometry)
+
+
+def restore_geometry_fields(apps, schema_editor):
+    Measurement = apps.get_model('api', 'Measurement')
+    SiloGeometry = apps.get_model('api', 'SiloGeometry')
+    for geometry in SiloGeometry.objects.all():
+        _update_in_batches(Measurement.objects.filter(geometry=geometry, capacity=0), **{
+            column: getattr(geometry, field) for column, field in GEOMETRY_FIELDS.items()})
+
+
+class Migration(migrations.Migration):
+    # every batch is committed on its own, an interrupted migration continues with the measurements left over
+    atomic = False
+
+    dependencies = [
+        ('api', '0026_silogeometry'),
+    ]
+
+    operations = [
+        migrations.RunPython(deduplicate_geometries, restore_geometry_fields),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 2.2.1 on 2026-10-18 10:24
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0027_deduplicate_silo_geometries'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='measurement',
+            name='capacity',
+        ),
+        migrations.RemoveField(
+            model_name='measurement',
+            name='radius',
+        ),
+        migrations.RemoveField(
+            model_name='measurement',
+            name='silo_gap_bottom',
+        ),
+        migrations.RemoveField(
+            model_name='measurement',
+            name='silo_gap_top',
+        ),
+        migrations.RemoveField(
+            model_name='measurement',
+            name='silo_height',
+        ),
+        migrations.RemoveField(
+            model_name='measurement',
+            name='silo_width',
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 2.2.1 on 2026-10-18 10:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0028_remove_measurement_geometry_fields'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='measurement',
+            index=models.Index(fields=['saved', 'id'], name='api_measure_saved_id_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 2.2.1 on 2026-10-18 10:46
+
+import api.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0029_measurement_saved_id_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='measurement',
+            name='saved',
+            field=models.DateTimeField(default=api.models._now, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,74 @@
+from django.db import migrations, transaction
+from django.utils import timezone
+
+# `MeasurementRollup.GRANULARITIES` at the time of this migration
+GRANULARITIES = ('minute', 'hour', 'day')
+CHUNK_SIZE = 2000
+
+
+def _truncate(saved, granularity):
+    saved = saved.astimezone(timezone.utc).replace(second=0, microsecond=0)
+    if granularity in ('hour', 'day'):
+        saved = saved.replace(minute=0)
+    if granularity == 'day':
+        saved = saved.replace(hour=0)
+    return saved
+
+
+def _aggregate(MeasurementRollup, sensor_id, readings):
+    # like `MeasurementRollup._aggregate`, for the readings of one sensor ordered by saved
+    rollups = {}
+    for saved, value in readings:
+        for granularity in GRANULARITIES:
+            key = (granularity, _truncate(saved, granularity))
+            rollup = rollups.get(key)
+            if rollup is None:
+                rollups[key] = MeasurementRollup(sensor_id=sensor_id, granularity=granularity, bucket=key[1],
+                                                 last_value=value, last_saved=saved, min_value=value,
+                                                 max_value=value, value_sum=value, count=1)
+                continue
+            rollup.last_saved = saved
+            rollup.last_value = value
+            rollup.min_value = min(rollup.min_value, value)
+            rollup.max_value = max(rollup.max_value, value)
+            rollup.value_sum += value
+            rollup.count += 1
+    return rollups.values()
+
+
+def build_rollups(apps, schema_editor):
+    '''
+    Build the rollups of the measurements stored before the rollups existed, like `rebuild_rollups` does, so the
+    graphs are complete right after deploying. Each sensor is built in its own transaction and sensors which have
+    rollups already are skipped, so an interrupted migration continues where it stopped.
+    '''
+    Sensor = apps.get_model('api', 'Sensor')
+    Measurement = apps.get_model('api', 'Measurement')
+    MeasurementRollup = apps.get_model('api', 'MeasurementRollup')
+
+    for sensor_id in Sensor.objects.order_by('id').values_list('id', flat=True):
+        if MeasurementRollup.objects.filter(sensor_id=sensor_id).exists():
+            continue
+        measures = Measurement.objects.filter(sensor_id=sensor_id, saved__isnull=False).order_by('saved', 'id')
+        with transaction.atomic():
+            readings = []
+            for saved, value in measures.values_list('saved', 'value').iterator(CHUNK_SIZE):
+                # the buckets of a whole (UTC) day are written once the day is over
+                if readings and _truncate(readings[-1][0], 'day') != _truncate(saved, 'day'):
+                    MeasurementRollup.objects.bulk_create(_aggregate(MeasurementRollup, sensor_id, readings))
+                    readings = []
+                readings.append((saved, value))
+            MeasurementRollup.objects.bulk_create(_aggregate(MeasurementRollup, sensor_id, readings))
+
+
+class Migration(migrations.Migration):
+    # the sensors are committed one by one instead of holding the whole table in one transaction
+    atomic = False
+
+    dependencies = [
+        ('api', '0030_measurement_saved_default'),
+    ]
+
+    operations = [
+        migrations.RunPython(build_rollups, migrations.RunPython.noop),
+    ]
@@ -1,19 +1,29 @@
+import json
+
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.contrib.humanize.templatetags.humanize import naturaltime
-from django.core.validators import MaxValueValidator, MinValueValidator
+from django.core.validators import MaxValueValidator, MinValueValidator, validate_comma_separated_integer_list
 from django.db import models
-from django.db.models import Max
-from django.db.models.functions import TruncDay
-from django.db.models.signals import post_save
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Max, F, Case, When, Value, Window
+from django.db.models.functions import TruncDay, Greatest, Least, RowNumber
+from django.db.models.signals import post_save, post_delete, pre_save
 from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.timezone import localtime
 from rest_framework.authtoken.models import Token
 
+from api import caching
+
 
 class Sensor(models.Model):
     serial_number = models.CharField(max_length=200, default='')
     type = models.CharField(max_length=200, default='LASER')
     user = models.ForeignKey(User, null=True, on_delete=models.CASCADE)
+    # measurements saved before this were compacted into hour and day rollups, set by `compact_measurements`
+    compacted_until = models.DateTimeField(null=True, blank=True, editable=False)
 
     def __str__(self):
         return self.type + " (" + self.serial_number + ")"
@@ -28,68 +38,131 @@ class Silo(models.Model):
     gap_bottom = models.FloatField(default=0)
     location = models.CharField(max_length=400, null=True, blank=True)
     sensor = models.ForeignKey(Sensor, null=True, on_delete=models.CASCADE)
+    # notifications are sent when the fill percentage drops below one of these levels
+    critical_levels = models.CharField(max_length=200, default='20,40,60,80', blank=True,
+                                       validators=[validate_comma_separated_integer_list])
+    # a level has to be exceeded by this many percent before it is notified again
+    alert_hysteresis = models.FloatField(default=2)
+    # minimal number of minutes between two notifications
+    alert_cooldown = models.IntegerField(default=0)
+    # number of days raw measurements are kept before they are compacted, empty to keep them forever
+    raw_retention_days = models.PositiveIntegerField(null=True, blank=True, validators=[MinValueValidator(1)])
 
     def __str__(self):
         return self.name
 
-    def last_update(self):
-        last_measure = Measurement.objects.filter(sensor=self.sensor).order_by('-saved').first()
-        if last_measure is None:
-            return "no measures"
-        result = naturaltime(last_measure.saved)
+    def get_critical_levels(self):
+        return sorted(int(level) for level in self.critical_levels.split(',') if level.strip())
 
-        result = result.replace("minutes", "m")
-        result = result.replace("minute", "m")
-        result = result.replace("hours", "h")
-        result = result.replace("hour", "h")
-        result = result.replace("days", "d")
-        result = result.replace("day", "d")
-        result = result.replace("weeks", "w")
-        result = result.replace("week", "w")
-        result = result.replace("months", "mo")
-        result = result.replace("month", "mo")
-        result = result.replace("years", "y")
-        result = result.replace("year", "y")
+    def get_snapshot(self):
+        '''
+        Return the denormalized snapshot of the latest readings, building it from the measurements if it
+        doesn't exist yet
+        '''
+        try:
+            return self.snapshot
+        except SiloSnapshot.DoesNotExist:
+            self.snapshot = SiloSnapshot.rebuild(self)
+            return self.snapshot
 
-        return result
+    def last_update(self):
+        return self.get_snapshot().last_update()
 
     def values_by_day(self):
-        measures = Measurement.objects.filter(sensor=self.sensor).annotate(day=TruncDay('saved')).values(
-            'day').annotate(max=Max('saved')).values('day', 'max').order_by('-day')[1:4]
+        return self.get_snapshot().values_by_day()
 
-        averages = {}
-        for measure in measures:
-            latest = Measurement.objects.filter(sensor=self.sensor, saved=measure['max']).first()
-            averages[measure['day'].strftime('%Y-%m-%d')] = latest.value
+    def percentage(self):
+        return self.get_snapshot().percentage()
 
-        return averages
 
-    def percentage(self):
-        last_measure = Measurement.objects.filter(sensor=self.sensor).order_by('-saved').first()
-        if last_measure is None:
-            return "N/A"
-        return last_measure.value
+class SiloGeometry(models.Model):
+    '''
+    Dimensions of a silo which measurements were computed with, a new version is stored whenever they change
+    '''
+    silo = models.ForeignKey(Silo, null=True, on_delete=models.SET_NULL, related_name='geometries')
+    version = models.PositiveIntegerField(default=1)
+    height = models.FloatField(default=0)
+    width = models.FloatField(default=0)
+    gap_top = models.FloatField(default=0)
+    gap_bottom = models.FloatField(default=0)
+    radius = models.FloatField(default=0)
+    capacity = models.FloatField(default=0)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('silo', 'version')
+
+    def __str__(self):
+        return f"{self.silo} v{self.version}: {self.height} x {self.width}"
+
+
+class MeasurementQuerySet(models.QuerySet):
+
+    def latest_per_bucket(self, truncation):
+        '''
+        Last measurement of every bucket in a single query, the buckets are ranked with a window function
+        (ties on saved are broken by the id) and only the first row of each is returned.
+        Databases without window functions fall back to a Max('saved') aggregation.
+        :param truncation: expression truncating `saved` into buckets, e.g. `TruncDay('saved')`
+        :return: measurements with `id`, `sensor_id`, `saved` and `value` loaded, ordered by saved
+        '''
+        if not connection.features.supports_over_clause:
+            return self._latest_per_bucket_by_aggregation(truncation)
+
+        ranked = self.order_by().annotate(bucket_rank=Window(
+            expression=RowNumber(), partition_by=[F('sensor_id'), truncation],
+            order_by=[F('saved').desc(), F('id').desc()])).values('id', 'sensor_id', 'saved', 'value', 'bucket_rank')
+        sql, params = ranked.query.sql_with_params()
+        # a window function can not be filtered in the same query, so the ranked rows are wrapped
+        return list(self.model.objects.raw(
+            f'SELECT * FROM ({sql}) ranked WHERE bucket_rank = 1 ORDER BY saved, id', params))
+
+    def _latest_per_bucket_by_aggregation(self, truncation):
+        latest = self.order_by().annotate(bucket=truncation).values('sensor_id', 'bucket').annotate(
+            latest=Max('saved'))
+        latest_by_bucket = {(row['sensor_id'], row['bucket']): row['latest'] for row in latest}
+        rows = self.filter(saved__in=set(latest_by_bucket.values())).annotate(bucket=truncation).only(
+            'id', 'sensor_id', 'saved', 'value').order_by('saved', '-id')
+        result = {}
+        for measure in rows:
+            key = (measure.sensor_id, measure.bucket)
+            # a timestamp can be the latest of another bucket or sensor as well, those rows are dropped
+            if latest_by_bucket.get(key) == measure.saved and key not in result:
+                result[key] = measure
+        return sorted(result.values(), key=lambda measure: (measure.saved, measure.id))
+
+
+def _now():
+    # looked up on every call like `auto_now_add` does, so tests can mock `timezone.now`
+    return timezone.now()
 
 
 class Measurement(models.Model):
     value = models.FloatField(default=0)
     distance = models.FloatField(default=0)
     read = models.DateTimeField(null=True)
-    saved = models.DateTimeField(auto_now_add=True, null=True)
+    # not `auto_now_add`, so readings stored later (e.g. by the ingestion buffer) keep the time they were received
+    saved = models.DateTimeField(default=_now, editable=False, null=True)
     sensor = models.ForeignKey(Sensor, on_delete=models.PROTECT, blank=True, null=True)
     sensor_timestamp = models.CharField(max_length=15, default='')
     temperature = models.FloatField(default=0)
     humidity = models.FloatField(default=0)
     pressure = models.FloatField(default=0)
-    capacity = models.FloatField(default=0)
     content = models.FloatField(default=0)
-    radius = models.FloatField(default=0)
-    silo_height = models.FloatField(default=0)
-    silo_width = models.FloatField(default=0)
-    silo_gap_top = models.FloatField(default=0)
-    silo_gap_bottom = models.FloatField(default=0)
+    # dimensions of the silo the percentage and content were computed with
+    geometry = models.ForeignKey(SiloGeometry, null=True, blank=True, on_delete=models.PROTECT)
     acc = models.CharField(max_length=30, default='')
 
+    objects = MeasurementQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # every read path filters by sensor and orders or ranges by the saved timestamp
+            models.Index(fields=['sensor', 'saved'], name='api_measure_sensor_saved_idx'),
+            # keyset pagination of the measurement list over all sensors of a user
+            models.Index(fields=['saved', 'id'], name='api_measure_saved_id_idx'),
+        ]
+
     def __str__(self):
         return str(self.value) + " - " + str(self.saved)
 
@@ -103,6 +176,440 @@ class Notification(models.Model):
         return f"Title: {self.title} | Body: {self.body} | Timestamp: {self.timestamp}"
 
 
+class OutgoingNotification(models.Model):
+    '''
+    Push message waiting to be sent by the `send_notifications` worker, so measurements can be stored
+    without waiting for the push provider
+    '''
+    PENDING = 'pending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUSES = (
+        (PENDING, 'Pending'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed'),
+    )
+
+    notification = models.ForeignKey(Notification, on_delete=models.CASCADE)
+    topic = models.CharField(max_length=150)
+    status = models.CharField(max_length=10, choices=STATUSES, default=PENDING)
+    attempts = models.IntegerField(default=0)
+    next_attempt = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, default='')
+    sent = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt'], name='api_outgoing_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.topic} | {self.notification.title} | {self.status}"
+
+
+class SiloSnapshot(models.Model):
+    '''
+    Latest reading and the closing values of the last days of a silo, kept up to date on every new measurement
+    so listing silos doesn't have to query the measurements
+    '''
+    DAYS_KEPT = 4
+
+    silo = models.OneToOneField(Silo, related_name='snapshot', on_delete=models.CASCADE)
+    value = models.FloatField(null=True)
+    saved = models.DateTimeField(null=True)
+    # JSON object mapping a day (%Y-%m-%d) to the [saved, value] pair of the last measurement of that day
+    closing_values = models.TextField(default='{}')
+
+    def __str__(self):
+        return f"{self.silo} | {self.value} | {self.saved}"
+
+    def get_closing_values(self):
+        return json.loads(self.closing_values)
+
+    def last_update(self):
+        if self.saved is None:
+            return "no measures"
+        result = naturaltime(self.saved)
+
+        result = result.replace("minutes", "m")
+        result = result.replace("minute", "m")
+        result = result.replace("hours", "h")
+        result = result.replace("hour", "h")
+        result = result.replace("days", "d")
+        result = result.replace("day", "d")
+        result = result.replace("weeks", "w")
+        result = result.replace("week", "w")
+        result = result.replace("months", "mo")
+        result = result.replace("month", "mo")
+        result = result.replace("years", "y")
+        result = result.replace("year", "y")
+
+        return result
+
+    def values_by_day(self):
+        # the current (incomplete) day is skipped, only the closing values of the previous days are shown
+        closing_values = sorted(self.get_closing_values().items(), reverse=True)[1:]
+        return {day: value for day, (saved, value) in closing_values}
+
+    def percentage(self):
+        if self.saved is None:
+            return "N/A"
+        return self.value
+
+    def record(self, saved, value):
+        '''
+        Register a new reading, readings older than the ones already registered only update their day
+        :param saved: timestamp of the reading
+        :param value: fill percentage of the reading
+        '''
+        if self.saved is None or saved >= self.saved:
+            self.saved = saved
+            self.value = value
+
+        closing_values = self.get_closing_values()
+        day = localtime(saved).strftime('%Y-%m-%d')
+        if day not in closing_values or parse_datetime(closing_values[day][0]) <= saved:
+            closing_values[day] = [saved.isoformat(), value]
+        self.closing_values = json.dumps(dict(sorted(closing_values.items(), reverse=True)[:self.DAYS_KEPT]))
+
+    @classmethod
+    def rebuild(cls, silo):
+        '''
+        Create or replace the snapshot of the silo from its stored measurements, locked like by
+        `update_derived_data`
+        '''
+        with transaction.atomic(savepoint=False):
+            snapshot, _ = cls.objects.select_for_update().get_or_create(silo=silo)
+            snapshot.value = None
+            snapshot.saved = None
+            snapshot.closing_values = '{}'
+            if silo.sensor_id is not None:
+                measures = Measurement.objects.filter(sensor_id=silo.sensor_id)
+                last_saved = measures.aggregate(last=Max('saved'))['last']
+                if last_saved is not None:
+                    # one day more than kept, so a daylight saving change can not cut off the first day
+                    first_day = localtime(last_saved).replace(hour=0, minute=0, second=0, microsecond=0) - \
+                        timezone.timedelta(days=cls.DAYS_KEPT)
+                    for measure in measures.filter(saved__gte=first_day).latest_per_bucket(TruncDay('saved')):
+                        snapshot.record(measure.saved, measure.value)
+            snapshot.save()
+
+        caching.invalidate_silos([silo.id])
+        return snapshot
+
+
+class SiloAlertState(models.Model):
+    '''
+    What is needed to decide about critical level notifications without querying previous measurements
+    '''
+    silo = models.OneToOneField(Silo, related_name='alert_state', on_delete=models.CASCADE)
+    last_value = models.FloatField(null=True)
+    # lowest level notified since the value was last above it (plus hysteresis)
+    notified_level = models.IntegerField(null=True)
+    notified_at = models.DateTimeField(null=True)
+
+    def __str__(self):
+        return f"{self.silo} | {self.last_value} | {self.notified_level}"
+
+    def evaluate(self, value, now):
+        '''
+        Register a new value and decide if a notification has to be sent, the state has to be saved afterwards.
+        A notification is due when the value drops below a critical level, unless that level (or a lower one) was
+        notified already and the value hasn't risen above it by the hysteresis since, or the last notification
+        was sent less than the cooldown ago.
+        :param value: new fill percentage
+        :param now: time of the new value
+        :return: the critical level to notify or None
+        '''
+        if self.notified_level is not None and value >= self.notified_level + self.silo.alert_hysteresis:
+            self.notified_level = None
+
+        level_to_notify = None
+        if self.last_value is not None:
+            for level in self.silo.get_critical_levels():
+                if value < level <= self.last_value:
+                    already_notified = self.notified_level is not None and level >= self.notified_level
+                    cooling_down = self.notified_at is not None and \
+                        now < self.notified_at + timezone.timedelta(minutes=self.silo.alert_cooldown)
+                    if not already_notified and not cooling_down:
+                        level_to_notify = level
+                        self.notified_level = level
+                        self.notified_at = now
+                    break
+
+        self.last_value = value
+        return level_to_notify
+
+
+class MeasurementRollup(models.Model):
+    '''
+    Aggregate of the measurements of a sensor within one minute, hour or day (in UTC), maintained incrementally
+    on every new measurement so graphs don't have to group the raw measurements
+    '''
+    MINUTE = 'minute'
+    HOUR = 'hour'
+    DAY = 'day'
+    GRANULARITIES = (
+        (MINUTE, 'Minute'),
+        (HOUR, 'Hour'),
+        (DAY, 'Day'),
+    )
+    BUCKET_SIZES = {
+        MINUTE: timezone.timedelta(minutes=1),
+        HOUR: timezone.timedelta(hours=1),
+        DAY: timezone.timedelta(days=1),
+    }
+
+    sensor = models.ForeignKey(Sensor, on_delete=models.CASCADE)
+    granularity = models.CharField(max_length=10, choices=GRANULARITIES)
+    bucket = models.DateTimeField()
+    last_value = models.FloatField()
+    last_saved = models.DateTimeField()
+    min_value = models.FloatField()
+    max_value = models.FloatField()
+    value_sum = models.FloatField()
+    count = models.IntegerField()
+
+    class Meta:
+        unique_together = ('sensor', 'granularity', 'bucket')
+
+    def __str__(self):
+        return f"{self.sensor} | {self.granularity} {self.bucket} | {self.last_value}"
+
+    @property
+    def avg_value(self):
+        return self.value_sum / self.count
+
+    @classmethod
+    def truncate(cls, saved, granularity):
+        saved = saved.astimezone(timezone.utc).replace(second=0, microsecond=0)
+        if granularity in (cls.HOUR, cls.DAY):
+            saved = saved.replace(minute=0)
+        if granularity == cls.DAY:
+            saved = saved.replace(hour=0)
+        return saved
+
+    @classmethod
+    def _aggregate(cls, readings):
+        '''
+        Aggregate readings into buckets of all granularities
+        :param readings: iterable of (sensor_id, saved, value)
+        :return: dictionary mapping (sensor_id, granularity, bucket) to rollups which are not saved yet
+        '''
+        rollups = {}
+        for sensor_id, saved, value in readings:
+            for granularity, _ in cls.GRANULARITIES:
+                key = (sensor_id, granularity, cls.truncate(saved, granularity))
+                rollup = rollups.get(key)
+                if rollup is None:
+                    rollups[key] = cls(sensor_id=sensor_id, granularity=granularity, bucket=key[2],
+                                       last_value=value, last_saved=saved, min_value=value, max_value=value,
+                                       value_sum=value, count=1)
+                    continue
+                if saved >= rollup.last_saved:
+                    rollup.last_saved = saved
+                    rollup.last_value = value
+                rollup.min_value = min(rollup.min_value, value)
+                rollup.max_value = max(rollup.max_value, value)
+                rollup.value_sum += value
+                rollup.count += 1
+        return rollups
+
+    @classmethod
+    def record(cls, readings):
+        '''
+        Merge new readings into the stored rollups
+        :param readings: iterable of (sensor_id, saved, value)
+        '''
+        for rollup in cls._aggregate(readings).values():
+            if not cls._merge(rollup):
+                try:
+                    with transaction.atomic():
+                        rollup.save()
+                except IntegrityError:
+                    # the bucket was created concurrently in the meantime
+                    cls._merge(rollup)
+
+    @classmethod
+    def _merge(cls, rollup):
+        last_saved = Value(rollup.last_saved, output_field=models.DateTimeField())
+        return cls.objects.filter(sensor_id=rollup.sensor_id, granularity=rollup.granularity,
+                                  bucket=rollup.bucket).update(
+            last_value=Case(When(last_saved__lte=rollup.last_saved, then=Value(rollup.last_value)),
+                            default=F('last_value'), output_field=models.FloatField()),
+            last_saved=Greatest('last_saved', last_saved),
+            min_value=Least('min_value', Value(rollup.min_value)),
+            max_value=Greatest('max_value', Value(rollup.max_value)),
+            value_sum=F('value_sum') + rollup.value_sum,
+            count=F('count') + rollup.count,
+        )
+
+    @classmethod
+    def rebuild(cls, sensor_id, date_from=None, date_to=None, chunk_size=2000):
+        '''
+        Recompute the rollups of a sensor from its measurements, the range is widened to whole days.
+        Compacted days are never rebuilt, their rollups are all that is left of the measurements.
+        '''
+        measures = Measurement.objects.filter(sensor_id=sensor_id, saved__isnull=False)
+        rollups = cls.objects.filter(sensor_id=sensor_id)
+        compacted_until = Sensor.objects.filter(id=sensor_id).values_list('compacted_until', flat=True).first()
+        if compacted_until is not None:
+            date_from = max(date_from, compacted_until) if date_from is not None else compacted_until
+        if date_to is not None and date_from is not None and date_to < date_from:
+            return
+        if date_from is not None:
+            date_from = cls.truncate(date_from, cls.DAY)
+            measures = measures.filter(saved__gte=date_from)
+            rollups = rollups.filter(bucket__gte=date_from)
+        if date_to is not None:
+            date_to = cls.truncate(date_to, cls.DAY) + cls.BUCKET_SIZES[cls.DAY]
+            measures = measures.filter(saved__lt=date_to)
+            rollups = rollups.filter(bucket__lt=date_to)
+
+        with transaction.atomic():
+            rollups.delete()
+            readings = []
+            for saved, value in measures.order_by('saved').values_list('saved', 'value').iterator(chunk_size):
+                # measurements are ordered, so the buckets of a whole day can be written once the day is over
+                # (at most 1465 rollups, the batch size is left to the database backend)
+                if readings and cls.truncate(readings[-1][1], cls.DAY) != cls.truncate(saved, cls.DAY):
+                    cls.objects.bulk_create(cls._aggregate(readings).values())
+                    readings = []
+                readings.append((sensor_id, saved, value))
+            cls.objects.bulk_create(cls._aggregate(readings).values())
+
+    @classmethod
+    def latest_values(cls, sensor_ids, granularity, date_from, date_to):
+        '''
+        Last measured value of each bucket between the given dates, for several sensors at once.
+        Minute buckets of compacted days are no longer kept, hour buckets are returned for them instead.
+        :return: dictionary mapping the sensor ids to lists of (saved, value) pairs ordered by saved
+        '''
+        compacted = {}
+        if granularity == cls.MINUTE:
+            compacted = dict(Sensor.objects.filter(id__in=sensor_ids, compacted_until__gt=date_from).values_list(
+                'id', 'compacted_until'))
+
+        result = cls._latest_values([sensor_id for sensor_id in sensor_ids if sensor_id not in compacted],
+                                    granularity, date_from, date_to)
+        for sensor_id, compacted_until in compacted.items():
+            result[sensor_id] = cls._latest_values(
+                [sensor_id], cls.HOUR, date_from, min(date_to, compacted_until - timezone.timedelta(microseconds=1))
+            )[sensor_id]
+            if date_to >= compacted_until:
+                result[sensor_id] += cls._latest_values([sensor_id], granularity, compacted_until, date_to)[sensor_id]
+        return result
+
+    @classmethod
+    def _latest_values(cls, sensor_ids, granularity, date_from, date_to):
+        rollups = cls.objects.filter(sensor_id__in=sensor_ids, granularity=granularity,
+                                     bucket__gte=cls.truncate(date_from, granularity), bucket__lte=date_to,
+                                     last_saved__gte=date_from).order_by('sensor_id', 'bucket')
+        result = {sensor_id: [] for sensor_id in sensor_ids}
+        for sensor_id, bucket, last_saved, last_value in rollups.values_list('sensor_id', 'bucket', 'last_saved',
+                                                                            'last_value'):
+            if last_saved > date_to:
+                # only the last bucket can reach past the end of the range, its value is taken from the measurements
+                latest = Measurement.objects.filter(sensor_id=sensor_id, saved__gte=bucket,
+                                                    saved__lte=date_to).order_by('-saved').values_list(
+                    'saved', 'value').first()
+                if latest:
+                    result[sensor_id].append(latest)
+            else:
+                result[sensor_id].append((last_saved, last_value))
+        return result
+
+
+@receiver(post_save, sender=Silo)
+def rebuild_silo_snapshot(sender, instance=None, raw=False, **kwargs):
+    # the sensor of the silo might have changed, so the snapshot is rebuilt on every edit
+    if not raw:
+        SiloSnapshot.rebuild(instance)
+
+
+@receiver(post_delete, sender=Silo)
+def invalidate_deleted_silo(sender, instance=None, **kwargs):
+    caching.invalidate_silos([instance.id])
+
+
+@receiver(post_save, sender=Sensor)
+@receiver(post_delete, sender=Sensor)
+def invalidate_silo_list(sender, instance=None, raw=False, **kwargs):
+    # the silo list contains the sensors of the silos, the other cached responses don't depend on them
+    if not raw:
+        caching.invalidate_silos([])
+
+
+def update_derived_data(measurements):
+    '''
+    Bring the silo snapshots and the rollups up to date with newly created measurements,
+    bulk inserts have to call this explicitly because they don't send `post_save`
+    :param measurements: new measurements, already saved
+    '''
+    measurements = [m for m in measurements if m.saved is not None and m.sensor_id is not None]
+    if not measurements:
+        return
+
+    sensor_ids = {m.sensor_id for m in measurements}
+    # the snapshots are locked until the transaction of the caller ends, so concurrent writers (other workers, the
+    # listener, the ingestion buffer) record their readings one after the other instead of overwriting each other
+    with transaction.atomic(savepoint=False):
+        snapshots = SiloSnapshot.objects.select_for_update(of=('self',)).filter(
+            silo__sensor_id__in=sensor_ids).select_related('silo').order_by('silo_id')
+        for snapshot in snapshots:
+            for measurement in measurements:
+                if measurement.sensor_id == snapshot.silo.sensor_id:
+                    snapshot.record(measurement.saved, measurement.value)
+            snapshot.save()
+
+        MeasurementRollup.record((m.sensor_id, m.saved, m.value) for m in measurements)
+    # silos without a snapshot yet build it from the measurements when they are shown, their cached responses are
+    # outdated all the same
+    caching.invalidate_silos(Silo.objects.filter(sensor_id__in=sensor_ids).values_list('id', flat=True))
+
+
+def rebuild_derived_data(readings):
+    '''
+    Bring the silo snapshots and the rollups up to date with edited or deleted measurements, which unlike new
+    measurements can't be merged into them
+    :param readings: (sensor_id, saved) of the measurements before and after the change
+    '''
+    readings = [(sensor_id, saved) for sensor_id, saved in readings if sensor_id is not None]
+    days = {(sensor_id, MeasurementRollup.truncate(saved, MeasurementRollup.DAY))
+            for sensor_id, saved in readings if saved is not None}
+    for sensor_id, day in days:
+        MeasurementRollup.rebuild(sensor_id, day, day)
+    silos = list(Silo.objects.filter(sensor_id__in={sensor_id for sensor_id, saved in readings}))
+    for silo in silos:
+        SiloSnapshot.rebuild(silo)
+    # once the rollups and the snapshots are written, so no stale response can be cached under the new versions
+    caching.invalidate_silos([silo.id for silo in silos])
+
+
+@receiver(pre_save, sender=Measurement)
+def remember_previous_measurement(sender, instance=None, raw=False, **kwargs):
+    # an edit can move the measurement to another sensor, whose derived data has to be rebuilt as well
+    instance._previous = None
+    if instance.pk is not None and not raw:
+        instance._previous = Measurement.objects.filter(pk=instance.pk).values_list('sensor_id', 'saved').first()
+
+
+@receiver(post_save, sender=Measurement)
+def measurement_created(sender, instance=None, created=False, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        update_derived_data([instance])
+    else:
+        rebuild_derived_data([reading for reading in (instance._previous, (instance.sensor_id, instance.saved))
+                              if reading is not None])
+
+
+@receiver(post_delete, sender=Measurement)
+def measurement_deleted(sender, instance=None, **kwargs):
+    rebuild_derived_data([(instance.sensor_id, instance.saved)])
+
+
 # Automatically creates and saves the token for every newly registered user
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
 def create_auth_token(sender, instance=None, created=False, **kwargs):
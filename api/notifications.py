@@ -0,0 +1,111 @@
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from fcm_django.fcm import fcm_send_topic_message
+
+from api.models import Notification, OutgoingNotification
+
+MAX_ATTEMPTS = 8
+RETRY_DELAY = timezone.timedelta(seconds=30)
+MAX_RETRY_DELAY = timezone.timedelta(hours=1)
+# time a worker has to send the messages it claimed, before other workers send them again
+CLAIM_TIMEOUT = timezone.timedelta(minutes=5)
+
+
+class FCMSender:
+    '''
+    Sends push messages to a topic with Firebase Cloud Messaging
+    '''
+
+    def send(self, topic, title, body):
+        fcm_send_topic_message(topic_name=topic, sound='default', message_body=body, message_title=title,
+                               data_message={"body": body, "title": title})
+
+
+class LocalSender:
+    '''
+    Keeps the messages in memory instead of sending them, for tests and local development
+    '''
+    sent = []
+
+    def send(self, topic, title, body):
+        self.sent.append((topic, title, body))
+
+
+def get_sender():
+    return import_string(getattr(settings, 'NOTIFICATION_SENDER', 'api.notifications.FCMSender'))()
+
+
+def enqueue(title, body, topic):
+    '''
+    Store the notification and queue its push message, the message is sent by `dispatch_pending`
+    '''
+    notification = Notification.objects.create(title=title, body=body)
+    OutgoingNotification.objects.create(notification=notification, topic=topic)
+    return notification
+
+
+def retry_delay(attempts):
+    return min(RETRY_DELAY * 2 ** (attempts - 1), MAX_RETRY_DELAY)
+
+
+def dispatch_pending(sender=None, batch_size=100):
+    '''
+    Send due push messages, grouped by topic. When sending to a topic fails, the remaining messages of the topic
+    are postponed as well to keep their order, and retried with exponential backoff.
+    The messages are claimed in a short transaction and sent outside of it, so a slow push provider holds neither
+    row locks nor a transaction. Messages of a worker which stopped before recording the result are sent again
+    once their claim expired.
+    :param sender: object with a `send(topic, title, body)` method, configured by `NOTIFICATION_SENDER` by default
+    :param batch_size: maximal number of messages to send
+    :return: number of sent and number of failed messages
+    '''
+    sender = sender or get_sender()
+    sent = failed = 0
+
+    with transaction.atomic():
+        # rows locked by another worker are skipped instead of being sent twice
+        due = list(OutgoingNotification.objects.select_for_update(skip_locked=True, of=('self',)).select_related(
+            'notification').filter(status=OutgoingNotification.PENDING, next_attempt__lte=timezone.now()).order_by(
+            'id')[:batch_size])
+        OutgoingNotification.objects.filter(id__in=[message.id for message in due]).update(
+            next_attempt=timezone.now() + CLAIM_TIMEOUT)
+
+    by_topic = {}
+    for message in due:
+        by_topic.setdefault(message.topic, []).append(message)
+
+    results = []
+    for topic, messages in by_topic.items():
+        error = None
+        for message in messages:
+            if error is None:
+                try:
+                    sender.send(topic, message.notification.title, message.notification.body)
+                except Exception as e:
+                    error = f"{type(e).__name__}: {e}"
+                else:
+                    results.append((message, None, timezone.now()))
+                    continue
+            results.append((message, error, timezone.now()))
+
+    with transaction.atomic():
+        for message, error, now in results:
+            if error is None:
+                message.status = OutgoingNotification.SENT
+                message.sent = now
+                message.save(update_fields=['status', 'sent'])
+                sent += 1
+                continue
+
+            message.attempts += 1
+            message.last_error = error
+            if message.attempts >= MAX_ATTEMPTS:
+                message.status = OutgoingNotification.FAILED
+            else:
+                message.next_attempt = now + retry_delay(message.attempts)
+            message.save(update_fields=['attempts', 'last_error', 'status', 'next_attempt'])
+            failed += 1
+
+    return sent, failed
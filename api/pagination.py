@@ -0,0 +1,80 @@
+import base64
+from collections import OrderedDict
+
+from dateutil import parser
+from django.db.models import Q
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+NEWEST_FIRST = '-saved'
+OLDEST_FIRST = 'saved'
+
+
+class SavedKeysetPagination(BasePagination):
+    '''
+    Pages ordered by (saved, id). The cursor holds the position of the last row of the previous page and the next
+    page starts right after it, so every page costs the same however deep the client scrolls.
+    Rows without a saved timestamp are never returned. The queryset may return model instances or `values()` rows.
+    - `cursor`: position of the page, taken from the `next` link
+    - `page_size`: number of rows per page
+    - `ordering`: `-saved` (newest first, default) or `saved`
+    '''
+    page_size = 100
+    max_page_size = 1000
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self._get_page_size(request)
+        self.ordering = request.query_params.get('ordering', NEWEST_FIRST)
+        if self.ordering not in (NEWEST_FIRST, OLDEST_FIRST):
+            raise ValidationError({"message": "Unknown ordering", "ordering": self.ordering})
+
+        queryset = queryset.filter(saved__isnull=False)
+        cursor = request.query_params.get('cursor')
+        if cursor:
+            saved, row_id = self._decode_cursor(cursor)
+            if self.ordering == NEWEST_FIRST:
+                queryset = queryset.filter(Q(saved__lt=saved) | Q(saved=saved, id__lt=row_id))
+            else:
+                queryset = queryset.filter(Q(saved__gt=saved) | Q(saved=saved, id__gt=row_id))
+
+        direction = '-' if self.ordering == NEWEST_FIRST else ''
+        # one row more than needed tells if there is a next page
+        rows = list(queryset.order_by(f'{direction}saved', f'{direction}id')[:self.page_size + 1])
+        self.next_cursor = None
+        if len(rows) > self.page_size:
+            rows = rows[:self.page_size]
+            last = rows[-1] if isinstance(rows[-1], dict) else vars(rows[-1])
+            self.next_cursor = self._encode_cursor(last['saved'], last['id'])
+        return rows
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([('next', self.get_next_link()), ('results', data)]))
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), 'cursor', self.next_cursor)
+
+    def _get_page_size(self, request):
+        try:
+            page_size = int(request.query_params.get('page_size', self.page_size))
+        except ValueError:
+            raise ValidationError({"message": "`page_size` has to be a number"})
+        if not 1 <= page_size <= self.max_page_size:
+            raise ValidationError({"message": f"`page_size` has to be between 1 and {self.max_page_size}"})
+        return page_size
+
+    @staticmethod
+    def _encode_cursor(saved, row_id):
+        return base64.urlsafe_b64encode(f'{saved.isoformat()}|{row_id}'.encode('ascii')).decode('ascii')
+
+    @staticmethod
+    def _decode_cursor(cursor):
+        try:
+            saved, row_id = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('ascii').split('|')
+            return parser.isoparse(saved), int(row_id)
+        except ValueError:
+            raise ValidationError({"message": "Invalid cursor"})
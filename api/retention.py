@@ -0,0 +1,170 @@
+'''
+Raw measurements of silos with a retention policy are compacted once they are older than the retention:
+their day is rebuilt into rollups, then the raw rows and minute rollups are deleted, leaving the hour and day
+rollups. `Readings` reads a range of measurements transparently, taking the compacted part from the hour rollups.
+'''
+from itertools import chain
+
+from django.db import connections, transaction
+from django.db.models import Max, Min
+from django.db.models.sql.constants import MULTI
+from django.utils import timezone
+
+from api import caching
+from api.models import Measurement, MeasurementRollup, Sensor, SiloSnapshot
+
+ITERATOR_CHUNK_SIZE = 2000
+DELETE_CHUNK_SIZE = 5000
+
+# the fields of the last reading of every hour, which is what is left of compacted measurements
+ROLLUP_FIELDS = {'saved': 'last_saved', 'value': 'last_value', 'sensor_id': 'sensor_id'}
+
+
+class Readings:
+    '''
+    Measurements of a sensor between two dates, measurements of compacted days are replaced by the last reading
+    of every hour with the fields which are not kept in rollups set to None
+    '''
+
+    def __init__(self, sensor, date_from=None, date_to=None):
+        self.sensor = sensor
+        self.date_from = date_from
+        self.date_to = date_to
+        self.compacted_until = sensor.compacted_until
+        if self.compacted_until is not None and date_from is not None and date_from >= self.compacted_until:
+            self.compacted_until = None
+
+    def _measurements(self):
+        measures = Measurement.objects.filter(sensor_id=self.sensor.id)
+        if self.date_from is not None:
+            measures = measures.filter(saved__gte=self.date_from)
+        if self.date_to is not None:
+            measures = measures.filter(saved__lte=self.date_to)
+        if self.compacted_until is not None:
+            # measurements stored late for compacted days are already part of the rollups
+            measures = measures.filter(saved__gte=self.compacted_until)
+        return measures
+
+    def _rollups(self):
+        if self.compacted_until is None:
+            return MeasurementRollup.objects.none()
+        rollups = MeasurementRollup.objects.filter(sensor_id=self.sensor.id, granularity=MeasurementRollup.HOUR,
+                                                   last_saved__lt=self.compacted_until)
+        if self.date_from is not None:
+            rollups = rollups.filter(last_saved__gte=self.date_from)
+        if self.date_to is not None:
+            rollups = rollups.filter(last_saved__lte=self.date_to)
+        return rollups
+
+    def count(self):
+        return self._measurements().count() + self._rollups().count()
+
+    def rows(self, fields, descending=False):
+        '''
+        :param fields: names of the measurement columns, as passed to `values_list`
+        :param descending: newest readings first
+        :return: iterator of value tuples ordered by saved
+        '''
+        order = '-saved' if descending else 'saved'
+        measurements = self._measurements().order_by(order).values_list(*fields).iterator(
+            chunk_size=ITERATOR_CHUNK_SIZE)
+        if self.compacted_until is None:
+            return measurements
+
+        rollup_fields = ['last_saved', 'last_value', 'sensor_id']
+        positions = [rollup_fields.index(ROLLUP_FIELDS[field]) if field in ROLLUP_FIELDS else None for field in fields]
+        rollups = self._rollups().order_by(order.replace('saved', 'last_saved')).values_list(*rollup_fields).iterator(
+            chunk_size=ITERATOR_CHUNK_SIZE)
+        compacted = (tuple(None if position is None else row[position] for position in positions) for row in rollups)
+        return chain(measurements, compacted) if descending else chain(compacted, measurements)
+
+    def column_chunks(self, fields, chunk_size=ITERATOR_CHUNK_SIZE):
+        '''
+        Read the readings ordered by saved in chunks of columns, filled from the rows of every `fetchmany` of the
+        cursor without building a value tuple per reading
+        :param fields: names of the measurement columns, as passed to `values_list`
+        :param chunk_size: number of rows fetched at once
+        :return: iterator of (number of rows, list of one sequence per field) tuples
+        '''
+        if self.compacted_until is not None:
+            rollup_fields = ['last_saved', 'last_value', 'sensor_id']
+            rollups = self._rollups().order_by('last_saved').values_list(*rollup_fields)
+            for chunk in _fetch_chunks(rollups, chunk_size):
+                columns = list(zip(*chunk))
+                yield len(chunk), [columns[rollup_fields.index(ROLLUP_FIELDS[field])] if field in ROLLUP_FIELDS
+                                   else (None,) * len(chunk) for field in fields]
+
+        for chunk in _fetch_chunks(self._measurements().order_by('saved').values_list(*fields), chunk_size):
+            yield len(chunk), list(zip(*chunk))
+
+
+def _fetch_chunks(queryset, chunk_size):
+    '''
+    Rows of a `values_list` queryset, as lists of tuples returned by `fetchmany`. The rows are only rebuilt when
+    the database backend converts values, e.g. the timestamps stored as text by SQLite.
+    '''
+    connection = connections[queryset.db]
+    compiler = queryset.query.get_compiler(queryset.db)
+    chunks = compiler.execute_sql(MULTI, chunked_fetch=connection.features.can_use_chunked_reads,
+                                  chunk_size=chunk_size)
+    converters = compiler.get_converters([expression for expression, _, _ in compiler.select[:compiler.col_count]])
+    for chunk in chunks:
+        yield list(compiler.apply_converters(chunk, converters)) if converters else chunk
+
+
+def compaction_cutoff(sensor, retention_days, now=None):
+    '''
+    Start of the first day whose measurements are kept, the days shown in the snapshot of the silo are always kept
+    so it can be rebuilt from the measurements
+    '''
+    last_saved = Measurement.objects.filter(sensor_id=sensor.id).aggregate(last=Max('saved'))['last']
+    if last_saved is None:
+        return None
+    day = MeasurementRollup.BUCKET_SIZES[MeasurementRollup.DAY]
+    # one more day than kept in the snapshot, as its days are local days and the rollup days are UTC
+    return min(MeasurementRollup.truncate((now or timezone.now()) - retention_days * day, MeasurementRollup.DAY),
+               MeasurementRollup.truncate(last_saved, MeasurementRollup.DAY) - (SiloSnapshot.DAYS_KEPT + 1) * day)
+
+
+def compact(sensor, retention_days, chunk_size=DELETE_CHUNK_SIZE, now=None):
+    '''
+    Compact the measurements of the sensor older than the retention, day by day. The rollups of a day are rebuilt
+    and the day is marked as compacted in one transaction, the raw rows are deleted in chunks afterwards, so an
+    interrupted run is continued by the next one without losing data.
+    :return: number of deleted measurements
+    '''
+    cutoff = compaction_cutoff(sensor, retention_days, now)
+    day = MeasurementRollup.BUCKET_SIZES[MeasurementRollup.DAY]
+    measures = Measurement.objects.filter(sensor_id=sensor.id)
+
+    while cutoff is not None and (sensor.compacted_until is None or sensor.compacted_until < cutoff):
+        pending = measures.filter(saved__lt=cutoff)
+        if sensor.compacted_until is not None:
+            pending = pending.filter(saved__gte=sensor.compacted_until)
+        first_saved = pending.aggregate(first=Min('saved'))['first']
+        # days without measurements are skipped at once
+        next_day = MeasurementRollup.truncate(first_saved, MeasurementRollup.DAY) + day if first_saved else cutoff
+        with transaction.atomic():
+            if first_saved is not None:
+                MeasurementRollup.rebuild(sensor.id, first_saved, first_saved)
+            Sensor.objects.filter(id=sensor.id).update(compacted_until=next_day)
+        sensor.compacted_until = next_day
+
+    deleted = 0
+    if sensor.compacted_until is not None:
+        deleted = _delete_in_chunks(measures.filter(saved__lt=sensor.compacted_until), chunk_size)
+        _delete_in_chunks(MeasurementRollup.objects.filter(sensor_id=sensor.id, granularity=MeasurementRollup.MINUTE,
+                                                           bucket__lt=sensor.compacted_until), chunk_size)
+        caching.invalidate_silos(sensor.silo_set.values_list('id', flat=True))
+    return deleted
+
+
+def _delete_in_chunks(queryset, chunk_size):
+    deleted = 0
+    while True:
+        ids = list(queryset.order_by('id').values_list('id', flat=True)[:chunk_size])
+        if not ids:
+            return deleted
+        # short transactions keep the locks and the generated WAL small. The rows are deleted without loading
+        # them and without `post_delete`, which would rebuild the derived data they were compacted into already
+        deleted += queryset.model.objects.filter(id__in=ids)._raw_delete(queryset.db)
@@ -1,6 +1,9 @@
-from rest_framework import serializers
+from django.utils import timezone
+from rest_framework import ISO_8601, serializers
+from rest_framework.settings import api_settings
 
 from api import models
+from api.geometry import silo_cache
 
 
 class SensorSerializer(serializers.ModelSerializer):
@@ -9,10 +12,67 @@ class SensorSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
+class CachedSensorField(serializers.PrimaryKeyRelatedField):
+    '''
+    Sensor by its id, from the cache of the process (see `silo_cache`) instead of a query per measurement
+    '''
+
+    def to_internal_value(self, data):
+        try:
+            sensor = silo_cache.sensor(int(data))
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        if sensor is None:
+            self.fail('does_not_exist', pk_value=data)
+        return sensor
+
+
+class GeometryField(serializers.ReadOnlyField):
+    '''
+    Dimension of the silo a measurement was computed with, as the measurements stored it before geometries were
+    versioned: 0 for measurements computed without dimensions
+    '''
+
+    def __init__(self, field, **kwargs):
+        self.geometry_field = field
+        super().__init__(source='*', **kwargs)
+
+    def to_representation(self, measurement):
+        if measurement.geometry is None:
+            return 0.0
+        return getattr(measurement.geometry, self.geometry_field)
+
+
 class MeasurementSerializer(serializers.ModelSerializer):
+    sensor = CachedSensorField(queryset=models.Sensor.objects.all(), allow_null=True, required=False)
+    capacity = GeometryField('capacity')
+    radius = GeometryField('radius')
+    silo_height = GeometryField('height')
+    silo_width = GeometryField('width')
+    silo_gap_top = GeometryField('gap_top')
+    silo_gap_bottom = GeometryField('gap_bottom')
+
     class Meta:
         model = models.Measurement
-        fields = '__all__'
+        exclude = ('geometry',)
+
+    def __init__(self, *args, fields=None, **kwargs):
+        '''
+        :param fields: names of the fields to include, all fields if None
+        '''
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+class BulkMeasurementSerializer(serializers.ModelSerializer):
+    # the sensors of a whole batch are looked up once per sensor by the view instead of once per measurement
+    sensor = serializers.IntegerField()
+
+    class Meta:
+        model = models.Measurement
+        exclude = ('geometry',)
 
 
 class SiloSerializer(serializers.ModelSerializer):
@@ -39,3 +99,116 @@ class NotificationSerializer(serializers.ModelSerializer):
     class Meta:
         model = models.Notification
         fields = '__all__'
+
+
+# representation of the DRF fields which only convert the type of the value
+_CONVERSIONS = {
+    serializers.FloatField: float,
+    serializers.IntegerField: int,
+    serializers.CharField: str,
+}
+
+
+def _datetime_conversion(field):
+    output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+    field_timezone = getattr(field, 'timezone', field.default_timezone())
+    if output_format is None or output_format.lower() != ISO_8601 or field_timezone is None:
+        return field.to_representation
+
+    def convert(value):
+        if not timezone.is_aware(value):
+            return field.to_representation(value)
+        value = value.astimezone(field_timezone).isoformat()
+        return value[:-6] + 'Z' if value.endswith('+00:00') else value
+    return convert
+
+
+class ValuesSerializer:
+    '''
+    Read only counterpart of a DRF model serializer working on `values()` rows instead of model instances. The
+    representation of every field is looked up once, so serializing a row only reads its columns and converts
+    them, while the rendered JSON stays the same as the one of the DRF serializer.
+    `SerializerMethodField`s are computed by a `get_<name>(row)` method of a subclass from its `method_columns`.
+    '''
+    method_columns = ()
+
+    def __init__(self, serializer, prefix=''):
+        '''
+        :param serializer: DRF serializer instance, its (possibly reduced) fields are serialized
+        :param prefix: lookup of the columns of a nested serializer, e.g. `sensor__`
+        '''
+        self.prefix = prefix
+        self.columns = [f'{prefix}{column}' for column in self.method_columns]
+        self.accessors = [(field.field_name, self._accessor(field)) for field in serializer.fields.values()
+                          if not field.write_only]
+
+    def _column(self, column):
+        self.columns.append(f'{self.prefix}{column}')
+        return f'{self.prefix}{column}'
+
+    def _accessor(self, field):
+        if isinstance(field, serializers.SerializerMethodField):
+            return getattr(self, f'get_{field.field_name}')
+        if isinstance(field, GeometryField):
+            column = self._column(f'geometry__{field.geometry_field}')
+            return lambda row: 0.0 if row[column] is None else row[column]
+        if isinstance(field, serializers.ModelSerializer):
+            nested = ValuesSerializer(field, f'{self.prefix}{field.source}__')
+            self.columns += nested.columns
+            primary_key = f'{nested.prefix}{field.Meta.model._meta.pk.name}'
+            return lambda row: None if row[primary_key] is None else nested.to_representation(row)
+
+        column = self._column(field.source)
+        if isinstance(field, serializers.PrimaryKeyRelatedField) and field.pk_field is None:
+            # the column of a foreign key already is the primary key of the related row
+            return lambda row: row[column]
+        if isinstance(field, serializers.DateTimeField):
+            convert = _datetime_conversion(field)
+        else:
+            convert = _CONVERSIONS.get(type(field), field.to_representation)
+        return lambda row: None if row[column] is None else convert(row[column])
+
+    def prepare(self, row):
+        '''
+        Hook to add what the method fields need to the row before it is serialized
+        '''
+        return row
+
+    def to_representation(self, row):
+        row = self.prepare(row)
+        return {name: accessor(row) for name, accessor in self.accessors}
+
+    def serialize(self, rows):
+        return [self.to_representation(row) for row in rows]
+
+    def values(self, queryset, *columns):
+        '''
+        :param columns: columns needed besides the serialized ones
+        :return: `values()` queryset with the columns needed to serialize its rows
+        '''
+        return queryset.values(*dict.fromkeys(list(columns) + self.columns))
+
+
+class SiloValuesSerializer(ValuesSerializer):
+    '''
+    `SiloSerializer` of `values()` rows, the method fields are computed from the snapshot columns
+    '''
+    method_columns = ('id', 'sensor', 'snapshot__id', 'snapshot__value', 'snapshot__saved',
+                      'snapshot__closing_values')
+
+    def prepare(self, row):
+        if row['snapshot__id'] is None:
+            row['snapshot'] = models.SiloSnapshot.rebuild(models.Silo(id=row['id'], sensor_id=row['sensor']))
+        else:
+            row['snapshot'] = models.SiloSnapshot(value=row['snapshot__value'], saved=row['snapshot__saved'],
+                                                  closing_values=row['snapshot__closing_values'])
+        return row
+
+    def get_values_by_day(self, row):
+        return row['snapshot'].values_by_day()
+
+    def get_last_update(self, row):
+        return row['snapshot'].last_update()
+
+    def get_percentage(self, row):
+        return row['snapshot'].percentage()
@@ -1,12 +1,31 @@
+import asyncio
+import gzip
+import io
+import json
+import os
+import tempfile
 from datetime import datetime
-from unittest import mock
+from unittest import mock, skipIf
 
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import QuerySet
 from django.db.models.functions import Trunc
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 from freezegun import freeze_time
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
 
-from api.models import Silo, Sensor, Measurement
+from api import authentication, benchmarks, caching, downsampling, exports, ingestion, listener, metrics, notifications, \
+    serializers, views
+from api.geometry import FillCalculator, silo_cache
+from api.models import Silo, Sensor, Measurement, MeasurementRollup, Notification, OutgoingNotification, \
+    SiloAlertState, SiloSnapshot
+from api.retention import Readings
 from api.views import MeasurementViewSet
 
 
@@ -61,6 +80,37 @@ class SiloTest(TestCase):
         self.assertEquals(result.pop('2019-05-23', 'skipped'),
                           'skipped')
 
+    def test_snapshot_follows_new_measurements(self):
+        sensor = Sensor.objects.create(serial_number='222')
+        silo = Silo.objects.create(name="test_silo", sensor=sensor)
+
+        values = {
+            datetime(2019, 5, 17, 9, tzinfo=timezone.utc): 6,
+            datetime(2019, 5, 18, 9, tzinfo=timezone.utc): 5,
+            datetime(2019, 5, 19, 9, 1, tzinfo=timezone.utc): 4,
+            datetime(2019, 5, 19, 9, 0, tzinfo=timezone.utc): 2,
+            datetime(2019, 5, 20, 9, tzinfo=timezone.utc): 1,
+        }
+
+        self.persist_test_measurements(sensor, values)
+
+        silo = Silo.objects.select_related('snapshot').get(id=silo.id)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(1, silo.percentage())
+            self.assertEqual({'2019-05-19': 4, '2019-05-18': 5, '2019-05-17': 6}, silo.values_by_day())
+
+    @skipIf(not connection.features.has_select_for_update, 'the database does not lock rows')
+    def test_snapshot_is_locked_while_recording_measurements(self):
+        sensor = Sensor.objects.create(serial_number='222')
+        Silo.objects.create(name="test_silo", sensor=sensor)
+
+        with CaptureQueriesContext(connection) as queries:
+            Measurement.objects.create(sensor=sensor, value=50)
+
+        self.assertTrue(any('FOR UPDATE' in query['sql'] and SiloSnapshot._meta.db_table in query['sql']
+                            for query in queries.captured_queries))
+
     @freeze_time("2019-03-23 18:45")
     def test_measures_by_hour(self):
         view = MeasurementViewSet()
@@ -91,6 +141,25 @@ class SiloTest(TestCase):
             {"19:39": 50.0, "19:40": 56.0, "19:41": 58.0, "19:42": 62.0, "19:43": 64.0}
         )
 
+    def test_all_values_for_silo(self):
+        view = MeasurementViewSet()
+        sensor, silo_id = self.persist_test_sensor_and_silo()
+
+        values = {
+            datetime(2019, 3, 23, 14, 43, 30, tzinfo=timezone.utc): 64,
+            datetime(2019, 3, 23, 14, 42, 31, tzinfo=timezone.utc): 62,
+            datetime(2019, 3, 22, 11, 39, 30, tzinfo=timezone.utc): 50,
+        }
+
+        self.persist_test_measurements(sensor, values)
+
+        response = view.all_values_for_silo(None, silo_id)
+
+        self.assertJSONEqual(
+            b''.join(response.streaming_content).decode('utf8'),
+            {"2019-03-23": {"14:43": 64.0, "14:42": 62.0}, "2019-03-22": {"11:39": 50.0}}
+        )
+
     def persist_test_sensor_and_silo(self):
         sensor_id = 1
         silo_id = 11
@@ -180,6 +249,25 @@ class SiloTest(TestCase):
              "06.03": 52.0, "05.03": 50.0}
         )
 
+    def test_rebuilt_rollups_match_incremental_rollups(self):
+        sensor, silo_id = self.persist_test_sensor_and_silo()
+        self.create_a_lot_of_test_measures(sensor)
+
+        fields = ('granularity', 'bucket', 'last_value', 'last_saved', 'min_value', 'max_value', 'value_sum', 'count')
+        incremental = list(MeasurementRollup.objects.order_by('granularity', 'bucket').values_list(*fields))
+        MeasurementRollup.rebuild(sensor.id)
+        rebuilt = list(MeasurementRollup.objects.order_by('granularity', 'bucket').values_list(*fields))
+
+        self.assertEqual(incremental, rebuilt)
+        self.assertIn(('day', datetime(2019, 3, 13, tzinfo=timezone.utc), 64,
+                       datetime(2019, 3, 13, 15, 46, 30, tzinfo=timezone.utc), 63, 64, 253.1, 4), rebuilt)
+
+    def test_measures_by_custom_dates_ending_within_bucket(self):
+        date_from = "2019-03-13T00:00:04.111Z"
+        date_to = "2019-03-13T15:45:04.111Z"
+        expected_data = {"14:00": 63.0, "16:00": 63.1}
+        self.base_test_measures_by_custom_date(date_from, date_to, expected_data)
+
     def test_measures_by_custom_dates_less_than_hour(self):
         date_from = "2019-03-13T15:30:04.111Z"
         date_to = "2019-03-13T16:00:04.111Z"
@@ -220,6 +308,33 @@ class SiloTest(TestCase):
         expected_data = {}
         self.base_test_measures_by_custom_date(date_from, date_to, expected_data)
 
+    def test_latest_per_bucket(self):
+        sensor, silo_id = self.persist_test_sensor_and_silo()
+        self.create_a_lot_of_test_measures(sensor)
+        # the same timestamp as the latest measurement of a day, but of another sensor and of another day
+        other_sensor = Sensor.objects.create(serial_number='other')
+        self.persist_test_measurements(other_sensor, {datetime(2019, 3, 13, 15, 46, 30, tzinfo=timezone.utc): 1})
+        self.persist_test_measurements(sensor, {datetime(2019, 3, 15, 15, 44, 31, tzinfo=timezone.utc): 66.5})
+
+        measures = Measurement.objects.filter(sensor=sensor, saved__gte=datetime(2019, 3, 13, tzinfo=timezone.utc))
+        expected = [(datetime(2019, 3, 13, 15, 46, 30, tzinfo=timezone.utc), 64),
+                    (datetime(2019, 3, 15, 15, 44, 31, tzinfo=timezone.utc), 66.5),
+                    (datetime(2019, 3, 23, 14, 48, 30, tzinfo=timezone.utc), 68)]
+        truncation = Trunc('saved', 'day', tzinfo=timezone.utc)
+
+        self.assertEqual(expected, [(m.saved, m.value) for m in measures.latest_per_bucket(truncation)])
+        with mock.patch('django.db.connection.features.supports_over_clause', False):
+            self.assertEqual(expected, [(m.saved, m.value) for m in measures.latest_per_bucket(truncation)])
+
+    @freeze_time("2019-03-23 18:45")
+    def test_measures_by_truncation_without_rollups(self):
+        sensor, silo_id = self.persist_test_sensor_and_silo()
+        self.create_a_lot_of_test_measures(sensor)
+
+        response = MeasurementViewSet._get_measures_as_json_response(
+            "%d.%m", silo_id, Trunc('saved', 'week', tzinfo=timezone.utc), delta=timezone.timedelta(days=30))
+        self.assertJSONEqual(str(response.content, encoding='utf8'), {"10.03": 62.0, "15.03": 66.0, "23.03": 68.0})
+
     @freeze_time("2019-03-23 18:45")
     def base_test_measures_by_custom_date(self, date_from, date_to, expected_data):
         view = MeasurementViewSet()
@@ -271,8 +386,1042 @@ class SiloTest(TestCase):
 
     @staticmethod
     def persist_test_measurements(sensor, values):
-        # this is needed to bypass `auto_now_add` in `saved` field
+        # `saved` defaults to the current time
         with mock.patch('django.utils.timezone.now') as mock_now:
             for key, value in values.items():
                 mock_now.return_value = key
                 Measurement.objects.create(sensor=sensor, value=value)
+
+
+class MeasurementCreateTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='farmer', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.sensor = Sensor.objects.create(serial_number='222', user=self.user)
+        self.silo = Silo.objects.create(name="test_silo", sensor=self.sensor, height=10, width=2, gap_top=1,
+                                        gap_bottom=1)
+
+    @mock.patch.object(MeasurementViewSet, 'send_notification')
+    def test_create_bulk(self, send_notification):
+        readings = [{"sensor": self.sensor.id, "value": distance, "temperature": 21}
+                    for distance in (1000, 4000, 7000, 5000)]
+
+        response = self.client.post('/measurement/bulk/', readings, format='json', secure=True)
+
+        self.assertEqual(201, response.status_code)
+        self.assertEqual({"created": 4}, response.json())
+        self.assertEqual([87.5, 50.0, 12.5, 37.5],
+                         list(Measurement.objects.order_by('id').values_list('value', flat=True)))
+        self.assertEqual(37.5, Silo.objects.get(id=self.silo.id).percentage())
+        send_notification.assert_has_calls([mock.call("test_silo", 60, topic='farmer'),
+                                            mock.call("test_silo", 20, topic='farmer')])
+        self.assertEqual(2, send_notification.call_count)
+
+    def test_create_bulk_keeps_the_order_of_the_readings(self):
+        other_sensor = Sensor.objects.create(serial_number='333', user=self.user)
+        readings = [{"sensor": sensor.id, "value": distance}
+                    for sensor, distance in ((self.sensor, 1000), (other_sensor, 2000), (self.sensor, 3000),
+                                             (other_sensor, 4000))]
+
+        self.client.post('/measurement/bulk/', readings, format='json', secure=True)
+
+        # the other sensor is not mounted in a silo, its values are not converted into percentages
+        self.assertEqual([(self.sensor.id, 87.5), (other_sensor.id, 2000), (self.sensor.id, 62.5),
+                          (other_sensor.id, 4000)],
+                         list(Measurement.objects.order_by('id').values_list('sensor_id', 'value')))
+
+    @mock.patch.object(MeasurementViewSet, 'send_notification')
+    def test_measurements_reference_geometry_versions(self, send_notification):
+        self.client.post('/measurement/', {"sensor": self.sensor.id, "value": 1000}, format='json', secure=True)
+        self.client.post('/measurement/', {"sensor": self.sensor.id, "value": 4000}, format='json', secure=True)
+        self.silo.height = 12
+        self.silo.save()
+        response = self.client.post('/measurement/', {"sensor": self.sensor.id, "value": 4000}, format='json',
+                                    secure=True)
+
+        self.assertEqual({"capacity": 31.42, "radius": 1.0, "silo_height": 12.0, "silo_width": 2.0,
+                          "silo_gap_top": 1.0, "silo_gap_bottom": 1.0, "value": 60.0},
+                         {key: response.json()[key] for key in ("capacity", "radius", "silo_height", "silo_width",
+                                                                "silo_gap_top", "silo_gap_bottom", "value")})
+        self.assertNotIn("geometry", response.json())
+        self.assertEqual([(1, 10), (1, 10), (2, 12)], list(Measurement.objects.order_by('id').values_list(
+            'geometry__version', 'geometry__height')))
+        self.assertEqual(0.0, self.client.get(f'/measurement/{Measurement.objects.create(sensor=self.sensor).id}/',
+                                              secure=True).json()["capacity"])
+
+    @mock.patch.object(MeasurementViewSet, 'send_notification')
+    def test_silo_list_follows_edited_and_deleted_measurements(self, send_notification):
+        for distance in (1000, 4000):
+            self.client.post('/measurement/', {"sensor": self.sensor.id, "value": distance}, format='json',
+                             secure=True)
+        first, last = Measurement.objects.order_by('id')
+
+        def percentage():
+            return self.client.get('/silo/', secure=True).json()[0]["percentage"]
+
+        self.assertEqual(50.0, percentage())
+        self.assertEqual(200, self.client.patch(f'/measurement/{last.id}/', {"value": 30}, format='json',
+                                                secure=True).status_code)
+        self.assertEqual(30.0, percentage())
+        self.assertEqual(204, self.client.delete(f'/measurement/{last.id}/', secure=True).status_code)
+        self.assertEqual(87.5, percentage())
+        first.delete()
+        self.assertEqual("N/A", percentage())
+
+    def test_graph_follows_edited_and_deleted_measurements(self):
+        SiloTest.persist_test_measurements(self.sensor, {datetime(2019, 3, 1, 10, 40, tzinfo=timezone.utc): 41,
+                                                         datetime(2019, 3, 1, 11, 10, tzinfo=timezone.utc): 42})
+        url = f'/measurement/graph/{self.silo.id}/2019-03-01T08:00:00.000Z/2019-03-01T13:00:00.000Z/'
+        self.assertEqual({"11:40": 41.0, "12:10": 42.0}, self.client.get(url, secure=True).json())
+        first, last = Measurement.objects.order_by('saved')
+
+        last.saved = datetime(2019, 3, 1, 11, 50, tzinfo=timezone.utc)
+        last.value = 45
+        last.save()
+        self.assertEqual({"11:40": 41.0, "12:50": 45.0}, self.client.get(url, secure=True).json())
+
+        self.assertEqual(204, self.client.delete(f'/measurement/{first.id}/', secure=True).status_code)
+        self.assertEqual({"12:50": 45.0}, self.client.get(url, secure=True).json())
+        self.assertEqual([(1, 45.0)], list(MeasurementRollup.objects.filter(granularity='day').values_list(
+            'count', 'last_value')))
+
+    def test_recompute_measurements(self):
+        self.client.post('/measurement/bulk/', [{"sensor": self.sensor.id, "value": distance}
+                                                for distance in (1000, 4000)], format='json', secure=True)
+        self.silo.gap_top = 2
+        self.silo.save()
+
+        call_command('recompute_measurements', self.silo.id, '--chunk-size', '1', stdout=io.StringIO())
+
+        self.assertEqual([(85.71, 1000, 2), (42.86, 4000, 2)], list(
+            Measurement.objects.order_by('id').values_list('value', 'distance', 'geometry__gap_top')))
+        self.assertEqual(42.86, MeasurementRollup.objects.get(granularity='day').last_value)
+        self.assertEqual(42.86, Silo.objects.get(id=self.silo.id).percentage())
+
+    def test_graph_is_cached_until_new_measurement(self):
+        url = f'/measurement/graph/{self.silo.id}/hour/'
+        self.client.post('/measurement/', {"sensor": self.sensor.id, "value": 1000}, format='json', secure=True)
+
+        response = self.client.get(url, secure=True)
+        etag = response['ETag']
+        with self.assertNumQueries(0):
+            self.assertEqual(304, self.client.get(url, HTTP_IF_NONE_MATCH=etag, secure=True).status_code)
+            self.assertEqual(response.content, self.client.get(url, secure=True).content)
+
+        self.client.post('/measurement/', {"sensor": self.sensor.id, "value": 4000}, format='json', secure=True)
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag, secure=True)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual([50.0], list(response.json().values()))
+
+    def test_graph_of_silo_without_snapshot_follows_new_measurement(self):
+        url = f'/measurement/graph/{self.silo.id}/hour/'
+        self.client.post('/measurement/', {"sensor": self.sensor.id, "value": 1000}, format='json', secure=True)
+        SiloSnapshot.objects.filter(silo_id=self.silo.id).delete()
+        etag = self.client.get(url, secure=True)['ETag']
+
+        self.client.post('/measurement/', {"sensor": self.sensor.id, "value": 4000}, format='json', secure=True)
+
+        self.assertEqual(200, self.client.get(url, HTTP_IF_NONE_MATCH=etag, secure=True).status_code)
+
+    def test_cached_responses_follow_edited_measurements_and_sensors(self):
+        self.client.post('/measurement/', {"sensor": self.sensor.id, "value": 1000}, format='json', secure=True)
+        measurement = Measurement.objects.get()
+
+        def etags():
+            return (self.client.get(f'/measurement/graph/{self.silo.id}/hour/', secure=True)['ETag'],
+                    self.client.get('/silo/', secure=True)['ETag'])
+
+        graph_etag, list_etag = etags()
+        self.client.patch(f'/measurement/{measurement.id}/', {"value": 30}, format='json', secure=True)
+        edited_graph_etag, edited_list_etag = etags()
+        self.assertNotEqual(graph_etag, edited_graph_etag)
+        self.assertNotEqual(list_etag, edited_list_etag)
+
+        self.sensor.serial_number = '223'
+        self.sensor.save()
+        self.assertEqual(edited_graph_etag, etags()[0])
+        self.assertNotEqual(edited_list_etag, etags()[1])
+        self.assertEqual('223', self.client.get('/silo/', secure=True).json()[0]["sensor"]["serial_number"])
+
+        self.client.delete(f'/measurement/{measurement.id}/', secure=True)
+        self.assertEqual({}, self.client.get(f'/measurement/graph/{self.silo.id}/hour/', secure=True).json())
+
+    @freeze_time("2019-03-23 18:45")
+    def test_graphs_of_several_silos(self):
+        other_sensor = Sensor.objects.create(serial_number='333', user=self.user)
+        other_silo = Silo.objects.create(name="other_silo", sensor=other_sensor)
+        foreign_silo = Silo.objects.create(name="foreign_silo", sensor=Sensor.objects.create(serial_number='444'))
+        SiloTest.persist_test_measurements(self.sensor, {datetime(2019, 3, 23, 14, 43, 30, tzinfo=timezone.utc): 64,
+                                                         datetime(2019, 3, 23, 14, 42, 30, tzinfo=timezone.utc): 62,
+                                                         datetime(2019, 3, 23, 13, 42, 30, tzinfo=timezone.utc): 60})
+        SiloTest.persist_test_measurements(other_sensor, {datetime(2019, 3, 23, 12, 42, 30, tzinfo=timezone.utc): 30})
+
+        with self.assertNumQueries(2):
+            response = self.client.get('/measurement/graph-batch/day/',
+                                       {'silos': f'{self.silo.id},{other_silo.id},{foreign_silo.id}'}, secure=True)
+
+        self.assertEqual({str(self.silo.id): {"14:00": 60.0, "15:00": 64.0}, str(other_silo.id): {"13:00": 30.0}},
+                         response.json())
+
+    def test_create_bulk_rejects_oversized_batches_before_validating(self):
+        readings = [{"sensor": self.sensor.id, "value": 1000}] * (views.MAX_BULK_MEASUREMENTS + 1)
+
+        with mock.patch.object(serializers.BulkMeasurementSerializer, 'is_valid') as is_valid:
+            response = self.client.post('/measurement/bulk/', readings, format='json', secure=True)
+            self.assertEqual(400, self.client.post('/measurement/bulk/', {"sensor": self.sensor.id, "value": 1000},
+                                                   format='json', secure=True).status_code)
+
+        self.assertEqual(400, response.status_code)
+        self.assertEqual({"message": f"At most {views.MAX_BULK_MEASUREMENTS} measurements can be sent at once"},
+                         response.json())
+        is_valid.assert_not_called()
+        self.assertFalse(Measurement.objects.exists())
+
+    def test_create_bulk_for_foreign_sensor(self):
+        foreign_sensor = Sensor.objects.create(serial_number='333')
+
+        response = self.client.post('/measurement/bulk/', [{"sensor": self.sensor.id, "value": 1000},
+                                                           {"sensor": foreign_sensor.id, "value": 1000}],
+                                    format='json', secure=True)
+
+        self.assertEqual(403, response.status_code)
+        self.assertFalse(Measurement.objects.exists())
+
+
+class MeasurementListTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='farmer', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.sensor = Sensor.objects.create(serial_number='222', user=self.user)
+        self.other_sensor = Sensor.objects.create(serial_number='333', user=self.user)
+        start = datetime(2019, 3, 23, 12, tzinfo=timezone.utc)
+        # both sensors save at the same times, so pages have to break ties by id
+        for sensor in (self.sensor, self.other_sensor):
+            SiloTest.persist_test_measurements(sensor, {start + timezone.timedelta(hours=hours): 10 * hours
+                                                        for hours in range(3)})
+        SiloTest.persist_test_measurements(Sensor.objects.create(serial_number='444'), {start: 99})
+
+    def list_all(self, url, params):
+        pages = []
+        response = self.client.get(url, params, secure=True)
+        while True:
+            self.assertEqual(200, response.status_code)
+            pages.append(response.json()["results"])
+            if response.json()["next"] is None:
+                return pages
+            response = self.client.get(response.json()["next"], secure=True)
+
+    def test_pages_follow_saved_and_id(self):
+        pages = self.list_all('/measurement/', {'page_size': 2})
+
+        expected = list(Measurement.objects.filter(sensor__user=self.user).order_by('-saved', '-id').values_list(
+            'id', flat=True))
+        self.assertEqual([2, 2, 2], [len(page) for page in pages])
+        self.assertEqual(expected, [measurement["id"] for page in pages for measurement in page])
+
+        pages = self.list_all('/measurement/', {'page_size': 4, 'ordering': 'saved'})
+        self.assertEqual(expected[::-1], [measurement["id"] for page in pages for measurement in page])
+
+    def test_filters(self):
+        response = self.client.get('/measurement/', {'sensor': self.sensor.id, 'since': '2019-03-23T13:00:00Z',
+                                                     'until': '2019-03-23T14:00:00Z'}, secure=True)
+
+        self.assertEqual([(self.sensor.id, 20.0), (self.sensor.id, 10.0)],
+                         [(measurement["sensor"], measurement["value"]) for measurement in response.json()["results"]])
+        self.assertEqual(400, self.client.get('/measurement/', {'since': 'yesterday'}, secure=True).status_code)
+        self.assertEqual(400, self.client.get('/measurement/', {'cursor': 'invalid'}, secure=True).status_code)
+
+    def test_sparse_fields(self):
+        response = self.client.get('/measurement/', {'fields': 'saved,value,capacity', 'page_size': 1}, secure=True)
+
+        self.assertEqual([{"saved": "2019-03-23T15:00:00+01:00", "value": 20.0, "capacity": 0.0}],
+                         response.json()["results"])
+        response = self.client.get('/measurement/', {'fields': 'value,password'}, secure=True)
+        self.assertEqual(400, response.status_code)
+        self.assertEqual(["password"], response.json()["fields"])
+
+
+class ValuesSerializerTest(TestCase):
+    '''
+    The serializers of `values()` rows have to render exactly the same JSON as the DRF serializers
+    '''
+
+    def setUp(self):
+        sensor = Sensor.objects.create(serial_number='222', user=User.objects.create_user(username='farmer'))
+        self.silo = Silo.objects.create(name="test_silo", sensor=sensor, height=10, width=2, gap_top=1, gap_bottom=1,
+                                        raw_retention_days=30)
+        Silo.objects.create(name="empty_silo", location="Farm", sensor=Sensor.objects.create(serial_number='333'))
+        Silo.objects.create(name="silo_without_sensor")
+        calculator = FillCalculator.for_silo(self.silo)
+        SiloTest.persist_test_measurements(sensor, {datetime(2019, 3, 21, 14, 42, 30, 123456, tzinfo=timezone.utc): 60,
+                                                    datetime(2019, 3, 23, 14, 42, 30, tzinfo=timezone.utc): 64})
+        Measurement.objects.create(sensor=sensor, temperature=-3.5, sensor_timestamp='1553352150',
+                                   read=datetime(2019, 3, 23, 14, 40, tzinfo=timezone.utc), acc='0,0,1',
+                                   **calculator.measurement_fields([4000])[0])
+        Measurement.objects.create(sensor=None)
+
+    def assertSameJson(self, serializer_class, values_serializer_class, queryset, **kwargs):
+        values_serializer = values_serializer_class(serializer_class(**kwargs))
+        self.assertEqual(JSONRenderer().render(serializer_class(queryset, many=True, **kwargs).data),
+                         JSONRenderer().render(values_serializer.serialize(values_serializer.values(queryset))))
+
+    def test_silos(self):
+        silos = Silo.objects.select_related('sensor', 'snapshot').order_by('name')
+        Silo.objects.get(name="empty_silo").snapshot.delete()
+
+        for current_timezone in ('Europe/Zurich', 'UTC'):
+            with self.subTest(timezone=current_timezone), timezone.override(current_timezone):
+                self.assertSameJson(serializers.SiloSerializer, serializers.SiloValuesSerializer, silos)
+        # missing snapshots are built like by the models
+        self.assertTrue(Silo.objects.get(name="empty_silo").snapshot.pk)
+
+    def test_measurements(self):
+        measurements = Measurement.objects.select_related('geometry').order_by('id')
+
+        for current_timezone in ('Europe/Zurich', 'UTC'):
+            with self.subTest(timezone=current_timezone), timezone.override(current_timezone):
+                self.assertSameJson(serializers.MeasurementSerializer, serializers.ValuesSerializer, measurements)
+        fields = ['capacity', 'saved', 'sensor']
+        self.assertSameJson(serializers.MeasurementSerializer, serializers.ValuesSerializer, measurements,
+                            fields=fields)
+        self.assertEqual({'saved', 'sensor', 'geometry__capacity'}, set(serializers.ValuesSerializer(
+            serializers.MeasurementSerializer(fields=fields)).columns))
+
+
+class QueryCountTest(TestCase):
+    '''
+    The number of queries of the endpoints has to stay the same however many silos, measurements
+    and notifications there are
+    '''
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='farmer', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.silos = []
+
+    def grow_fixtures(self, silos):
+        for index in range(len(self.silos), silos):
+            sensor = Sensor.objects.create(serial_number=f'{index}', user=self.user)
+            self.silos.append(Silo.objects.create(name=f"silo {index}", sensor=sensor, height=10, width=2))
+            SiloTest.persist_test_measurements(sensor, {
+                timezone.now() - timezone.timedelta(minutes=minutes): 50 + index for minutes in range(0, 5000, 250)})
+            Notification.objects.create(title=self.silos[0].name, body=f"{index}")
+        caching.invalidate_silos([silo.id for silo in self.silos])
+
+    def assertConstantQueries(self, expected, request):
+        for silos in (1, 5):
+            self.grow_fixtures(silos)
+            # the silos cached per process are loaded once, the cached responses are dropped again
+            request()
+            caching.invalidate_silos([silo.id for silo in self.silos])
+            with self.assertNumQueries(expected):
+                response = request()
+                if response.streaming:
+                    b''.join(response.streaming_content)
+            self.assertLess(response.status_code, 300)
+
+    def test_silo_list(self):
+        self.assertConstantQueries(1, lambda: self.client.get('/silo/', secure=True))
+
+    def test_notification_list(self):
+        self.assertConstantQueries(2, lambda: self.client.get('/notification/', secure=True))
+
+    def test_create_measurement(self):
+        # the sensor, its silo and geometry are cached, only the measurement and what is derived from it is written
+        # (two of the queries are the savepoint of the locked alert state, a transaction outside of tests)
+        self.assertConstantQueries(11, lambda: self.client.post(
+            '/measurement/', {"sensor": self.silos[0].sensor_id, "value": 3000}, format='json', secure=True))
+
+    def test_graphs(self):
+        for timespan in ('hour', 'day', 'week', 'month'):
+            with self.subTest(timespan=timespan):
+                # minute graphs check whether the range was compacted
+                self.assertConstantQueries(4 if timespan == 'hour' else 3, lambda: self.client.get(
+                    f'/measurement/graph/{self.silos[0].id}/{timespan}/', secure=True))
+                caching.invalidate_silos([self.silos[0].id])
+
+    def test_measurement_list(self):
+        self.assertConstantQueries(1, lambda: self.client.get('/measurement/', {'page_size': 10}, secure=True))
+
+    def test_deep_measurement_list_page(self):
+        self.grow_fixtures(5)
+        cursor = self.client.get('/measurement/', {'page_size': 90}, secure=True).json()["next"]
+        with self.assertNumQueries(1):
+            self.assertEqual(10, len(self.client.get(cursor, secure=True).json()["results"]))
+
+    def test_graph_batch(self):
+        self.assertConstantQueries(2, lambda: self.client.get(
+            '/measurement/graph-batch/day/', {'silos': ','.join(str(silo.id) for silo in self.silos)}, secure=True))
+
+    def test_graph_with_time_interval(self):
+        self.assertConstantQueries(3, lambda: self.client.get(
+            f'/measurement/graph/{self.silos[0].id}/2019-03-01T00:00:00.000Z/2019-03-02T00:00:00.000Z/', secure=True))
+
+
+class IngestionCacheTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='gateway', password='password')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.get(user=self.user).key}')
+        self.sensor = Sensor.objects.create(serial_number='222', user=self.user)
+        Silo.objects.create(name="test_silo", sensor=self.sensor, height=10, width=2)
+
+    def post_measurement(self):
+        return self.client.post('/measurement/', {"sensor": self.sensor.id, "value": 3000}, format='json',
+                                secure=True)
+
+    def test_token_and_sensor_are_cached(self):
+        self.assertEqual(201, self.post_measurement().status_code)
+
+        with self.assertNumQueries(11):
+            self.assertEqual(201, self.post_measurement().status_code)
+
+    def test_invalidation(self):
+        self.post_measurement()
+
+        self.sensor.user = User.objects.create_user(username='other')
+        self.sensor.save()
+        self.assertEqual(403, self.post_measurement().status_code)
+        self.sensor.user = self.user
+        self.sensor.save()
+        self.assertEqual(201, self.post_measurement().status_code)
+
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(401, self.post_measurement().status_code)
+        self.user.is_active = True
+        self.user.save()
+        self.assertEqual(201, self.post_measurement().status_code)
+
+        Token.objects.filter(user=self.user).delete()
+        self.assertEqual(401, self.post_measurement().status_code)
+
+    def test_unknown_sensor_is_not_cached(self):
+        response = self.client.post('/measurement/', {"sensor": self.sensor.id + 1, "value": 3000}, format='json',
+                                    secure=True)
+        self.assertEqual(400, response.status_code)
+
+        sensor = Sensor.objects.create(serial_number='333', user=self.user)
+        self.assertEqual(201, self.client.post('/measurement/', {"sensor": sensor.id, "value": 3000}, format='json',
+                                               secure=True).status_code)
+
+    @override_settings(TOKEN_CACHE_SIZE=2)
+    def test_least_recently_used_tokens_are_dropped(self):
+        authentication.token_cache.clear()
+        for key in ('a', 'b', 'a', 'c'):
+            authentication.token_cache.get(key, lambda: key.upper())
+
+        self.assertEqual(2, len(authentication.token_cache))
+        self.assertEqual('A', authentication.token_cache.get('a', lambda: None))
+        self.assertIsNone(authentication.token_cache.get('b', lambda: None))
+
+
+class SensorListenerTest(TestCase):
+
+    def setUp(self):
+        sensor = Sensor.objects.create(serial_number='222', user=User.objects.create_user(username='farmer'))
+        Silo.objects.create(name="test_silo", sensor=sensor, height=10, width=2, gap_top=1, gap_bottom=1)
+        self.buffer = ingestion.ReadingBuffer(listener.store_sensor_readings, batch_size=2)
+        self.listener = listener.SensorListener(self.buffer)
+
+    def test_parse_reading(self):
+        self.assertEqual(('222', {"value": 1000.0, "temperature": 21.5, "humidity": 40.0, "pressure": 1013.0,
+                                  "acc": "0,0,1", "sensor_timestamp": "1553352150"}),
+                         listener.parse_reading('222 1000 21.5 40 1013 0,0,1 1553352150'))
+        self.assertEqual(('222', {"value": 1000.0}), listener.parse_reading(' 222\t1000 '))
+        for line in ('222', '222 far', '222 nan', '222 1000 1 2 3 4 5 6', f'222 1 1 1 1 {"0" * 31}'):
+            with self.subTest(line=line), self.assertRaises(ValueError):
+                listener.parse_reading(line)
+
+    def test_tcp_lines_are_answered_and_stored(self):
+        protocol = listener._StreamProtocol(self.listener)
+        protocol.connection_made(mock.Mock())
+        protocol.data_received(b'222 1000 21.5\r\n222 far\n222 70')
+        protocol.data_received(b'00\nUNKNOWN 1000\n')
+
+        self.assertEqual([b'OK\n', b"ERR could not convert string to float: 'far'\n", b'OK\n', b'OK\n'],
+                         [call[0][0] for call in protocol.transport.write.call_args_list])
+        with self.assertLogs('api.listener', 'WARNING'):
+            self.assertEqual(3, self.buffer.flush())
+        self.assertEqual([(87.5, 1000, 21.5), (12.5, 7000, 0)], list(
+            Measurement.objects.order_by('id').values_list('value', 'distance', 'temperature')))
+        self.assertEqual(12.5, Silo.objects.get(name="test_silo").percentage())
+        self.assertEqual(['farmer'], list(OutgoingNotification.objects.values_list('topic', flat=True)))
+
+        protocol.data_received(b'1' * (listener.MAX_LINE_LENGTH + 1))
+        protocol.transport.close.assert_called_once_with()
+
+    def test_udp_datagrams(self):
+        protocol = listener._DatagramProtocol(self.listener)
+        with self.assertLogs('api.listener', 'WARNING'):
+            protocol.datagram_received(b'222 1000\n222 4000\n\n222 -', ('127.0.0.1', 5000))
+
+        self.buffer.close()
+        self.assertEqual([87.5, 50.0], list(Measurement.objects.order_by('id').values_list('value', flat=True)))
+
+    def test_serve(self):
+        received = []
+        buffer = ingestion.ReadingBuffer(received.extend, flush_interval=0.01)
+
+        async def send_and_stop(stop, addresses):
+            (_, udp_port), (_, tcp_port) = await addresses
+            loop = asyncio.get_event_loop()
+            transport, _ = await loop.create_datagram_endpoint(asyncio.DatagramProtocol,
+                                                               remote_addr=('127.0.0.1', udp_port))
+            transport.sendto(b'222 1000')
+            transport.close()
+            reader, writer = await asyncio.open_connection('127.0.0.1', tcp_port)
+            writer.write(b'222 4000 20\n')
+            self.assertEqual(b'OK\n', await reader.readline())
+            writer.close()
+            while len(received) < 2:
+                await asyncio.sleep(0.01)
+            stop.set()
+
+        async def run():
+            stop = asyncio.Event()
+            addresses = asyncio.get_event_loop().create_future()
+            await asyncio.gather(listener.serve(listener.SensorListener(buffer), '127.0.0.1', 0, 0, stop,
+                                                lambda *bound: addresses.set_result(bound)),
+                                 asyncio.wait_for(send_and_stop(stop, addresses), 10))
+
+        # a loop of its own, which is closed afterwards
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(run())
+        finally:
+            loop.close()
+        self.assertEqual([{"serial_number": '222', "value": 1000.0},
+                          {"serial_number": '222', "value": 4000.0, "temperature": 20.0}],
+                         sorted(({key: value for key, value in reading.items() if key != 'saved'}
+                                 for reading in received), key=lambda reading: reading["value"]))
+
+
+class IngestionBufferTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='farmer', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.sensor = Sensor.objects.create(serial_number='222', user=self.user)
+        self.silo = Silo.objects.create(name="test_silo", sensor=self.sensor, height=10, width=2, gap_top=1,
+                                        gap_bottom=1)
+        self.addCleanup(ingestion.close_buffer)
+
+    def test_flush_stores_all_waiting_readings_in_one_transaction(self):
+        stored = []
+        buffer = ingestion.ReadingBuffer(stored.append, batch_size=2)
+        futures = [buffer.add({"value": value}) for value in (1, 2, 3)]
+
+        with mock.patch.object(ingestion.transaction, 'atomic', wraps=ingestion.transaction.atomic) as atomic:
+            self.assertEqual(3, buffer.flush())
+
+        atomic.assert_called_once_with()
+        self.assertEqual([[{"value": 1}, {"value": 2}], [{"value": 3}]], stored)
+        self.assertEqual([None] * 3, [future.result(0) for future in futures])
+        self.assertEqual(0, buffer.flush())
+
+    def test_failed_flush_fails_the_futures(self):
+        buffer = ingestion.ReadingBuffer(mock.Mock(side_effect=ValueError('broken')))
+        future = buffer.add({"value": 1})
+
+        with self.assertLogs('api.ingestion', 'ERROR'):
+            self.assertEqual(0, buffer.flush())
+        self.assertIsInstance(future.exception(0), ValueError)
+        buffer.close()
+        with self.assertRaises(RuntimeError):
+            buffer.add({"value": 2})
+
+    def test_only_the_reading_which_can_not_be_stored_is_dropped(self):
+        stored = []
+
+        def store(readings):
+            if any(reading["value"] is None for reading in readings):
+                raise ValueError('poisoned')
+            stored.extend(readings)
+
+        directory = tempfile.mkdtemp()
+        buffer = ingestion.ReadingBuffer(store, journal=ingestion.ReadingJournal(directory, fsync=False))
+        futures = [buffer.add({"value": value}) for value in (1, 2, None, 4, 5)]
+
+        with self.assertLogs('api.ingestion', 'ERROR') as logs:
+            self.assertEqual(4, buffer.flush())
+
+        self.assertEqual(1, len(logs.records))
+        self.assertEqual([1, 2, 4, 5], sorted(reading["value"] for reading in stored))
+        self.assertEqual([None, None, ValueError, None, None],
+                         [type(future.exception(0)) if future.exception(0) else None for future in futures])
+        failed = [name for name in os.listdir(directory) if name.endswith('.failed')]
+        with open(os.path.join(directory, failed[0]), encoding='utf-8') as failed_segment:
+            self.assertEqual([{"value": None}], [json.loads(line) for line in failed_segment])
+        buffer.close()
+        self.assertEqual(failed, os.listdir(directory))
+
+    def test_journal_is_recovered_by_the_next_process(self):
+        directory = tempfile.mkdtemp()
+        saved = datetime(2019, 3, 23, 14, 42, 30, tzinfo=timezone.utc)
+        crashed = ingestion.ReadingJournal(directory, fsync=False)
+        crashed.append({"sensor": self.sensor.id, "value": 1000, "saved": saved})
+        crashed.append({"sensor": self.sensor.id, "value": 4000, "saved": saved})
+        # the lock of a process which is gone is released
+        crashed._segment.close()
+
+        buffer = ingestion.ReadingBuffer(ingestion.store_buffered_readings,
+                                         journal=ingestion.ReadingJournal(directory))
+        self.assertEqual(2, buffer.recover())
+        self.assertEqual([(87.5, saved), (50.0, saved)],
+                         list(Measurement.objects.order_by('id').values_list('value', 'saved')))
+        self.assertEqual(1, len(os.listdir(directory)))
+
+        buffer.add({"sensor": self.sensor.id, "value": 7000})
+        buffer.store = mock.Mock(side_effect=ValueError('broken'))
+        with self.assertLogs('api.ingestion', 'ERROR'):
+            buffer.flush()
+        buffer.close()
+        self.assertEqual(1, len(os.listdir(directory)))
+        self.assertTrue(os.listdir(directory)[0].endswith('.jsonl.failed'))
+        self.assertEqual(0, ingestion.ReadingBuffer(ingestion.store_buffered_readings,
+                                                    journal=ingestion.ReadingJournal(directory)).recover())
+
+    @override_settings(INGESTION_BUFFER='memory', INGESTION_BUFFER_ACK='accepted', INGESTION_BUFFER_ROWS=1000,
+                       INGESTION_BUFFER_DELAY_MS=3600000)
+    def test_create_is_accepted_and_stored_with_the_next_flush(self):
+        with freeze_time("2019-03-23 14:42:30"):
+            response = self.client.post('/measurement/', {"sensor": self.sensor.id, "value": 4000}, format='json',
+                                        secure=True)
+
+        self.assertEqual(202, response.status_code)
+        self.assertEqual({"status": "accepted"}, response.json())
+        self.assertFalse(Measurement.objects.exists())
+        self.assertEqual(1, ingestion.get_buffer().flush())
+        self.assertEqual([(50.0, datetime(2019, 3, 23, 14, 42, 30, tzinfo=timezone.utc))],
+                         list(Measurement.objects.values_list('value', 'saved')))
+        self.assertEqual(50.0, Silo.objects.get(id=self.silo.id).percentage())
+
+        foreign_sensor = Sensor.objects.create(serial_number='333')
+        self.assertEqual(403, self.client.post('/measurement/', {"sensor": foreign_sensor.id, "value": 4000},
+                                               format='json', secure=True).status_code)
+
+    @override_settings(INGESTION_BUFFER='memory', INGESTION_BUFFER_ACK='committed', INGESTION_BUFFER_ROWS=1,
+                       INGESTION_BUFFER_DELAY_MS=3600000)
+    def test_create_waits_until_committed(self):
+        for distance in (1000, 7000):
+            response = self.client.post('/measurement/', {"sensor": self.sensor.id, "value": distance},
+                                        format='json', secure=True)
+
+            self.assertEqual(201, response.status_code)
+            # the same representation as without buffer
+            expected = self.client.get(f'/measurement/{Measurement.objects.latest("id").id}/', secure=True).json()
+            if not connection.features.can_return_ids_from_bulk_insert:
+                expected["id"] = None
+            self.assertEqual(expected, response.json())
+        self.assertEqual([87.5, 12.5], list(Measurement.objects.order_by('id').values_list('value', flat=True)))
+        self.assertEqual(['farmer'], list(OutgoingNotification.objects.values_list('topic', flat=True)))
+
+    @override_settings(INGESTION_BUFFER='memory', INGESTION_BUFFER_ACK='committed', INGESTION_BUFFER_ROWS=1,
+                       INGESTION_BUFFER_DELAY_MS=3600000)
+    def test_create_which_could_not_be_stored(self):
+        with mock.patch.object(ingestion, 'store_readings', side_effect=ValueError('broken')), \
+                self.assertLogs('api.ingestion', 'ERROR'):
+            response = self.client.post('/measurement/', {"sensor": self.sensor.id, "value": 1000}, format='json',
+                                        secure=True)
+
+        self.assertEqual(500, response.status_code)
+        self.assertEqual({"message": "The measurement could not be stored"}, response.json())
+
+    @override_settings(INGESTION_BUFFER='memory', INGESTION_BUFFER_ACK='committed', INGESTION_BUFFER_ROWS=1000,
+                       INGESTION_BUFFER_DELAY_MS=3600000)
+    def test_create_waiting_alone_is_stored_right_away(self):
+        response = self.client.post('/measurement/', {"sensor": self.sensor.id, "value": 1000}, format='json',
+                                    secure=True)
+
+        self.assertEqual(201, response.status_code)
+        self.assertEqual(0, len(ingestion.get_buffer()))
+        self.assertEqual(1, Measurement.objects.count())
+
+    @override_settings(INGESTION_BUFFER='memory', INGESTION_BUFFER_ACK='committed', INGESTION_BUFFER_ROWS=1000,
+                       INGESTION_BUFFER_DELAY_MS=3600000, INGESTION_BUFFER_TIMEOUT=0)
+    def test_create_which_was_not_stored_in_time(self):
+        # another reading is waiting, so the request waits for the group
+        ingestion.get_buffer().add({"sensor": self.sensor.id, "value": 1000, "saved": timezone.now()})
+        response = self.client.post('/measurement/', {"sensor": self.sensor.id, "value": 1000}, format='json',
+                                    secure=True)
+
+        self.assertEqual(503, response.status_code)
+        self.assertEqual(2, ingestion.get_buffer().flush())
+        self.assertEqual(2, Measurement.objects.count())
+
+
+class SiloAlertStateTest(TestCase):
+    now = datetime(2019, 3, 23, 18, 45, tzinfo=timezone.utc)
+
+    def evaluate_all(self, state, values, interval=timezone.timedelta(minutes=1)):
+        return [state.evaluate(value, self.now + i * interval) for i, value in enumerate(values)]
+
+    def test_levels_are_notified_when_crossed_downwards(self):
+        state = SiloAlertState(silo=Silo(critical_levels='20,40,60,80'))
+
+        self.assertEqual([None, 60, None, 20, None], self.evaluate_all(state, [87.5, 50, 45, 12.5, 37.5]))
+
+    def test_oscillating_values_are_notified_once(self):
+        state = SiloAlertState(silo=Silo(critical_levels='40', alert_hysteresis=2))
+
+        # only rising above 42 re-arms the level
+        self.assertEqual([None, 40, None, None, None, 40],
+                         self.evaluate_all(state, [40.5, 39.9, 41, 39.8, 42.5, 39.5]))
+
+    def test_cooldown(self):
+        state = SiloAlertState(silo=Silo(critical_levels='20,40', alert_hysteresis=0, alert_cooldown=30))
+
+        self.assertEqual([None, 40, None, None, None, 40, None],
+                         self.evaluate_all(state, [50, 39, 45, 39, 41, 21, 19], timezone.timedelta(minutes=10)))
+
+
+    def test_state_created_concurrently_is_used(self):
+        silo = Silo.objects.create(name="test_silo", critical_levels='40')
+        notify = mock.Mock()
+        get = QuerySet.get
+
+        def get_missing_concurrently_created_state(queryset, *args, **kwargs):
+            if queryset.model is SiloAlertState and not SiloAlertState.objects.exists():
+                # another process inserts the state right after it was looked up
+                SiloAlertState.objects.create(silo=silo, last_value=50)
+                raise SiloAlertState.DoesNotExist()
+            return get(queryset, *args, **kwargs)
+
+        with mock.patch.object(QuerySet, 'get', get_missing_concurrently_created_state):
+            ingestion.check_critical_levels(silo, [30], 'farmer', notify)
+
+        notify.assert_called_once_with("test_silo", 40, topic='farmer')
+        self.assertEqual([30], list(SiloAlertState.objects.values_list('last_value', flat=True)))
+
+class GeometryTest(TestCase):
+
+    def test_fill_calculator(self):
+        calculator = FillCalculator(height=10, width=2, gap_top=1, gap_bottom=1)
+
+        percentages, contents = calculator.compute([1000, 4000, 8000, 8500])
+
+        self.assertEqual([87.5, 50.0, 0.0, -6.25], percentages.tolist())
+        self.assertEqual([21.99, 12.57, 0.0, -1.57], contents.tolist())
+        self.assertIsNone(FillCalculator.for_silo(Silo(height=10, width=0)))
+
+    def test_silo_cache_is_cleared_when_silo_is_saved(self):
+        sensor = Sensor.objects.create(serial_number='222')
+        silo = Silo.objects.create(name="test_silo", sensor=sensor, height=10, width=2)
+
+        silo_cache.get(sensor.id)
+        with self.assertNumQueries(0):
+            self.assertEqual(10, silo_cache.get(sensor.id)[1].height)
+
+        silo.height = 12
+        silo.save()
+
+        self.assertEqual(12, silo_cache.get(sensor.id)[1].height)
+
+
+class DownsamplingTest(TestCase):
+    start = datetime(2019, 3, 1, tzinfo=timezone.utc)
+
+    def series(self, values):
+        return [(self.start + timezone.timedelta(minutes=i), value) for i, value in enumerate(values)]
+
+    def test_lttb_keeps_dips(self):
+        points = self.series([80, 80, 79, 79, 5, 79, 78, 78, 78, 77, 77, 77])
+
+        result = list(downsampling.lttb(iter(points), len(points), 5))
+
+        self.assertEqual(5, len(result))
+        self.assertEqual(points[0], result[0])
+        self.assertEqual(points[-1], result[-1])
+        self.assertIn(points[4], result)
+
+    def test_lttb_keeps_first_and_last_points(self):
+        series = self.series(range(400))
+        for total in range(4, len(series)):
+            points = series[:total]
+            for threshold in (3, 4, 5, 7, 10, 25, 50, 100, 250):
+                if threshold < total:
+                    with self.subTest(total=total, threshold=threshold):
+                        result = list(downsampling.lttb(iter(points), total, threshold))
+
+                        self.assertEqual(threshold, len(result))
+                        self.assertEqual([points[0], points[-1]], [result[0], result[-1]])
+                        self.assertEqual(sorted(set(result)), result)
+
+    def test_lttb_with_points_changed_after_counting(self):
+        points = self.series(range(100))
+        for total in (50, 99, 101, 150, 1000):
+            with self.subTest(total=total):
+                result = list(downsampling.lttb(iter(points), total, 10))
+
+                self.assertEqual([points[0], points[-1]], [result[0], result[-1]])
+                self.assertEqual(sorted(set(result)), result)
+        self.assertEqual([], list(downsampling.lttb(iter([]), 100, 10)))
+
+    def test_lttb_returns_small_series_unchanged(self):
+        points = self.series([80, 79, 78])
+
+        self.assertEqual(points, list(downsampling.lttb(iter(points), len(points), 5)))
+
+    def test_min_max(self):
+        points = self.series([80, 80, 79, 79, 5, 79, 78, 78, 78, 77, 77, 90])
+
+        result = list(downsampling.min_max(iter(points), self.start, points[-1][0], 4))
+
+        self.assertEqual([points[0], points[4], points[9], points[11]], result)
+
+    def test_downsampled_graph(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create_superuser('admin', 'admin@admin.com', 'password'))
+        sensor = Sensor.objects.create(serial_number='222')
+        silo = Silo.objects.create(name="test_silo", sensor=sensor)
+        SiloTest.persist_test_measurements(sensor, dict(self.series([80, 79, 5, 78, 77, 76])))
+
+        response = client.get(f'/measurement/graph/{silo.id}/2019-03-01T00:00:00.000Z/2019-03-02T00:00:00.000Z/4/',
+                              secure=True)
+
+        self.assertEqual({"2019-03-01T01:00:00+01:00": 80.0, "2019-03-01T01:02:00+01:00": 5.0,
+                          "2019-03-01T01:03:00+01:00": 78.0, "2019-03-01T01:05:00+01:00": 76.0}, response.json())
+
+
+class MeasurementExportTest(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser('admin', 'admin@admin.com', 'password'))
+        self.sensor = Sensor.objects.create(serial_number='222')
+        self.silo = Silo.objects.create(name="test_silo", sensor=self.sensor)
+        SiloTest.persist_test_measurements(self.sensor, {
+            datetime(2019, 3, 13, 15, 46, 30, tzinfo=timezone.utc): 64,
+            datetime(2019, 3, 13, 15, 43, 30, tzinfo=timezone.utc): 63.1,
+        })
+        self.url = f'/measurement/export/{self.silo.id}/2019-03-13T00:00:00.000Z/2019-03-14T00:00:00.000Z/'
+
+    def test_export_csv(self):
+        response = self.client.get(self.url, secure=True)
+
+        self.assertEqual('text/csv', response['Content-Type'])
+        self.assertEqual('2019-03-13 15:43:30;63.1\r\n2019-03-13 15:46:30;64.0\r\n',
+                         b''.join(response.streaming_content).decode('utf8'))
+
+    def test_export_csv_with_columns_and_compression(self):
+        response = self.client.get(self.url, {'columns': 'saved,sensor,read,value', 'compression': 'gzip'},
+                                   secure=True)
+
+        self.assertEqual('application/gzip', response['Content-Type'])
+        sensor_id = self.sensor.id
+        self.assertEqual(f'2019-03-13 15:43:30;{sensor_id};;63.1\r\n2019-03-13 15:46:30;{sensor_id};;64.0\r\n',
+                         gzip.decompress(b''.join(response.streaming_content)).decode('utf8'))
+
+    @skipIf(exports.pyarrow is None, 'pyarrow is not installed')
+    def test_export_parquet(self):
+        other_sensor = Sensor.objects.create(serial_number='333')
+        other_silo = Silo.objects.create(name="other_silo", sensor=other_sensor)
+        SiloTest.persist_test_measurements(other_sensor, {datetime(2019, 3, 13, 15, tzinfo=timezone.utc): 20})
+
+        response = self.client.get('/measurement/export-parquet/2019-03-13T00:00:00.000Z/2019-03-14T00:00:00.000Z/',
+                                   {'silos': f'{self.silo.id},{other_silo.id}', 'columns': 'saved,value,acc'},
+                                   secure=True)
+
+        table = exports.pyarrow.parquet.read_table(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(['silo', 'saved', 'value', 'acc'], table.column_names)
+        self.assertEqual({'silo': [self.silo.id, self.silo.id, other_silo.id],
+                          'saved': [datetime(2019, 3, 13, 15, 43, 30, tzinfo=timezone.utc),
+                                    datetime(2019, 3, 13, 15, 46, 30, tzinfo=timezone.utc),
+                                    datetime(2019, 3, 13, 15, tzinfo=timezone.utc)],
+                          'value': [63.1, 64.0, 20.0],
+                          'acc': ['', '', '']}, table.to_pydict())
+
+    def test_export_csv_with_unknown_column(self):
+        response = self.client.get(self.url, {'columns': 'saved,password'}, secure=True)
+
+        self.assertEqual(400, response.status_code)
+
+
+class MeasurementRetentionTest(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser('admin', 'admin@admin.com', 'password'))
+        self.sensor = Sensor.objects.create(serial_number='222')
+        self.silo = Silo.objects.create(name="test_silo", sensor=self.sensor, raw_retention_days=2)
+        SiloTest.persist_test_measurements(self.sensor, {
+            datetime(2019, 3, 1, 10, 5, tzinfo=timezone.utc): 40,
+            datetime(2019, 3, 1, 10, 40, tzinfo=timezone.utc): 41,
+            datetime(2019, 3, 1, 11, 10, tzinfo=timezone.utc): 42,
+            datetime(2019, 3, 2, 9, tzinfo=timezone.utc): 43,
+            datetime(2019, 3, 20, 9, tzinfo=timezone.utc): 50,
+            datetime(2019, 3, 23, 9, tzinfo=timezone.utc): 53,
+        })
+
+    @freeze_time("2019-03-23 18:45")
+    def test_compacted_measurements_are_read_from_rollups(self):
+        call_command('compact_measurements', '--chunk-size', '2', stdout=io.StringIO())
+        call_command('rebuild_rollups', stdout=io.StringIO())
+
+        self.assertEqual(datetime(2019, 3, 18, tzinfo=timezone.utc),
+                         Sensor.objects.get(id=self.sensor.id).compacted_until)
+        self.assertEqual([50, 53], list(Measurement.objects.order_by('saved').values_list('value', flat=True)))
+        self.assertEqual(2, MeasurementRollup.objects.filter(granularity='minute').count())
+        self.assertEqual(53, Silo.objects.get(id=self.silo.id).percentage())
+
+        url = f'/measurement/export/{self.silo.id}/2019-03-01T00:00:00.000Z/2019-03-21T00:00:00.000Z/'
+        response = self.client.get(url, {'columns': 'saved,value,temperature'}, secure=True)
+        self.assertEqual('2019-03-01 10:40:00;41.0;\r\n2019-03-01 11:10:00;42.0;\r\n2019-03-02 09:00:00;43.0;\r\n'
+                         '2019-03-20 09:00:00;50.0;0.0\r\n', b''.join(response.streaming_content).decode('utf8'))
+
+        url = f'/measurement/graph/{self.silo.id}/2019-03-01T08:00:00.000Z/2019-03-01T13:00:00.000Z/'
+        response = self.client.get(url, secure=True)
+        self.assertEqual({"11:40": 41.0, "12:10": 42.0}, response.json())
+
+        readings = Readings(Sensor.objects.get(id=self.sensor.id), datetime(2019, 3, 1, tzinfo=timezone.utc))
+        self.assertEqual([(2, [(41.0, 42.0), (None, None)]), (1, [(43.0,), (None,)]), (2, [(50.0, 53.0), (0.0, 0.0)])],
+                         list(readings.column_chunks(['value', 'temperature'], chunk_size=2)))
+
+
+class MetricsTest(TestCase):
+
+    def setUp(self):
+        metrics.registry.reset()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser('admin', 'admin@admin.com', 'password'))
+        self.sensor = Sensor.objects.create(serial_number='222')
+        self.silo = Silo.objects.create(name="test_silo", sensor=self.sensor)
+        SiloTest.persist_test_measurements(self.sensor, {datetime(2019, 3, 13, 15, 46, 30, tzinfo=timezone.utc): 64})
+
+    def test_metrics_per_endpoint(self):
+        self.client.get('/silo/', secure=True)
+        response = self.client.get(f'/measurement/export/{self.silo.id}/2019-03-13T00:00:00.000Z/'
+                                   f'2019-03-14T00:00:00.000Z/', secure=True)
+        b''.join(response.streaming_content)
+
+        report = self.client.get('/metrics/', secure=True).json()
+
+        self.assertEqual({'SiloViewSet.list', 'MeasurementViewSet.export_measure_for_sensor_with_time_interval'},
+                         set(report))
+        export = report['MeasurementViewSet.export_measure_for_sensor_with_time_interval']
+        self.assertEqual(1, export['latency_ms']['count'])
+        self.assertEqual(3, export['queries']['max'])
+        self.assertEqual(len('2019-03-13 15:46:30;64.0\r\n'), export['size_bytes']['max'])
+        self.assertGreater(report['SiloViewSet.list']['queries']['max'], 0)
+
+    def test_metrics_are_only_shown_to_admins(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user(username='farmer', password='password'))
+
+        self.assertEqual(403, client.get('/metrics/', secure=True).status_code)
+
+    def test_requests_exceeding_budget_are_logged(self):
+        with override_settings(METRICS_BUDGET={'queries': 100}, METRICS_ENDPOINT_BUDGETS={'SiloViewSet.list': {
+                'queries': 0}}), self.assertLogs('api.metrics', 'WARNING') as logs:
+            self.client.get('/silo/', secure=True)
+            self.client.get('/metrics/', secure=True)
+
+        self.assertEqual(1, len(logs.output))
+        self.assertIn('GET /silo/ (SiloViewSet.list) exceeded its budget', logs.output[0])
+
+    def test_metrics_are_dumped(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'metrics.json')
+            with override_settings(METRICS_DUMP_FILE=path, METRICS_DUMP_INTERVAL=0):
+                self.client.get('/silo/', secure=True)
+
+            with open(path) as file:
+                self.assertEqual(1, json.load(file)['SiloViewSet.list']['latency_ms']['count'])
+
+
+class BenchmarkTest(TestCase):
+
+    def test_fleet_generation(self):
+        call_command('generate_fleet', '--users', '2', '--silos', '3', '--sensors', '4', '--years', '0.01',
+                     '--interval', '60', stdout=io.StringIO())
+
+        self.assertEqual(3, Silo.objects.count())
+        self.assertEqual(4, Sensor.objects.count())
+        self.assertEqual(3 * 87, Measurement.objects.count())
+        for silo in Silo.objects.all():
+            self.assertEqual(silo.sensor.measurement_set.latest('saved').value, silo.percentage())
+
+    def test_benchmark_run(self):
+        results = benchmarks.run([1], silos=2, users=1, interval=120, repeat=1)
+
+        self.assertEqual(1, len(results['results']))
+        self.assertEqual(24, results['results'][0]['measurements'])
+        self.assertEqual(['silo_list', 'measurement_list', 'graph_hour', 'graph_day', 'graph_week', 'graph_month',
+                          'all_values', 'csv_export', 'create', 'create_bulk'], list(results['results'][0]['scenarios']))
+        self.assertEqual(1, results['results'][0]['scenarios']['silo_list']['queries'])
+        self.assertEqual({"silo_list": 2, "measurement_list": 24}, {
+            name: comparison['rows'] for name, comparison in results['results'][0]['serializers'].items()})
+        # the generated fleet is rolled back
+        self.assertFalse(Measurement.objects.exists())
+
+
+class NotificationDispatchTest(TestCase):
+
+    class FailingSender:
+
+        def send(self, topic, title, body):
+            if topic == 'broken':
+                raise ConnectionError('push provider unavailable')
+
+    @freeze_time("2019-03-23 18:45")
+    def test_dispatch_pending(self):
+        notifications.enqueue("silo 1", "The level is below 40%", topic='farmer')
+        notifications.enqueue("silo 2", "The level is below 20%", topic='broken')
+        notifications.enqueue("silo 2", "The level is below 20%", topic='broken')
+
+        self.assertEqual((1, 2), notifications.dispatch_pending(self.FailingSender()))
+        # nothing is due until the backoff has passed
+        self.assertEqual((0, 0), notifications.dispatch_pending(self.FailingSender()))
+
+        self.assertEqual(['sent', 'pending', 'pending'],
+                         list(OutgoingNotification.objects.order_by('id').values_list('status', flat=True)))
+        failed = OutgoingNotification.objects.filter(topic='broken').first()
+        self.assertEqual(1, failed.attempts)
+        self.assertEqual("ConnectionError: push provider unavailable", failed.last_error)
+        self.assertEqual(datetime(2019, 3, 23, 18, 45, 30, tzinfo=timezone.utc), failed.next_attempt)
+
+    @freeze_time("2019-03-23 18:45")
+    def test_claimed_messages_are_not_sent_twice(self):
+        notifications.enqueue("silo 1", "The level is below 40%", topic='farmer')
+        concurrent = []
+
+        class SlowSender:
+
+            def send(self, topic, title, body):
+                # another worker running while the message is being sent
+                concurrent.append(notifications.dispatch_pending(notifications.LocalSender()))
+
+        self.assertEqual((1, 0), notifications.dispatch_pending(SlowSender()))
+        self.assertEqual([(0, 0)], concurrent)
+        with freeze_time("2019-03-23 18:55"):
+            self.assertEqual((0, 0), notifications.dispatch_pending(self.FailingSender()))
+
+    def test_claims_of_stopped_workers_expire(self):
+        notifications.enqueue("silo 1", "The level is below 40%", topic='farmer')
+
+        class StoppedSender:
+
+            def send(self, topic, title, body):
+                raise SystemExit()
+
+        with self.assertRaises(SystemExit):
+            notifications.dispatch_pending(StoppedSender())
+        self.assertEqual((0, 0), notifications.dispatch_pending(self.FailingSender()))
+        with freeze_time(timezone.now() + notifications.CLAIM_TIMEOUT):
+            self.assertEqual((1, 0), notifications.dispatch_pending(self.FailingSender()))
+
+    def test_dispatch_gives_up_after_max_attempts(self):
+        notifications.enqueue("silo 2", "The level is below 20%", topic='broken')
+        OutgoingNotification.objects.update(attempts=notifications.MAX_ATTEMPTS - 1)
+
+        self.assertEqual((0, 1), notifications.dispatch_pending(self.FailingSender()))
+        self.assertEqual('failed', OutgoingNotification.objects.get().status)
@@ -1,26 +1,39 @@
 # Create your views here.
+import concurrent.futures
 import csv
+import tempfile
+import zlib
 
 from dateutil import parser
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.db.models import Max
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db.models.functions import Trunc
-from django.http import JsonResponse, HttpResponse
+from django.http import JsonResponse, StreamingHttpResponse, FileResponse
 from django.utils import timezone
 from django.utils.timezone import localtime
-from fcm_django.fcm import fcm_send_topic_message
-from pyfcm.errors import AuthenticationError
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
-from rest_framework.exceptions import PermissionDenied
+from rest_framework.exceptions import PermissionDenied, ValidationError
+from rest_framework.permissions import IsAdminUser
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
-from math import pow, pi
+from rest_framework.views import APIView
 
-from api import models, serializers
-from api.models import Measurement, Notification, Silo, Sensor
+from api import caching, downsampling, exports, ingestion, metrics, models, pagination, retention, serializers
+from api.geometry import silo_cache
+from api.models import Measurement, MeasurementRollup, Silo, Sensor
 
-SAVED_ASC = 'saved'
-SAVED_DESC = '-saved'
+ITERATOR_CHUNK_SIZE = 2000
+MAX_BULK_MEASUREMENTS = 10000
+MAX_GRAPH_POINTS = 5000
+
+GZIP = 'gzip'
+
+CSV_COLUMNS = exports.EXPORT_COLUMNS
+CSV_DATE_COLUMNS = {field.name for field in Measurement._meta.concrete_fields
+                    if field.get_internal_type() == 'DateTimeField'}
+DEFAULT_CSV_COLUMNS = ['saved', 'value']
 
 HOUR = 'hour'
 DAY = 'day'
@@ -49,6 +62,80 @@ DELTAS = {
 }
 
 
+def _group_values_by_day(measures):
+    '''
+    Group the (saved, value) pairs of measures ordered by date into one dictionary per day
+    :param measures: iterable of (saved, value) pairs, ordered by saved
+    :return: generator of (day, {time: value}) pairs
+    '''
+    current_day = None
+    values = {}
+    for saved, value in measures:
+        day = saved.strftime('%Y-%m-%d')
+        if day != current_day:
+            if current_day is not None:
+                yield current_day, values
+            current_day = day
+            values = {}
+        values[saved.strftime('%H:%M')] = value
+
+    if current_day is not None:
+        yield current_day, values
+
+
+def _stream_json_object(items):
+    '''
+    Encode (key, value) pairs as a JSON object piece by piece, so big responses don't have to be kept in memory
+    :param items: iterable of (key, value) pairs
+    :return: generator of JSON chunks
+    '''
+    encoder = DjangoJSONEncoder()
+    separator = '{'
+    for key, value in items:
+        yield f"{separator}{encoder.encode(key)}: {encoder.encode(value)}"
+        separator = ', '
+    yield '{}' if separator == '{' else '}'
+
+
+class _Echo:
+    '''
+    File-like object returning what is written, lets the csv writer produce single lines
+    '''
+
+    def write(self, value):
+        return value
+
+
+def _stream_csv(rows, date_columns):
+    '''
+    Encode rows as CSV, several rows at once
+    :param rows: iterable of value tuples
+    :param date_columns: flag per column telling if its values are dates to be formatted
+    :return: generator of CSV chunks
+    '''
+    writer = csv.writer(_Echo(), delimiter=';')
+    time_format_in_csv = "%Y-%m-%d %H:%M:%S"
+    lines = []
+    for row in rows:
+        lines.append(writer.writerow([
+            (value.strftime(time_format_in_csv) if value is not None else None) if is_date else value
+            for value, is_date in zip(row, date_columns)]))
+        if len(lines) == ITERATOR_CHUNK_SIZE:
+            yield ''.join(lines)
+            lines = []
+    if lines:
+        yield ''.join(lines)
+
+
+def _gzip_stream(chunks):
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk.encode('utf-8'))
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
 def _filter_queryset_by_user_permission(request, queryset):
     '''
     Narrow down showing resources to superusers and users that are assigned to the sensor
@@ -64,12 +151,21 @@ def _filter_queryset_by_user_permission(request, queryset):
 
 
 class SiloViewSet(viewsets.ModelViewSet):
-    queryset = models.Silo.objects.all().order_by("name")
+    queryset = models.Silo.objects.select_related('sensor', 'snapshot').order_by("name")
     serializer_class = serializers.SiloSerializer
 
     def filter_queryset(self, queryset):
         return _filter_queryset_by_user_permission(self.request, queryset)
 
+    def list(self, request, *args, **kwargs):
+        def render():
+            silos = self.filter_queryset(self.get_queryset())
+            values = serializers.SiloValuesSerializer(self.get_serializer())
+            return JSONRenderer().render(values.serialize(values.values(silos)))
+
+        return caching.cached_response(request, ('silo-list', caching.user_scope(request.user)), [caching.SILO_LIST],
+                                       render)
+
 
 class NotificationViewSet(viewsets.ModelViewSet):
     queryset = models.Notification.objects.all().order_by("-timestamp")
@@ -89,31 +185,52 @@ class SensorViewSet(viewsets.ModelViewSet):
 
 
 class MeasurementViewSet(viewsets.ModelViewSet):
-    queryset = models.Measurement.objects.all()
+    queryset = models.Measurement.objects.select_related('geometry')
     serializer_class = serializers.MeasurementSerializer
-    critical_levels = [20, 40, 60, 80]
+    pagination_class = pagination.SavedKeysetPagination
 
     def filter_queryset(self, queryset):
         return _filter_queryset_by_user_permission(self.request, queryset)
 
-    def _send_notifications_if_necessary(self, user, serializer):
+    def list(self, request, *args, **kwargs):
+        '''
+        Measurements the user can see, in pages (see `SavedKeysetPagination`)
+        - `sensor`: id of the sensor
+        - `since`, `until`: first and last saved timestamp (ISO 8601)
+        - `fields`: comma separated fields to include, all by default
         '''
-        Check if sending notification is necessary,
-        It will be triggered when value drops below the critical levels and the notification hasn't been sent already
-        :param serializer:
+        params = request.query_params
+        measures = self.filter_queryset(self.get_queryset())
+        try:
+            if params.get('sensor'):
+                measures = measures.filter(sensor_id=int(params['sensor']))
+            if params.get('since'):
+                measures = measures.filter(saved__gte=parser.isoparse(params['since']))
+            if params.get('until'):
+                measures = measures.filter(saved__lte=parser.isoparse(params['until']))
+        except ValueError:
+            raise ValidationError({"message": "`sensor` has to be an id, `since` and `until` ISO 8601 timestamps"})
+
+        fields = params['fields'].split(',') if params.get('fields') else None
+        serializer = self.get_serializer(fields=fields)
+        if fields is not None:
+            unknown_fields = [field for field in fields if field not in serializer.fields]
+            if unknown_fields:
+                raise ValidationError({"message": "Unknown fields", "fields": unknown_fields})
+
+        # only the columns of the requested fields are loaded, the keyset columns are always needed
+        values = serializers.ValuesSerializer(serializer)
+        page = self.paginate_queryset(values.values(measures.select_related(None), 'id', 'saved'))
+        return self.get_paginated_response(values.serialize(page))
+
+    def _send_notifications_if_necessary(self, user, silo, values):
+        '''
+        Check if sending notification is necessary, see `ingestion.check_critical_levels`
+        :param silo: silo the values were measured in
+        :param values: new values in the order they were measured
         :return:
         '''
-        sensor = serializer.validated_data["sensor"]
-        silo = Silo.objects.filter(sensor=sensor).first()
-        # getting the second latest measurement because the new measurement gets saved before this
-        latest_measurement = Measurement.objects.filter(sensor=sensor).order_by("-id")[1].value
-        for level in self.critical_levels:
-            if serializer.validated_data["value"] < level <= latest_measurement:
-                try:
-                    self.send_notification(silo.name, level, topic=user.username)
-                except AuthenticationError as e:
-                    print("Sending notification ERROR, " + str(e))
-                break
+        ingestion.check_critical_levels(silo, values, user.username, self.send_notification)
 
     def _user_is_allowed_to_create_measurement(self, user, sensor):
         '''
@@ -122,7 +239,7 @@ class MeasurementViewSet(viewsets.ModelViewSet):
         :param sensor:
         :return:
         '''
-        return user.is_superuser or (sensor.user and sensor.user.id == user.id)
+        return user.is_superuser or (sensor.user_id is not None and sensor.user_id == user.id)
 
     def create(self, request, *args, **kwargs):
         '''
@@ -132,6 +249,7 @@ class MeasurementViewSet(viewsets.ModelViewSet):
         - calculate percentage
         - create measurement
         - check if notification needs to be sent
+        - with the write-behind buffer (`INGESTION_BUFFER`), hand an allowed reading to it, see `_create_buffered`
         :param request:
         :param args:
         :param kwargs:
@@ -142,78 +260,137 @@ class MeasurementViewSet(viewsets.ModelViewSet):
         serializer.is_valid(raise_exception=True)
 
         sensor: Sensor = serializer.validated_data["sensor"]
-        distance = serializer.validated_data["value"]
         user: User = self.request.user
 
-        silo = Silo.objects.filter(sensor=sensor).first()
-
-        if silo:
-            if silo.width is not None and silo.width > 0 and silo.height is not None and silo.height > 0:
-                radius = silo.width / 2
-                capacity = pi * pow(radius, 2) * (silo.height - silo.gap_top - silo.gap_bottom)
-                content = pi * pow(radius, 2) * (silo.height - silo.gap_top - silo.gap_bottom - distance / 1000)
-                percentage = content / capacity * 100
-
-                serializer.validated_data["value"] = round(percentage, 2)
-                serializer.validated_data["distance"] = distance
-                serializer.validated_data["capacity"] = round(capacity, 2)
-                serializer.validated_data["content"] = round(content, 2)
-                serializer.validated_data["radius"] = radius
-                serializer.validated_data["silo_height"] = silo.height
-                serializer.validated_data["silo_width"] = silo.width
-                serializer.validated_data["silo_gap_top"] = silo.gap_top
-                serializer.validated_data["silo_gap_bottom"] = silo.gap_bottom
+        buffer = ingestion.get_buffer()
+        if buffer is not None and self._user_is_allowed_to_create_measurement(user, sensor):
+            return self._create_buffered(buffer, dict(serializer.validated_data, sensor=sensor.id,
+                                                      saved=timezone.now()))
+
+        silo, calculator = silo_cache.get(sensor.id)
+        if calculator:
+            serializer.validated_data.update(calculator.measurement_fields([serializer.validated_data["value"]])[0])
 
         if self._user_is_allowed_to_create_measurement(user, sensor):
             self.perform_create(serializer)
 
-            self._send_notifications_if_necessary(user, serializer)
+            if silo:
+                self._send_notifications_if_necessary(user, silo, [serializer.validated_data["value"]])
             headers = self.get_success_headers(serializer.data)
             return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
         else:
             raise PermissionDenied(
                 {"message": "You don't have write permission for this sensor", "sensor_id": sensor.id})
 
-    @staticmethod
-    def send_notification(silo_name, level, topic):
-        title = silo_name
-        body = f"The level is below {level}%"
-        notification = Notification(title=title, body=body)
-        notification.save()
-
-        fcm_send_topic_message(topic_name=topic, sound='default', message_body=body, message_title=title,
-                               data_message={"body": body, "title": title})
-
-    @action(methods=['get'], detail=False, url_path='all/(?P<silo_id>[^/.]+)')
-    def all_values_for_silo(self, request, silo_id):
-        sensor_id = models.Silo.objects.filter(id=silo_id).first().sensor.id
-        measures = Measurement.objects.filter(sensor=sensor_id).order_by(SAVED_DESC).all()
-
-        result = {}
+    def _create_buffered(self, buffer, reading):
+        '''
+        Hand the reading to the write-behind buffer (see `ingestion.get_buffer`), it is stored with the next group
+        of readings. A request waiting until its reading is stored stores it right away if no other reading is
+        waiting. Notifications are sent to the owner of the sensor.
+        :return: 202 once the reading is accepted, or the created measurement like without buffer once it is
+        stored, depending on `INGESTION_BUFFER_ACK`
+        '''
+        committed = settings.INGESTION_BUFFER_ACK == ingestion.COMMITTED
+        future = buffer.add(reading, waits=committed)
+        if not committed:
+            return Response({"status": "accepted"}, status=status.HTTP_202_ACCEPTED)
+        try:
+            measurement = future.result(settings.INGESTION_BUFFER_TIMEOUT)
+        except concurrent.futures.TimeoutError:
+            return Response({"message": "The measurement was not stored in time, it might still be stored later"},
+                            status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        except Exception:
+            measurement = None
+        if measurement is None:
+            # the error was logged by the buffer, the reading is dropped
+            return Response({"message": "The measurement could not be stored"},
+                            status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        data = self.get_serializer(measurement).data
+        return Response(data, status=status.HTTP_201_CREATED, headers=self.get_success_headers(data))
+
+    @action(methods=['post'], detail=False, url_path='bulk')
+    def create_bulk(self, request):
+        '''
+        Create a batch of measurements, e.g. replayed by a gateway which buffered them while offline:
+        - validate all the readings
+        - look up their sensors and silos in the cache of the process and check the write permission
+        - calculate the percentages and insert all measurements at once
+        - check once per sensor if notifications need to be sent for the ordered readings
+        :param request: list of measurements, in the format accepted by `create`
+        :return:
+        '''
+        # checked before validating, which would cost the time of validating every reading of an oversized batch
+        if not isinstance(request.data, list):
+            raise ValidationError({"message": "A list of measurements is expected"})
+        if len(request.data) > MAX_BULK_MEASUREMENTS:
+            raise ValidationError({"message": f"At most {MAX_BULK_MEASUREMENTS} measurements can be sent at once"})
+        serializer = serializers.BulkMeasurementSerializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        readings = serializer.validated_data
 
-        for measure in measures:
+        user: User = self.request.user
+        sensor_ids = {reading["sensor"] for reading in readings}
+        sensors = {sensor_id: silo_cache.sensor(sensor_id) for sensor_id in sensor_ids}
+        for sensor_id in sensor_ids:
+            if sensors[sensor_id] is None:
+                raise ValidationError({"message": "Sensor does not exist", "sensor_id": sensor_id})
+            if not self._user_is_allowed_to_create_measurement(user, sensors[sensor_id]):
+                raise PermissionDenied(
+                    {"message": "You don't have write permission for this sensor", "sensor_id": sensor_id})
 
-            measure_date = measure.saved.strftime('%Y-%m-%d')
-            measure_day = measure.saved.strftime('%d')
-            measure_month = measure.saved.strftime('%m')
-            measure_year = measure.saved.strftime('%Y')
+        for reading in readings:
+            reading["sensor"] = sensors[reading["sensor"]]
+        measurements = ingestion.store_readings(readings, topic=user.username, notify=self.send_notification)
 
-            if result.get(measure_date) is None:  # don't fetch them again
+        return Response({"created": len(measurements)}, status=status.HTTP_201_CREATED)
 
-                measures_per_day_objects = Measurement.objects.filter(sensor=sensor_id,
-                                                                      saved__day=measure_day,
-                                                                      saved__month=measure_month,
-                                                                      saved__year=measure_year).order_by(SAVED_DESC)
+    @staticmethod
+    def send_notification(silo_name, level, topic):
+        ingestion.send_notification(silo_name, level, topic)
 
-                measures_per_day = {m.saved.strftime('%H:%M'): m.value for m in measures_per_day_objects}
-                result[measure_date] = measures_per_day
+    @action(methods=['get'], detail=False, url_path='all/(?P<silo_id>[^/.]+)')
+    def all_values_for_silo(self, request, silo_id):
+        sensor = models.Silo.objects.filter(id=silo_id).first().sensor
+        measures = retention.Readings(sensor).rows(['saved', 'value'], descending=True)
 
-        return JsonResponse(result)
+        return StreamingHttpResponse(_stream_json_object(_group_values_by_day(measures)),
+                                     content_type='application/json')
 
     @action(methods=['get'], detail=False, url_path='graph/(?P<silo_id>[^/.]+)/(?P<timespan_type>[a-z]+)')
     def measures_for_graph(self, request, silo_id, timespan_type):
-        return self._get_measures_as_json_response(KEY_FORMATS[timespan_type], silo_id, TRUNCATION[timespan_type],
-                                                   DELTAS[timespan_type])
+        return caching.cached_response(
+            request, ('graph', silo_id, timespan_type, caching.user_scope(request.user)), [silo_id],
+            lambda: self._get_measures_as_json_response(KEY_FORMATS[timespan_type], silo_id, TRUNCATION[timespan_type],
+                                                        DELTAS[timespan_type]).content)
+
+    @action(methods=['get'], detail=False, url_path='graph-batch/(?P<timespan_type>[a-z]+)')
+    def measures_for_graphs(self, request, timespan_type):
+        '''
+        Graphs of several silos at once, e.g. for a dashboard showing all silos of a farm
+        - `silos`: comma separated ids of the silos, silos the user has no access to are skipped
+        :return: graph of every silo by its id, in the format of `measures_for_graph`
+        '''
+        if timespan_type not in DELTAS:
+            raise ValidationError({"message": "Unknown timespan", "timespan": timespan_type})
+        try:
+            silo_ids = sorted({int(silo_id) for silo_id in request.query_params.get('silos', '').split(',')})
+        except ValueError:
+            raise ValidationError({"message": "`silos` has to be a comma separated list of silo ids"})
+
+        def render():
+            silos = _filter_queryset_by_user_permission(request, Silo.objects.filter(id__in=silo_ids,
+                                                                                     sensor__isnull=False))
+            sensors = dict(silos.values_list('id', 'sensor_id'))
+            date_to = timezone.now()
+            values = MeasurementRollup.latest_values(set(sensors.values()), TRUNCATION[timespan_type].kind,
+                                                     date_to - DELTAS[timespan_type], date_to)
+            key_format = KEY_FORMATS[timespan_type]
+            return JsonResponse({silo_id: {localtime(saved).strftime(key_format): value
+                                           for saved, value in values[sensor_id]}
+                                 for silo_id, sensor_id in sensors.items()}).content
+
+        return caching.cached_response(request, ('graph-batch', silo_ids, timespan_type,
+                                                 caching.user_scope(request.user)), silo_ids, render)
 
     @action(methods=['get'], detail=False,
             url_path='graph/(?P<silo_id>[^/.]+)/(?P<date_from>\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}.\d{3}Z)/(?P<date_to>\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}.\d{3}Z)')
@@ -241,6 +418,36 @@ class MeasurementViewSet(viewsets.ModelViewSet):
         return self._get_measures_as_json_response(key_format, silo_id, truncated_timestamp, date_from=date_from,
                                                    date_to=date_to)
 
+    @action(methods=['get'], detail=False,
+            url_path='graph/(?P<silo_id>[^/.]+)/(?P<date_from>\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}.\d{3}Z)/(?P<date_to>\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}.\d{3}Z)/(?P<points>\d+)')
+    def downsampled_measures_for_graph(self, request, silo_id, date_from, date_to, points):
+        '''
+        Measures of the time interval reduced to at most `points` values which keep the shape of the graph,
+        with the local timestamps as keys
+        - `algorithm`: `lttb` (Largest-Triangle-Three-Buckets, default) or `minmax` (lowest and highest value of
+        equally long buckets)
+        '''
+        date_from = parser.parse(date_from)
+        date_to = parser.parse(date_to)
+        points = int(points)
+        algorithm = request.query_params.get('algorithm', downsampling.LTTB)
+        if algorithm not in downsampling.ALGORITHMS:
+            raise ValidationError({"message": "Unknown algorithm", "algorithm": algorithm})
+        if not 3 <= points <= MAX_GRAPH_POINTS:
+            raise ValidationError({"message": f"Between 3 and {MAX_GRAPH_POINTS} points can be requested"})
+        if date_from > date_to:
+            return JsonResponse({})
+
+        sensor = models.Silo.objects.filter(id=silo_id).first().sensor
+        readings = retention.Readings(sensor, date_from, date_to)
+        rows = readings.rows(['saved', 'value'])
+        if algorithm == downsampling.LTTB:
+            selected = downsampling.lttb(rows, readings.count(), points)
+        else:
+            selected = downsampling.min_max(rows, date_from, date_to, points)
+
+        return JsonResponse({localtime(saved).isoformat(): value for saved, value in selected})
+
     @staticmethod
     def _get_measures_as_json_response(key_format, silo_id, truncated_timestamp,
                                        delta=None, date_from=None, date_to=None):
@@ -249,14 +456,16 @@ class MeasurementViewSet(viewsets.ModelViewSet):
             date_from = date_to - delta
 
         sensor_id = models.Silo.objects.filter(id=silo_id).first().sensor.id
-        base_query = Measurement.objects.filter(sensor__id=sensor_id, saved__gte=date_from, saved__lte=date_to)
-        measure_dates = base_query.annotate(saved_trunc=truncated_timestamp).values('saved_trunc').annotate(
-            max_date=Max(SAVED_ASC))
-        max_value_dates = [m['max_date'] for m in measure_dates]
-
-        measures = Measurement.objects.filter(sensor_id=sensor_id, saved__in=max_value_dates).order_by(SAVED_ASC)
 
         result = {}
+        if truncated_timestamp.kind in MeasurementRollup.BUCKET_SIZES:
+            for saved, value in MeasurementRollup.latest_values([sensor_id], truncated_timestamp.kind, date_from,
+                                                                date_to)[sensor_id]:
+                result[localtime(saved).strftime(key_format)] = value
+            return JsonResponse(result)
+
+        measures = Measurement.objects.filter(sensor_id=sensor_id, saved__gte=date_from,
+                                              saved__lte=date_to).latest_per_bucket(truncated_timestamp)
         for m in measures:
             parsed_date = localtime(m.saved).strftime(key_format)
             result[parsed_date] = m.value
@@ -268,29 +477,94 @@ class MeasurementViewSet(viewsets.ModelViewSet):
     def export_measure_for_sensor_with_time_interval(self, request, silo_id, date_from, date_to):
         date_from = parser.parse(date_from)
         date_to = parser.parse(date_to)
-        return self._get_measures_as_csv(silo_id, date_from=date_from, date_to=date_to)
+        return self._get_measures_as_csv(silo_id, date_from=date_from, date_to=date_to,
+                                         **self._get_csv_options(request))
 
     @action(methods=['get'], detail=False,
             url_path='export/(?P<silo_id>[^/.]+)/(?P<timespan_type>[a-z]+)')
     def export_measure_for_sensor(self, request, silo_id, timespan_type):
-        return self._get_measures_as_csv(silo_id, delta=DELTAS[timespan_type])
+        return self._get_measures_as_csv(silo_id, delta=DELTAS[timespan_type], **self._get_csv_options(request))
+
+    @action(methods=['get'], detail=False,
+            url_path='export-parquet/(?P<date_from>\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}.\d{3}Z)/(?P<date_to>\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}.\d{3}Z)')
+    def export_parquet_with_time_interval(self, request, date_from, date_to):
+        '''
+        Export the measurements of several silos as a Parquet file with typed columns
+        - `silos`: comma separated ids of the silos, silos the user has no access to are skipped
+        - `columns`: comma separated measurement fields to export
+        '''
+        if exports.pyarrow is None:
+            raise ValidationError({"message": "Parquet export is not available on this server"})
+
+        columns = request.query_params.get('columns')
+        columns = columns.split(',') if columns else exports.DEFAULT_PARQUET_COLUMNS
+        unknown_columns = [column for column in columns if column not in exports.EXPORT_COLUMNS]
+        if unknown_columns:
+            raise ValidationError({"message": "Unknown columns", "columns": unknown_columns})
+        try:
+            silo_ids = [int(silo_id) for silo_id in request.query_params.get('silos', '').split(',')]
+        except ValueError:
+            raise ValidationError({"message": "`silos` has to be a comma separated list of silo ids"})
+
+        silo_ids = list(_filter_queryset_by_user_permission(request, Silo.objects.filter(id__in=silo_ids)).values_list(
+            'id', flat=True))
+        file = tempfile.TemporaryFile()
+        exports.write_measurements_parquet(file, silo_ids, parser.parse(date_from), parser.parse(date_to), columns)
+        file.seek(0)
+        return FileResponse(file, as_attachment=True, filename='measurements.parquet',
+                            content_type='application/vnd.apache.parquet')
 
     @staticmethod
-    def _get_measures_as_csv(silo_id, delta=None, date_from=None, date_to=None):
+    def _get_csv_options(request):
+        '''
+        Read the export options from the query parameters:
+        - `columns`: comma separated measurement fields to export, `saved` and `value` by default
+        - `compression`: `gzip` to compress the CSV
+        :param request:
+        :return: keyword arguments for `_get_measures_as_csv`
+        '''
+        columns = request.query_params.get('columns')
+        columns = columns.split(',') if columns else DEFAULT_CSV_COLUMNS
+        unknown_columns = [column for column in columns if column not in CSV_COLUMNS]
+        if unknown_columns:
+            raise ValidationError({"message": "Unknown columns", "columns": unknown_columns})
+
+        compression = request.query_params.get('compression')
+        if compression not in (None, GZIP):
+            raise ValidationError({"message": "Unsupported compression", "compression": compression})
+
+        return {"columns": columns, "compress": compression == GZIP}
+
+    @staticmethod
+    def _get_measures_as_csv(silo_id, delta=None, date_from=None, date_to=None, columns=DEFAULT_CSV_COLUMNS,
+                             compress=False):
         if delta:
             date_to = timezone.now()
             date_from = date_to - delta
 
-        sensor_id = models.Silo.objects.filter(id=silo_id).first().sensor.id
-        time_format_in_csv = "%Y-%m-%d %H:%M:%S"
-        measures = Measurement.objects.filter(sensor_id=sensor_id, saved__gte=date_from, saved__lte=date_to).order_by(
-            SAVED_ASC)
+        sensor = models.Silo.objects.filter(id=silo_id).first().sensor
+        rows = retention.Readings(sensor, date_from, date_to).rows([CSV_COLUMNS[column] for column in columns])
+        content = _stream_csv(rows, [column in CSV_DATE_COLUMNS for column in columns])
 
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = f'attachment; filename="measurements.csv"'
-        writer = csv.writer(response, delimiter=';')
+        if compress:
+            response = StreamingHttpResponse(_gzip_stream(content), content_type='application/gzip')
+            response['Content-Disposition'] = f'attachment; filename="measurements.csv.gz"'
+        else:
+            response = StreamingHttpResponse(content, content_type='text/csv')
+            response['Content-Disposition'] = f'attachment; filename="measurements.csv"'
+        return response
 
-        for measure in measures:
-            writer.writerow([measure.saved.strftime(time_format_in_csv), measure.value])
 
-        return response
+class MetricsView(APIView):
+    '''
+    Query count, database time, render time, latency and response size histograms per endpoint,
+    collected by this process since it started or the metrics were reset
+    '''
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request):
+        return Response(metrics.registry.report())
+
+    def delete(self, request):
+        metrics.registry.reset()
+        return Response(status=status.HTTP_204_NO_CONTENT)
@@ -47,6 +47,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -91,6 +92,14 @@ if os.getenv('ENVIRONMENT') == 'PIPELINE':
             'PASSWORD': ''
         }
     }
+elif os.getenv('ENVIRONMENT') == 'SQLITE':
+    # runs the tests (in memory) and the app without the Postgres service of docker-compose.yml
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        }
+    }
 else:
     DATABASES = {
         'default': {
@@ -151,7 +160,7 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.IsAuthenticated',
     ),
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     )
 }
 
@@ -161,6 +170,58 @@ FCM_DJANGO_SETTINGS = {
    "FCM_SERVER_KEY": os.getenv("SILO_FCM_SERVER_KEY")
 }
 
+# Graph and silo list responses are cached in the `responses` cache for RESPONSE_CACHE_TIMEOUT seconds and invalidated
+# when new measurements arrive. The local memory cache is per process, use a shared backend (e.g. file based) when
+# running several workers.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'responses': {
+        'BACKEND': os.getenv('SILO_RESPONSE_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('SILO_RESPONSE_CACHE_LOCATION', 'silo-responses'),
+    },
+}
+RESPONSE_CACHE = 'responses'
+RESPONSE_CACHE_TIMEOUT = 60
+
+# Seconds sensors, their silos and geometries are cached per process (for at most SILO_CACHE_SIZE sensors), saving
+# a sensor or a silo clears the cache of the process doing it
+SILO_CACHE_TTL = 300
+SILO_CACHE_SIZE = 10000
+
+# Seconds the users of tokens are cached per process (for at most TOKEN_CACHE_SIZE tokens), other processes accept
+# a deleted token for up to this long
+TOKEN_CACHE_TTL = 300
+TOKEN_CACHE_SIZE = 10000
+
+# Opt-in write-behind buffer of `POST /measurement/` (see `api.ingestion.get_buffer`): `memory` or `file` (appended
+# to a journal in INGESTION_BUFFER_DIRECTORY first, synced to disk if INGESTION_BUFFER_FSYNC). The readings are
+# stored in one transaction every INGESTION_BUFFER_DELAY_MS milliseconds or once INGESTION_BUFFER_ROWS are waiting.
+# With INGESTION_BUFFER_ACK `committed` the request waits up to INGESTION_BUFFER_TIMEOUT seconds until its reading
+# is stored (right away if no other reading is waiting), with `accepted` it is answered once the reading is buffered.
+INGESTION_BUFFER = os.getenv("SILO_INGESTION_BUFFER")
+INGESTION_BUFFER_ACK = os.getenv("SILO_INGESTION_BUFFER_ACK", "committed")
+INGESTION_BUFFER_ROWS = int(os.getenv("SILO_INGESTION_BUFFER_ROWS", "500"))
+INGESTION_BUFFER_DELAY_MS = int(os.getenv("SILO_INGESTION_BUFFER_DELAY_MS", "50"))
+INGESTION_BUFFER_DIRECTORY = os.getenv("SILO_INGESTION_BUFFER_DIRECTORY", os.path.join(BASE_DIR, 'ingestion-journal'))
+INGESTION_BUFFER_FSYNC = os.getenv("SILO_INGESTION_BUFFER_FSYNC", "true") == "true"
+INGESTION_BUFFER_TIMEOUT = 30
+
+# Sends the queued push notifications, see `python manage.py send_notifications`
+NOTIFICATION_SENDER = os.getenv("SILO_NOTIFICATION_SENDER", "api.notifications.FCMSender")
+
+# Requests exceeding these budgets are logged, METRICS_ENDPOINT_BUDGETS overrides them per endpoint
+# (e.g. {"MeasurementViewSet.all_values_for_silo": {"latency_ms": 10000}}). The metrics of every endpoint are
+# available at /metrics/ for administrators and dumped to METRICS_DUMP_FILE every METRICS_DUMP_INTERVAL seconds.
+METRICS_BUDGET = {
+    "queries": int(os.getenv("SILO_METRICS_QUERY_BUDGET", "50")),
+    "latency_ms": int(os.getenv("SILO_METRICS_LATENCY_BUDGET", "1000")),
+}
+METRICS_ENDPOINT_BUDGETS = {}
+METRICS_DUMP_FILE = os.getenv("SILO_METRICS_FILE")
+METRICS_DUMP_INTERVAL = 60
+
 CORS_ORIGIN_WHITELIST = [
     "http://localhost:3000",
     "http://127.0.0.1:3000",
@@ -20,7 +20,7 @@ from fcm_django.api.rest_framework import FCMDeviceAuthorizedViewSet
 from rest_framework import routers
 from rest_framework.authtoken.views import obtain_auth_token
 
-from api.views import SiloViewSet, SensorViewSet, MeasurementViewSet, NotificationViewSet
+from api.views import SiloViewSet, SensorViewSet, MeasurementViewSet, NotificationViewSet, MetricsView
 
 router = routers.DefaultRouter()
 router.register(r'silo', SiloViewSet)
@@ -33,4 +33,5 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     url(r'^', include(router.urls)),
     url(r'^auth/', obtain_auth_token),
+    url(r'^metrics/$', MetricsView.as_view(), name='metrics'),
 ]